@@ -142,6 +142,14 @@ class Categorical(ExponentialFamily):
                 moments, 
                 cls._parent_moments)
 
+    def _prune_self(self, axis, keep):
+        if axis == -1:
+            # Remove categories
+            D = np.count_nonzero(keep)
+            self._distribution = CategoricalDistribution(D)
+            self._moments = CategoricalMoments(D)
+        super()._prune_self(axis, keep)
+
     def random(self):
         logp = self.phi[0]
         logp -= np.amax(logp, axis=-1, keepdims=True)
@@ -27,7 +27,7 @@ from .deterministic import Deterministic
 from .expfamily import ExponentialFamily, \
                        ExponentialFamilyDistribution, \
                        useconstructor
-from .node import Moments, \
+from .node import Moments, message_sum_multiply, \
                   ensureparents
 from .categorical import CategoricalMoments
 from .dirichlet import Dirichlet, \
@@ -39,8 +39,9 @@ class CategoricalMarkovChainMoments(Moments):
 
     ndim_observations = 0
 
-    def __init__(self, categories):
+    def __init__(self, categories, offsets=None):
         self.D = categories
+        self.offsets = offsets
 
     def converter(self, moments_class):
         """
@@ -66,15 +67,38 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
     ndims = (1, 3)
     ndims_parents = ( (1,), (1,) )
 
-    def __init__(self, categories, states):
+    def __init__(self, categories, states, transitions=None):
         self.K = categories
         self.N = states
+        if transitions is None:
+            self.offsets = None
+            self.allowed = None
+        else:
+            transitions = np.asarray(transitions, dtype=bool)
+            if np.shape(transitions) != (categories, categories):
+                raise ValueError("The mask of allowed transitions has shape "
+                                 "%s but it should be %s"
+                                 % (np.shape(transitions),
+                                    (categories, categories)))
+            (i, j) = np.nonzero(transitions)
+            self.offsets = np.unique(j - i)
+            self.allowed = utils.dense_to_banded(transitions, 
+                                                 self.offsets,
+                                                 fill=False)
 
     def compute_message_to_parent(self, parent, index, u, u_p0, u_P):
         if index == 0:
             return [ u[0] ]
         elif index == 1:
-            return [ u[1] ]
+            # If the same transition matrix is used for all time instances,
+            # this sums over time directly.  The banded messages are expanded
+            # only after the sum.
+            m = message_sum_multiply(parent.plates,
+                                     np.shape(u[1])[-1:],
+                                     u[1])
+            if self.offsets is not None:
+                m = utils.banded_to_dense(m, self.offsets)
+            return [m]
         else:
             raise ValueError("Parent index out of bounds")
 
@@ -90,13 +114,23 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
 
     def compute_phi_from_parents(self, u_p0, u_P, mask=True):
         phi0 = u_p0[0]
-        phi1 = u_P[0] * np.ones((self.N-1,self.K,self.K))
+        # Time-homogeneous transition probabilities are not copied for each
+        # time instance but broadcasted in the recursion
+        if self.offsets is None:
+            phi1 = u_P[0]
+        else:
+            # Keep only the diagonals which contain allowed transitions
+            phi1 = utils.dense_to_banded(u_P[0], self.offsets)
         return [phi0, phi1]
 
     def compute_moments_and_cgf(self, phi, mask=True):
         logp0 = phi[0]
         logP = phi[1]
-        (z0, zz, cgf) = random.alpha_beta_recursion(logp0, logP)
+        if self.offsets is not None:
+            logP = np.where(self.allowed, logP, -np.inf)
+        (z0, zz, cgf) = random.alpha_beta_recursion(logp0, logP,
+                                                    offsets=self.offsets,
+                                                    states=self.N)
         u = [z0, zz]
         return (u, cgf)
 
@@ -127,17 +161,36 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
         return (M+1,)
         
 class CategoricalMarkovChain(ExponentialFamily):
+    """
+    Node for categorical Markov chain random variables.
+
+    Parameters
+    ----------
+    p0 : Dirichlet-like node or (...,K)-array
+        Initial state probabilities
+    P : Dirichlet-like node or (...,N-1,K,K)-array
+        State transition probabilities
+    states : int, optional
+        The length of the chain, if it can not be inferred from P
+    transitions : (K,K)-array of bools, optional
+        Mask of allowed state transitions.  If given, the node stores only
+        the diagonals of the transition matrices that contain allowed
+        transitions, and the cost of the forward-backward recursion is
+        proportional to the number of these elements.  This is efficient for
+        left-to-right and other banded topologies.
+    """
     
     _parent_moments = (DirichletMoments(),
                        DirichletMoments())
 
     @useconstructor
-    def __init__(self, p0, P, states=None, **kwargs):
+    def __init__(self, p0, P, states=None, transitions=None, **kwargs):
         super().__init__(p0, P, **kwargs)
 
     @classmethod
     @ensureparents
-    def _constructor(cls, p0, P, states=None, plates=None, **kwargs):
+    def _constructor(cls, p0, P, states=None, transitions=None, plates=None,
+                     **kwargs):
 
         # Number of categories
         D = p0.dims[0][0]
@@ -168,10 +221,17 @@ class CategoricalMarkovChain(ExponentialFamily):
         if len(P.plates) < 1 or P.plates[-1] != D:
             raise ValueError("Transition probability matrix is not square")
 
-        dims = ( (D,), (N-1,D,D) )
+        distribution = CategoricalMarkovChainDistribution(
+            D,
+            N,
+            transitions=transitions)
+        moments = CategoricalMarkovChainMoments(D,
+                                                offsets=distribution.offsets)
 
-        distribution = CategoricalMarkovChainDistribution(D, N)
-        moments = CategoricalMarkovChainMoments(D)
+        if distribution.offsets is None:
+            dims = ( (D,), (N-1,D,D) )
+        else:
+            dims = ( (D,), (N-1,D,len(distribution.offsets)) )
         parent_moments = cls._parent_moments
 
         return (dims, 
@@ -190,6 +250,7 @@ class CategoricalMarkovChainToCategorical(Deterministic):
         Z = Z._convert(CategoricalMarkovChainMoments)
         K = Z.dims[0][-1]
         dims = ( (K,), )
+        self.offsets = Z._moments.offsets
         self._moments = CategoricalMoments(K)
         self._parent_moments = (CategoricalMarkovChainMoments(K),)
         super().__init__(Z, dims=dims, **kwargs)
@@ -199,7 +260,10 @@ class CategoricalMarkovChainToCategorical(Deterministic):
         p0 = u_Z[0][...,None,:]
         # Sum joint probability arrays to marginal probability vectors
         zz = u_Z[1]
-        p = np.sum(zz, axis=-2)
+        if self.offsets is None:
+            p = np.sum(zz, axis=-2)
+        else:
+            p = utils.banded_column_sum(zz, self.offsets)
 
         # Broadcast p0 and p to same shape, except the time axis
         plates_p0 = np.shape(p0)[:-2]
@@ -215,7 +279,11 @@ class CategoricalMarkovChainToCategorical(Deterministic):
 
     def _compute_message_to_parent(self, index, m, u_Z):
         m0 = m[0][...,0,:]
-        m1 = m[0][...,1:,None,:]
+        if self.offsets is None:
+            m1 = m[0][...,1:,None,:]
+        else:
+            (cols, _) = utils.band_indices(self.dims[0][-1], self.offsets)
+            m1 = m[0][...,1:,cols]
         return [m0, m1]
     
     def _compute_mask_to_parent(self, index, mask):
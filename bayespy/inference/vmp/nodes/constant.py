@@ -42,3 +42,11 @@ class Constant(Node):
 
     def get_moments(self):
         return self.u
+
+    def _moments_stamp(self):
+        return (self._version,) + tuple(id(ui) for ui in self.u)
+
+    def _prune_self(self, axis, keep):
+        if axis is not None:
+            self.u = self._prune_moments(self.u, axis, keep)
+        super()._prune_self(axis, keep)
@@ -56,8 +56,36 @@ class Deterministic(Node):
         super().__init__(*args, plates=None, notify_parents=False, **kwargs)
 
     def get_moments(self):
+        # Reuse the cached moments if the parents have not changed
+        stamp = self._moments_stamp()
+        cached = getattr(self, '_moments_cache', None)
+        if stamp is not None and cached is not None and cached[0] == stamp:
+            return list(cached[1])
         u_parents = self._message_from_parents()
-        return self._compute_moments(*u_parents)
+        u = self._compute_moments(*u_parents)
+        if stamp is not None:
+            self._moments_cache = (stamp, list(u))
+        return u
+
+    def _moments_stamp(self):
+        stamps = self._parent_stamps()
+        if stamps is None:
+            return None
+        return (self._version, stamps)
+
+    def _message_stamp_to_parent(self, index):
+        stamps = self._parent_stamps(exclude=index)
+        if stamps is None:
+            return None
+        # The message depends on the messages from the children
+        children = []
+        for (child, ind) in self.children:
+            stamp = child._message_stamp_to_parent(ind)
+            if stamp is None:
+                return None
+            children.append((id(child), ind, stamp))
+        children.sort(key=lambda child: child[:2])
+        return (self._version, stamps, tuple(children))
 
     def _compute_message_and_mask_to_parent(self, index, m_children, *u_parents):
         # The following methods should be implemented by sub-classes.
@@ -128,6 +156,23 @@ class Deterministic(Node):
         # contribuion is zero.
         return 0
 
+    def _lower_bound_stamp(self):
+        return ()
+
+    def _prune_axis_to_parent(self, index, axis):
+        # Sub-classes which support pruning should implement this
+        raise NotImplementedError("Pruning is not implemented for %s nodes"
+                                  % self.__class__.__name__)
+
+    def _prune_from_parent(self, index, axis, keep, plan):
+        # Sub-classes which support pruning should implement this
+        raise NotImplementedError("Pruning is not implemented for %s nodes"
+                                  % self.__class__.__name__)
+
+    def _prune_self(self, axis, keep):
+        super()._prune_self(axis, keep)
+        self._moments_cache = None
+
 def tile(X, tiles):
     """
     Tile the plates of the input node.
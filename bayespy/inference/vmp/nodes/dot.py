@@ -94,11 +94,22 @@ class SumMultiply(Deterministic):
 
     because the third axis ('c') could be summed out already in the first
     operation. This same effect applies also to numpy.einsum in general.
+
+    Internally, the sum-products are contracted pairwise in a greedily chosen
+    order, and pairs which form (batched) matrix products, for instance,
+    inner products and matrix-vector products over the plates, are computed
+    with BLAS.  See bayespy.utils.utils.einsum_path.
     """
 
-    def __init__(self, *args, iterator_axis=None, **kwargs):
+    def __init__(self, *args, iterator_axis=None, max_bytes=None, **kwargs):
         """
         SumMultiply(Node1, map1, Node2, map2, ..., NodeN, mapN [, map_out])
+
+        If `max_bytes` is given, the sum-products for the moments and the
+        messages are computed in chunks so that no intermediate array is
+        larger than `max_bytes`.  The chunks are taken along the longest
+        axes, typically plates, and the results are either concatenated or
+        summed.
         """
 
         args = list(args)
@@ -236,6 +247,10 @@ class SumMultiply(Deterministic):
         self.in_keys = [ [full_keyset.index(key) for key in keyset]
                          for keyset in keysets ]
 
+        # Contraction orders of the sum-products for each shape signature
+        self._einsum_paths = {}
+        self.max_bytes = max_bytes
+
         super().__init__(*nodes,
                          dims=(tuple(dim0),tuple(dim1)),
                          **kwargs)
@@ -267,7 +282,7 @@ class SumMultiply(Deterministic):
         u0 = [u[0] for u in u_parents]
         
         args = utils.zipper_merge(u0, in_all_keys) + [out_all_keys]
-        x0 = np.einsum(*args)
+        x0 = self._einsum(*args)
 
         #
         # Compute the covariance
@@ -282,19 +297,95 @@ class SumMultiply(Deterministic):
                                                            self.in_keys)]
         u1 = [u[1] for u in u_parents]
         args = utils.zipper_merge(u1, in_all_keys) + [out_all_keys]
-        x1 = np.einsum(*args)
+        x1 = self._einsum(*args)
 
         return [x0, x1]
 
 
+    def _einsum(self, *args):
+        """
+        Compute einsum by contracting the operands pairwise.
+
+        The contraction order is planned once for each signature of the
+        shapes and keys of the operands and then reused.
+        """
+        keys_out = args[-1]
+        (operands, keys_in) = utils.expand_implicit_arrays(args[:-1:2],
+                                                           args[1:-1:2])
+        shapes = [np.shape(x) for x in operands]
+        signature = (tuple(shapes),
+                     tuple(tuple(keys) for keys in keys_in),
+                     tuple(keys_out))
+        try:
+            path = self._einsum_paths[signature]
+        except KeyError:
+            path = utils.einsum_path(shapes, keys_in, keys_out)
+            self._einsum_paths[signature] = path
+
+        if self.max_bytes is not None:
+            itemsize = np.result_type(*operands).itemsize
+            nbytes = itemsize * utils.einsum_path_size(path, shapes, keys_in)
+            if nbytes > self.max_bytes:
+                return self._chunked_einsum(path, operands, keys_in, keys_out,
+                                            nbytes)
+
+        return utils.einsum_with_path(path, operands, keys_in, keys_out)
+
+    def _chunked_einsum(self, path, operands, keys_in, keys_out, nbytes):
+        """
+        Compute einsum in chunks along the longest axis.
+        """
+
+        sizes = {}
+        for (x, keys) in zip(operands, keys_in):
+            for (key, size) in zip(keys, np.shape(x)):
+                sizes[key] = max(sizes.get(key, 1), size)
+        key = max(sizes, key=lambda k: sizes[k]) if sizes else None
+        if key is None or sizes[key] == 1:
+            # Nothing to split
+            return utils.einsum_with_path(path, operands, keys_in, keys_out)
+
+        N = sizes[key]
+        chunks = min(N, int(np.ceil(nbytes / self.max_bytes)))
+        limits = np.linspace(0, N, chunks+1).astype(int)
+
+        y = None
+        for (start, end) in zip(limits[:-1], limits[1:]):
+            # Slice the operands which have the axis
+            sliced = []
+            for (x, keys) in zip(operands, keys_in):
+                if key in keys and np.shape(x)[keys.index(key)] > 1:
+                    index = [slice(None)] * np.ndim(x)
+                    index[keys.index(key)] = slice(start, end)
+                    x = x[tuple(index)]
+                sliced.append(x)
+            y_chunk = self._einsum(*(utils.zipper_merge(sliced, keys_in) 
+                                     + [keys_out]))
+            if key in keys_out:
+                # Concatenate along the axis
+                if y is None:
+                    y = np.empty(tuple(sizes[k] for k in keys_out),
+                                 dtype=y_chunk.dtype)
+                index = [slice(None)] * len(keys_out)
+                index[list(keys_out).index(key)] = slice(start, end)
+                y[tuple(index)] = y_chunk
+            else:
+                # Sum over the axis
+                if y is None:
+                    y = y_chunk
+                else:
+                    y = y + y_chunk
+
+        return y
+
     def get_parameters(self):
         # Compute mean and variance
         u = self.get_moments()
-        u[1] -= u[0]**2
+        u[1] = u[1] - u[0]**2
         return u
         
 
-    def _message_to_parent(self, index):
+    def _get_message_to_parent(self, index):
         """
         Compute the message and mask to a parent node.
         """
@@ -424,7 +515,7 @@ class SumMultiply(Deterministic):
             args.append(parent_keys)
 
             # THE BEEF: Compute the message
-            msg[ind] = np.einsum(*args)
+            msg[ind] = self._einsum(*args)
 
             # Find the correct shape for the message array
             message_shape = list(np.shape(msg[ind]))
@@ -456,6 +547,52 @@ class SumMultiply(Deterministic):
         
         return msg
 
+    def _prune_axis_to_parent(self, index, axis):
+        if axis is None:
+            return None
+        parent = self.parents[index]
+        keys = self.in_keys[index]
+        if axis < -len(self.out_keys):
+            # Plate axis
+            axis = axis + len(self.out_keys)
+            if -axis > len(parent.plates) or parent.plates[axis] == 1:
+                return None
+            return axis - len(keys)
+        # Output axis
+        key = self.out_keys[axis]
+        if key not in keys:
+            return None
+        pos = keys.index(key)
+        if parent.dims[0][pos] == 1:
+            return None
+        return pos - len(keys)
+
+    def _prune_from_parent(self, index, axis, keep, plan):
+        if axis is None:
+            return
+        keys = self.in_keys[index]
+        if axis < -len(keys):
+            # Plate axis
+            self._prune_plan(axis + len(keys) - len(self.out_keys), keep, plan)
+            return
+        key = keys[axis]
+        if key in self.out_keys:
+            pos = self.out_keys.index(key)
+            self._prune_plan(pos - len(self.out_keys), keep, plan)
+            return
+        # The axis is summed over so the other nodes using the same key are
+        # pruned but the output does not change shape
+        if self in plan:
+            return
+        plan[self] = None
+        for (ind, parent) in enumerate(self.parents):
+            if ind != index and key in self.in_keys[ind]:
+                pos = self.in_keys[ind].index(key)
+                if parent.dims[0][pos] != 1:
+                    parent._prune_plan(pos - len(self.in_keys[ind]),
+                                       keep,
+                                       plan)
+
 def Dot(*args, **kwargs):
     """
     Node for computing inner product of several Gaussian vectors.
@@ -22,11 +22,15 @@
 ######################################################################
 
 import numpy as np
+import h5py
 
 from bayespy.utils import utils
 
 from .stochastic import Stochastic, Distribution
 
+# Default number of plates in the blocks read from out-of-core observations
+OUT_OF_CORE_BLOCK_SIZE = 2**16
+
 class ExponentialFamilyDistribution(Distribution):
     """
     Sub-classes implement distribution specific computations.
@@ -175,6 +179,7 @@ class ExponentialFamily(Stochastic):
 
             # Update natural parameters using parents
             self._update_phi_from_parents(*u_parents)
+            self._store_phi_from_parents()
 
             # Update moments
             mask = np.logical_not(self.observed)
@@ -228,7 +233,7 @@ class ExponentialFamily(Stochastic):
         # This makes correct broadcasting
         self.phi = self._distribution.compute_phi_from_parents(*u_parents)
         #self.phi = self._compute_phi_from_parents(*u_parents)
-        self.phi = list(self.phi)
+        self.phi = [utils.astype(phi, self.dtype) for phi in self.phi]
         # Make sure phi has the correct number of axes. It makes life
         # a bit easier elsewhere.
         for i in range(len(self.phi)):
@@ -250,15 +255,78 @@ class ExponentialFamily(Stochastic):
                                     np.shape(self.phi[i]),
                                     self.get_shape(i)))
 
+    def _store_phi_from_parents(self):
+        """
+        Store the natural parameters from the parents for the lower bound.
+
+        The stored parameters are reused by `lower_bound_contribution` as long
+        as the moments of the parents do not change.
+        """
+        stamps = self._parent_stamps()
+        if stamps is not None:
+            self._phi_from_parents = (stamps, list(self.phi))
+
+    def _get_phi_and_cgf_from_parents(self):
+        """
+        Return the natural parameters and the CGF from the parents.
+
+        Values computed for the current moments of the parents are reused.
+        """
+        stamps = self._parent_stamps()
+        phi = getattr(self, '_phi_from_parents', None)
+        cgf = getattr(self, '_cgf_from_parents', None)
+        if stamps is not None and phi is not None and phi[0] == stamps:
+            phi = phi[1]
+        else:
+            phi = None
+        if stamps is not None and cgf is not None and cgf[0] == stamps:
+            cgf = cgf[1]
+        else:
+            cgf = None
+        if phi is None or cgf is None:
+            u_parents = self._message_from_parents()
+            if phi is None:
+                phi = self._distribution.compute_phi_from_parents(*u_parents)
+                if stamps is not None:
+                    self._phi_from_parents = (stamps, list(phi))
+            if cgf is None:
+                cgf = self._distribution.compute_cgf_from_parents(*u_parents)
+                if stamps is not None:
+                    self._cgf_from_parents = (stamps, cgf)
+        return (phi, cgf)
+
+    def _lower_bound_stamp(self):
+        stamps = self._parent_stamps()
+        if stamps is None:
+            return None
+        return (self._moments_stamp(), stamps)
+
     def _set_moments_and_cgf(self, u, g, mask=True):
         self._set_moments(u, mask=mask)
         # TODO/FIXME: Apply mask to g too!!
         self.g = g
 
+    def set_dtype(self, dtype):
+        super().set_dtype(dtype)
+        self.phi = [utils.astype(phi, self.dtype) for phi in self.phi]
+
+    def _prune_self(self, axis, keep):
+        if axis is not None:
+            self.phi = self._prune_moments(self.phi, axis, keep)
+            self.g = self._prune_plates(self.g, axis, keep)
+            self.f = self._prune_plates(self.f, axis, keep)
+        super()._prune_self(axis, keep)
+        self._phi_from_parents = None
+        self._cgf_from_parents = None
+        # Recompute the moments of the remaining components
+        if axis is not None and not np.all(self.observed):
+            self._update_moments_and_cgf()
+
     def _update_distribution_and_lowerbound(self, m_children, *u_parents):
 
         # Update phi first from parents..
         self._update_phi_from_parents(*u_parents)
+        self._store_phi_from_parents()
         # .. then just add children's message
         for i in range(len(self.phi)):
             self.phi[i] = self.phi[i] + m_children[i]
@@ -266,6 +334,37 @@ class ExponentialFamily(Stochastic):
         # Update u and g
         self._update_moments_and_cgf()
 
+    def update_natural_gradient(self, step, multipliers=None):
+        """
+        Take a natural gradient step for the natural parameters.
+
+        In conjugate exponential family models, the natural gradient of the
+        lower bound with respect to the natural parameters is the difference
+        between the standard VB update and the current natural parameters.
+        Thus, a unit step length corresponds to the standard VB update.
+
+        Parameters
+        ----------
+        step : float
+            Step length, in (0, 1].
+        multipliers : dict, optional
+            Scalar multipliers for the messages from some children (child node
+            -> multiplier), for instance, for scaling mini-batch messages.
+        """
+        if np.all(self.observed):
+            return
+        if step <= 0 or step > 1:
+            raise ValueError("Step length must be in (0, 1], got %s" % step)
+        phi_old = self.phi
+        u_parents = self._message_from_parents()
+        m_children = self._message_from_children(multipliers=multipliers)
+        self._update_phi_from_parents(*u_parents)
+        self._store_phi_from_parents()
+        for i in range(len(self.phi)):
+            self.phi[i] = ((1 - step) * phi_old[i] 
+                           + step * (self.phi[i] + m_children[i]))
+        self._update_moments_and_cgf()
+
     def _update_moments_and_cgf(self):
         """
         Update moments and cgf based on current phi.
@@ -282,11 +381,23 @@ class ExponentialFamily(Stochastic):
     def observe(self, x, mask=True):
         """
         Fix moments, compute f and propagate mask.
+
+        If `x` is a `np.memmap` or a `h5py.Dataset`, the moments are not
+        stored but computed from the data in blocks of plates (see
+        `message_block_size`) when the messages and the lower bound are
+        computed.  Such observations must not have missing values.
         """
 
+        if (isinstance(x, (np.memmap, h5py.Dataset)) 
+            and len(self.plates) > 0):
+            self._observe_out_of_core(x, mask=mask)
+            return
+
+        self._observation = None
+
         # Compute fixed moments
-        (u, f) = self._distribution.compute_fixed_moments_and_f(np.asanyarray(x),
-                                                                mask=mask)
+        x = utils.astype(x, self.dtype)
+        (u, f) = self._distribution.compute_fixed_moments_and_f(x, mask=mask)
 
         # Check the dimensionality of the observations
         for (i,v) in enumerate(u):
@@ -310,15 +421,86 @@ class ExponentialFamily(Stochastic):
         self.observed = mask
         self._update_mask()
 
+    def _observe_out_of_core(self, x, mask=True):
+        """
+        Observe data which is read in blocks when needed.
+        """
+        if not np.all(mask):
+            raise ValueError("Out-of-core observations can not have missing "
+                             "values")
+        shape = self.plates + self._distribution.shape_of_value(self.dims)
+        if tuple(x.shape) != shape:
+            raise ValueError("Shape of the observations %s does not match "
+                             "the expected shape %s"
+                             % (tuple(x.shape), shape))
+        if self.message_block_size is None:
+            self.message_block_size = OUT_OF_CORE_BLOCK_SIZE
+        self._observation = x
+        self._version += 1
+        self.observed = True
+        self._update_mask()
+
+    def _get_moments_and_f_block(self, axis=None, start=None, end=None):
+        """
+        Compute the moments and f of the out-of-core observations for the
+        block `start:end` of a plate axis.
+
+        All the observations are read only if they fit in one block.
+        """
+        x = self._observation
+        if axis is None:
+            if np.prod(self.plates) > self.message_block_size:
+                raise ValueError("The out-of-core observations of %s can not "
+                                 "be read at once, thus the messages to the "
+                                 "parents must be computable in blocks"
+                                 % self.name)
+            x = x[...]
+        else:
+            ndim = len(x.shape) - len(self.plates)
+            x = utils.take_block(x, axis - ndim, start, end)
+        return self._distribution.compute_fixed_moments_and_f(np.asarray(x))
+
+    def get_moments(self):
+        if self._observation is not None:
+            raise ValueError("The moments of the out-of-core observations of "
+                             "%s are not stored" % self.name)
+        return super().get_moments()
+
+    def _get_moments_block(self, axis=None, start=None, end=None):
+        if self._observation is None:
+            return super()._get_moments_block(axis, start, end)
+        (u, f) = self._get_moments_and_f_block(axis, start, end)
+        return u
+
+    def _lower_bound_out_of_core(self):
+        """
+        Compute the lower bound term of out-of-core observations in blocks.
+        """
+        (phi, g) = self._get_phi_and_cgf_from_parents()
+        axis = -len(self.plates)
+        limits = self._block_limits(self.plates, axis)
+        L = 0
+        for (start, end) in zip(limits[:-1], limits[1:]):
+            (u, f) = self._get_moments_and_f_block(axis, start, end)
+            L_block = utils.take_block(g, axis, start, end) + f
+            for (phi_i, u_i, dims) in zip(phi, u, self.dims):
+                phi_i = utils.take_block(phi_i, axis - len(dims), start, end)
+                axis_sum = tuple(range(-len(dims),0))
+                L_block = L_block + np.sum(phi_i * u_i, axis=axis_sum)
+            plates = (end - start,) + self.plates[1:]
+            L = L + (np.sum(L_block, dtype=np.float64)
+                     * self._plate_multiplier(plates, np.shape(L_block)))
+        return L
+
     def lower_bound_contribution(self, gradient=False):
         # Compute E[ log p(X|parents) - log q(X) ] over q(X)q(parents)
+
+        if self._observation is not None:
+            return self._lower_bound_out_of_core()
         
-        # Messages from parents
-        #u_parents = [parent.message_to_child() for parent in self.parents]
-        u_parents = self._message_from_parents()
-        phi = self._distribution.compute_phi_from_parents(*u_parents)
-        # G from parents
-        L = self._distribution.compute_cgf_from_parents(*u_parents)
+        # Phi and G from parents (reuse the values from the update if the
+        # parents have not changed)
+        (phi, L) = self._get_phi_and_cgf_from_parents()
         # L = g
         # G for unobserved variables (ignored variables are handled
         # properly automatically)
@@ -338,12 +520,12 @@ class ExponentialFamily(Stochastic):
 
             # Compute the term
             phi_q = np.where(latent_mask_i, phi_q, 0)
-            # TODO/FIXME: Use einsum here?
-            Z = np.sum((phi_p-phi_q) * u_q, axis=axis_sum)
+            Z = utils.sum_multiply(phi_p-phi_q, u_q, axis=axis_sum)
 
             L = L + Z
 
-        return (np.sum(np.where(self.mask, L, 0))
+        # Sum over the plates in double precision
+        return (np.sum(np.where(self.mask, L, 0), dtype=np.float64)
                 * self._plate_multiplier(self.plates,
                                          np.shape(L),
                                          np.shape(self.mask)))
@@ -149,8 +149,13 @@ class _GammaToDiagonalWishart(Deterministic):
     ndims = (2, 0)
     ndims_parents = [None, (2, 0)]
 
+    _parent_moments = (GammaMoments(),)
+
     def __init__(self, alpha, **kwargs):
 
+        from .wishart import WishartMoments
+        self._moments = WishartMoments()
+
         # Check for constant
         if utils.is_numeric(alpha):
             alpha = Constant(Gamma)(alpha)
@@ -186,14 +191,15 @@ class _GammaToDiagonalWishart(Deterministic):
         u = self.parents[0].get_moments()
 
         # Form a diagonal matrix from the gamma variables
-        return [np.identity(self.dims[0][0]) * u[0][...,np.newaxis],
+        D = self.dims[0][0]
+        return [utils.DiagonalMatrix(u[0] * np.ones(D)),
                 np.sum(u[1], axis=(-1))]
 
     @staticmethod
     def _compute_message_to_parent(index, m_children, *u_parents):
 
         # Take the diagonal
-        m0 = np.einsum('...ii->...i', m_children[0])
+        m0 = utils.get_diag(m_children[0])
         m1 = np.reshape(m_children[1], np.shape(m_children[1]) + (1,))
 
         return [m0, m1]
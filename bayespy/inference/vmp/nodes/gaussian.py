@@ -32,6 +32,7 @@ from .expfamily import ExponentialFamilyDistribution
 from .expfamily import useconstructor
 from .wishart import Wishart, WishartMoments
 from .gamma import Gamma, GammaMoments
+from .stochastic import Stochastic
 from .deterministic import Deterministic
 
 from .node import Moments, ensureparents
@@ -44,7 +45,7 @@ class GaussianMoments(Moments):
     def compute_fixed_moments(self, x):
         """ Compute Gaussian moments for fixed x. """
         x = utils.utils.atleast_nd(x, self.ndim)
-        return [x, utils.linalg.outer(x, x, ndim=self.ndim)]
+        return [x, utils.utils.OuterProduct(x, ndim=self.ndim)]
 
     def compute_dims_from_values(self, x):
         x = utils.utils.atleast_nd(x, self.ndim)
@@ -76,16 +77,23 @@ class GaussianDistribution(ExponentialFamilyDistribution):
                 -0.5 * u_Lambda[0]]
 
     def compute_moments_and_cgf(self, phi, mask=True):
-        # TODO: Compute -2*phi[1] and simplify the formulas
-        L = utils.utils.m_chol(-2*phi[1])
-        k = np.shape(phi[0])[-1]
+        if isinstance(phi[1], utils.utils.DiagonalMatrix):
+            # Diagonal precision matrix, no need for Cholesky
+            d = -2 * phi[1].d
+            u0 = phi[0] / d
+            u1 = utils.utils.m_outer(u0, u0) + utils.utils.diag(1/d)
+            g = (-0.5 * np.einsum('...i,...i', u0, phi[0])
+                 + 0.5 * np.sum(np.log(d), axis=-1))
+            return ([u0, u1], g)
+        # Factorize all the precision matrices at once
+        L = utils.linalg.Cholesky(-2*phi[1])
         # Moments
-        u0 = utils.utils.m_chol_solve(L, phi[0])
-        u1 = utils.utils.m_outer(u0, u0) + utils.utils.m_chol_inv(L)
+        u0 = L.solve(phi[0])
+        u1 = utils.utils.m_outer(u0, u0) + L.inv()
         u = [u0, u1]
         # G
         g = (-0.5 * np.einsum('...i,...i', u[0], phi[0])
-             + 0.5 * utils.utils.m_chol_logdet(L))
+             + 0.5 * L.logdet())
              #+ 0.5 * np.log(2) * self.dims[0][0])
         return (u, g)
 
@@ -94,14 +102,14 @@ class GaussianDistribution(ExponentialFamilyDistribution):
         mumu = u_mu[1]
         Lambda = u_Lambda[0]
         logdet_Lambda = u_Lambda[1]
-        g = (-0.5 * np.einsum('...ij,...ij',mumu,Lambda)
+        g = (-0.5 * utils.utils.sum_multiply(mumu, Lambda, axis=(-1,-2))
              + 0.5 * logdet_Lambda)
         return g
 
     def compute_fixed_moments_and_f(self, x, mask=True):
         """ Compute u(x) and f(x) for given x. """
         k = np.shape(x)[-1]
-        u = [x, utils.utils.m_outer(x,x)]
+        u = [x, utils.utils.OuterProduct(x, ndim=1)]
         f = -k/2*np.log(2*np.pi)
         return (u, f)
 
@@ -274,11 +282,11 @@ class Gaussian(ExponentialFamily):
         # observed/fixed elements!
 
         # Note that phi[1] is -0.5*inv(Cov)
-        U = utils.utils.m_chol(-2*self.phi[1])
+        U = utils.linalg.chol(-2*self.phi[1])
         mu = self.u[0]
         z = np.random.normal(0, 1, self.get_shape(0))
         # Compute mu + U'*z
-        z = utils.utils.m_solve_triangular(U, z, trans='T', lower=False)
+        z = utils.linalg.solve_triangular(U, z, trans='T', lower=False)
         return mu + z
             
 
@@ -330,6 +338,7 @@ class Gaussian(ExponentialFamily):
             self.u[0] = mvdot(R, self.u[0])
             self.u[1] = dot(R, self.u[1], R.T)
             self.g -= logdetR
+            self._version += 1
 
     def rotate_matrix(self, R1, R2, inv1=None, logdet1=None, inv2=None, logdet2=None, Q=None):
         """
@@ -434,6 +443,13 @@ class GaussianARDDistribution(ExponentialFamilyDistribution):
             axes0 = list(range(-self.ndim, -self.ndim_mu))
             m0 = utils.utils.sum_multiply(alpha, x, axis=axes0)
 
+            if self.ndim > 0 and self.ndim == self.ndim_mu:
+                # The precision is diagonal
+                m1 = utils.utils.DiagonalMatrix(-0.5 * alpha 
+                                                * np.ones(self.shape),
+                                                ndim=self.ndim)
+                return [m0, m1]
+
             Alpha = utils.utils.diag(alpha, ndim=self.ndim)
             axes1 = [axis+self.ndim for axis in axes0] + axes0
             m1 = -0.5 * utils.utils.sum_multiply(Alpha, 
@@ -517,14 +533,14 @@ class GaussianARDDistribution(ExponentialFamilyDistribution):
             phi1 = np.reshape(phi[1], phi[1].shape[:-2*self.ndim] + (D,D))
 
             # Compute the moments
-            L = utils.linalg.chol(-2*phi1)
-            Cov = utils.linalg.chol_inv(L)
-            u0 = utils.linalg.chol_solve(L, phi0)
+            L = utils.linalg.Cholesky(-2*phi1)
+            Cov = L.inv()
+            u0 = L.solve(phi0)
             u1 = utils.linalg.outer(u0, u0) + Cov
 
             # Compute CGF
             g = (- 0.5 * np.einsum('...i,...i', u0, phi0)
-                 + 0.5 * utils.linalg.chol_logdet(L))
+                 + 0.5 * L.logdet())
 
             # Reshape to arrays
             u0 = np.reshape(u0, u0.shape[:-1] + self.shape)
@@ -600,7 +616,7 @@ class GaussianARDDistribution(ExponentialFamilyDistribution):
         if self.ndim > 0 and np.shape(x)[-self.ndim:] != self.shape:
             raise ValueError("Invalid shape")
         k = np.prod(self.shape)
-        u = [x, utils.linalg.outer(x, x, ndim=self.ndim)]
+        u = [x, utils.utils.OuterProduct(x, ndim=self.ndim)]
         f = -k/2*np.log(2*np.pi)
         return (u, f)
 
@@ -924,6 +940,41 @@ class GaussianARD(ExponentialFamily):
         print(str(Cov))
 
 
+    def _prune_self(self, axis, keep):
+        shape = self._distribution.shape
+        if axis is not None and axis >= -len(shape):
+            shape = list(shape)
+            shape[axis] = np.count_nonzero(keep)
+            self._distribution = GaussianARDDistribution(
+                tuple(shape),
+                self._distribution.ndim_mu)
+        super()._prune_self(axis, keep)
+
+    def _dead_components(self, tol):
+        """
+        Find the components shrunk to zero by ARD.
+
+        A component is dead if the sum of its squared posterior means is
+        smaller than the largest sum by the factor `tol`.  Only the axes
+        which have separate precisions are checked.
+        """
+        alpha = self.parents[1]
+        if not isinstance(alpha, Stochastic):
+            return None
+        shape = self._distribution.shape
+        plates = alpha.plates
+        x2 = self.u[0]**2 * np.ones(self.get_shape(0))
+        for d in range(-len(shape), 0):
+            if shape[d] == 1 or len(plates) < -d or plates[d] != shape[d]:
+                continue
+            # The energy of each component
+            e = np.sum(np.reshape(np.swapaxes(x2, d, -1), (-1, shape[d])),
+                       axis=0)
+            keep = (e > tol * np.amax(e))
+            if not np.all(keep):
+                return (self, d, keep)
+        return None
+
     def rotate(self, R, inv=None, logdet=None, axis=-1, Q=None):
 
         ndim = len(self._distribution.shape)
@@ -953,6 +1004,7 @@ class GaussianARD(ExponentialFamily):
         s = list(self.dims[0])
         s.pop(axis)
         self.g -= logdetR * np.prod(s)
+        self._version += 1
 
         return
 
@@ -1008,7 +1060,9 @@ def reshape_gaussian_array(dims_from, dims_to, x0, x1):
         )
     x0 = np.ones(dims_to) * np.reshape(x0, shape)
 
-    # Reshape the second moment / covariance / precision
+    # Reshape the second moment / covariance / precision (explicitly, because
+    # the result is an explicit array anyway)
+    x1 = np.asarray(x1)
     num_plates_from = np.ndim(x1) - 2*num_dims_from
     plates_from = np.shape(x1)[:num_plates_from]
     shape = (
@@ -68,6 +68,10 @@ class TemplateGaussianMarkovChainDistribution(ExponentialFamilyDistribution):
     def __init__(self, N, D):
         self.N = N
         self.D = D
+        # Smoother algorithm and parallel execution over the plates
+        self.method = 'sequential'
+        self.chunks = 1
+        self.pool = 'thread'
         super().__init__()
 
     def compute_message_to_parent(self, parent, index, u_self, *u_parents):
@@ -101,8 +105,16 @@ class TemplateGaussianMarkovChainDistribution(ExponentialFamilyDistribution):
         # Don't multiply phi[2] by two because it is a sum of the super- and
         # sub-diagonal blocks so we would need to divide by two anyway.
         B = -phi[2]
+        # Time-homogeneous super-diagonal blocks are broadcasted without
+        # copying
+        N = np.shape(y)[-2]
+        B = np.broadcast_to(B, np.shape(B)[:-3] + (N-1,) + np.shape(B)[-2:])
 
-        (CovXnXn, CovXpXn, Xn, ldet) = linalg.block_banded_solve(A, B, y)
+        (CovXnXn, CovXpXn, Xn, ldet) = linalg.block_banded_solve(
+            A, B, y,
+            chunks=self.chunks,
+            pool=self.pool,
+            method=self.method)
 
         # Compute moments
         u0 = Xn
@@ -204,6 +216,44 @@ class _TemplateGaussianMarkovChain(ExponentialFamily):
     def show(self):
         raise NotImplementedError()
 
+    def set_parallel(self, chunks, pool='thread'):
+        """
+        Run the smoother in parallel over chunks of the plates.
+
+        Parameters
+        ----------
+        chunks : int
+            Number of chunks.  One means serial execution.
+        pool : {'thread', 'process'} or concurrent.futures.Executor
+            The pool of workers.
+
+        See also
+        --------
+        bayespy.utils.linalg.block_banded_solve
+        """
+        self._distribution.chunks = chunks
+        self._distribution.pool = pool
+
+    def set_smoother(self, method):
+        """
+        Select the algorithm of the smoother.
+
+        Parameters
+        ----------
+        method : {'sequential', 'cyclic'}
+            'sequential' runs the recursions over the time instances.
+            'cyclic' uses cyclic reduction which is vectorized over the time
+            instances and needs only about log2(N) levels, thus it is much
+            faster for long chains.
+
+        See also
+        --------
+        bayespy.utils.linalg.block_banded_solve
+        """
+        if method not in ('sequential', 'cyclic'):
+            raise ValueError("Unknown smoother %s" % method)
+        self._distribution.method = method
+
     def rotate(self, R, inv=None, logdet=None):
 
         if inv is not None:
@@ -236,6 +286,7 @@ class _TemplateGaussianMarkovChain(ExponentialFamily):
             u2 = linalg.dot(R, self.u[2], R.T)
             self.u = [u0, u1, u2]
             self.g -= N*logdetR
+            self._version += 1
 
             
 def _compute_cgf_for_gaussian_markov_chain(mumu, Lambda, logdet_Lambda, 
@@ -293,7 +344,13 @@ class GaussianMarkovChainDistribution(TemplateGaussianMarkovChainDistribution):
             XnXn = u[1]
             XpXn = u[2]
             v = u_v[0]
-            m0 = v[...,np.newaxis] * XpXn.swapaxes(-1,-2)
+            # If the same A is used for all time instances, this sums over
+            # time directly without forming the message for each time
+            # instance.
+            m0 = message_sum_multiply(parent.plates,
+                                      parent.dims[0],
+                                      v[...,np.newaxis],
+                                      XpXn.swapaxes(-1,-2))
             # The following message matrix could be huge, so let's use a help
             # function which computes sum(v*XnXn) without computing the huge
             # v*XnXn explicitly.
@@ -368,12 +425,9 @@ class GaussianMarkovChainDistribution(TemplateGaussianMarkovChainDistribution):
         plates_phi1 = utils.broadcasted_shape(np.shape(Lambda)[:-2],
                                               np.shape(v)[:-2],
                                               np.shape(AA)[:-4])
-        plates_phi2 = utils.broadcasted_shape(np.shape(v)[:-2],
-                                              np.shape(A)[:-3])
         
         phi0 = np.zeros(plates_phi0+(N,D))
         phi1 = np.zeros(plates_phi1+(N,D,D))
-        phi2 = np.zeros(plates_phi2+(N-1,D,D))
 
         # Parameters for x0
         phi0[...,0,:] = np.einsum('...ik,...k->...i', Lambda, mu)
@@ -386,8 +440,10 @@ class GaussianMarkovChainDistribution(TemplateGaussianMarkovChainDistribution):
 
         # Super-diagonal blocks: 0.5 * A.T * V
         # However, don't multiply by 0.5 because there are both super- and
-        # sub-diagonal blocks (sum them together)
-        phi2[..., :, :, :] = np.einsum('...ji,...j->...ij', A, v)
+        # sub-diagonal blocks (sum them together).  If A and v are shared by
+        # all time instances, keep only one block.
+        phi2 = np.einsum('...ji,...j->...ij', A, v)
+        phi2 = utils.add_leading_axes(phi2, 3 - np.ndim(phi2))
 
         return (phi0, phi1, phi2)
 
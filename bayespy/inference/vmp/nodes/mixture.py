@@ -22,15 +22,18 @@
 ######################################################################
 
 import itertools
+import numbers
 import numpy as np
 import scipy as sp
 import scipy.linalg.decomp_cholesky as decomp
 import scipy.linalg as linalg
+import scipy.sparse as sparse
 import scipy.special as special
 import scipy.spatial.distance as distance
 
 from bayespy.utils import utils
 
+from .stochastic import Stochastic
 from .expfamily import ExponentialFamily, \
                        ExponentialFamilyDistribution, \
                        useconstructor
@@ -40,12 +43,95 @@ from .categorical import Categorical, \
 
 class MixtureDistribution(ExponentialFamilyDistribution):
 
-    def __init__(self, distribution, cluster_plate, n_clusters):
+    def __init__(self, distribution, cluster_plate, n_clusters,
+                 truncation=None):
         self.distribution = distribution
         self.cluster_plate = cluster_plate
         self.ndims = distribution.ndims
         self.ndims_parents = distribution.ndims_parents
         self.K = n_clusters
+        if isinstance(truncation, (bool, np.bool_)):
+            raise ValueError("Truncation must be a number of clusters or a "
+                             "threshold, not %s" % truncation)
+        self.truncation = truncation
+        # Integers (also NumPy integers) give the number of kept clusters
+        self.truncation_count = isinstance(truncation, numbers.Integral)
+
+    def truncate(self, p):
+        """
+        Keep only the largest responsibilities of each plate.
+
+        If the truncation is an integer k, the k largest responsibilities are
+        kept.  If it is a float, the responsibilities below it are dropped
+        (the largest one is always kept).  Returns the indices of the kept
+        clusters and their renormalized responsibilities, both with shape
+        [Nn,..,N0,k], or None if nothing would be dropped.
+
+        The responsibilities p themselves are dense and the kept clusters are
+        selected from them, thus the cost of this step is still proportional
+        to the number of clusters, as is the cost of the message to the
+        cluster assignments, which is not truncated.
+        """
+        if self.truncation is None:
+            return None
+        if self.truncation_count:
+            k = max(int(self.truncation), 1)
+            if k >= self.K:
+                return None
+        else:
+            if np.all(p >= self.truncation):
+                return None
+            k = max(np.max(np.sum(p >= self.truncation, axis=-1)), 1)
+        idx = np.argpartition(-p, k-1, axis=-1)[...,:k]
+        w = self.gather_clusters(p, idx, 0, axis=-1)
+        if not self.truncation_count:
+            # Always keep the most probable cluster
+            keep = np.logical_or(w >= self.truncation,
+                                 w == np.amax(w, axis=-1, keepdims=True))
+            w = np.where(keep, w, 0)
+        w = w / np.sum(w, axis=-1, keepdims=True)
+        return (idx, w)
+
+    def gather_clusters(self, x, idx, ndim, axis=None):
+        """
+        Take the given clusters of an array.
+
+        The clusters are on the cluster plate axis of x (or the given
+        axis) and the indices have shape [Nn,..,N0,k].
+        Shape(x)      = [Nn,..,K,..,N0,Dd,..,D0]
+        Shape(result) = [Nn,..,N0,k,Dd,..,D0]
+        """
+        if axis is None:
+            axis = self.cluster_plate - ndim
+        if np.ndim(x) < abs(axis) or np.shape(x)[axis] == 1:
+            # Equal for all clusters
+            if np.ndim(x) >= abs(axis):
+                x = np.squeeze(x, axis=axis)
+            if np.ndim(x) >= ndim + 1:
+                x = np.expand_dims(x, axis=-1-ndim)
+            return x
+        x = utils.moveaxis(np.asarray(x), axis, -1-ndim)
+        plates = utils.broadcasted_shape(np.shape(x)[:-1-ndim], 
+                                         np.shape(idx)[:-1])
+        x = np.broadcast_to(x, plates + np.shape(x)[-1-ndim:])
+        idx = np.broadcast_to(idx, plates + np.shape(idx)[-1:])
+        grid = tuple(np.reshape(np.arange(n), (-1,) + (1,)*(len(plates)-i))
+                     for (i, n) in enumerate(plates))
+        return x[grid + (idx,)]
+
+    def responsibilities(self, p):
+        """
+        Return the (possibly truncated) responsibilities as a dense array.
+        """
+        truncated = self.truncate(p)
+        if truncated is None:
+            return p
+        (idx, w) = truncated
+        q = np.zeros(np.shape(idx)[:-1] + (self.K,))
+        grid = tuple(np.reshape(np.arange(n), (-1,) + (1,)*(np.ndim(idx)-1-i))
+                     for (i, n) in enumerate(np.shape(idx)[:-1]))
+        q[grid + (idx,)] = w
+        return q
 
     def compute_message_to_parent(self, parent, index, u, *u_parents):
 
@@ -138,7 +224,7 @@ class MixtureDistribution(ExponentialFamilyDistribution):
                 # Responsibilities for clusters are the first
                 # parent's first moment:
                 # Shape(p)      = [Nn,..,N0,K]
-                p = u_parents[0][0]
+                p = self.responsibilities(u_parents[0][0])
                 # Move the cluster axis to the proper place:
                 # Shape(p)      = [Nn,..,K,..,N0]
                 p = utils.atleast_nd(p, abs(self.cluster_plate))
@@ -186,6 +272,20 @@ class MixtureDistribution(ExponentialFamilyDistribution):
         # Contributions/weights/probabilities
         P = u_parents[0][0]
 
+        # Average only over the kept clusters
+        truncated = self.truncate(P)
+        if truncated is not None:
+            (idx, w) = truncated
+            phi = list()
+            for ind in range(len(Phi)):
+                D = self.distribution.ndims[ind]
+                # Shape(phi)    = [Nn,..,N0,k,Dd,..,D0]
+                phi_k = self.gather_clusters(Phi[ind], idx, D)
+                # Shape(result) = [Nn,..,N0,Dd,..,D0]
+                phi.append(np.sum(utils.add_trailing_axes(w, D) * phi_k,
+                                  axis=-1-D))
+            return phi
+
         phi = list()
 
         for ind in range(len(Phi)):
@@ -250,6 +350,14 @@ class MixtureDistribution(ExponentialFamilyDistribution):
         # Shape(p)      = [Nn,..,N0,K]
         p = u_parents[0][0]
 
+        # Average only over the kept clusters
+        truncated = self.truncate(p)
+        if truncated is not None:
+            (idx, w) = truncated
+            # Shape(g)      = [Nn,..,N0,k]
+            g = self.gather_clusters(g, idx, 0, axis=-1)
+            return np.sum(w * g, axis=-1)
+
         # Weighted average of g over the clusters. As p and g are
         # properly aligned, you can just sum p*g over the last
         # axis and utilize broadcasting:
@@ -294,14 +402,33 @@ class MixtureDistribution(ExponentialFamilyDistribution):
         return self.distribution.shape_of_value(dims)
 
 class Mixture(ExponentialFamily):
+    """
+    Mixture of nodes of the same distribution.
+
+    If `truncation` is given, only the largest responsibilities of the
+    cluster assignments `z` are used for each plate: an integer keeps that
+    many clusters and a float drops the responsibilities below it.  The
+    kept responsibilities are renormalized.  The parameters and the messages
+    to the cluster parameters are then computed only for the kept clusters.
+    The message to `z` is not truncated: it needs the log-densities of all
+    the clusters, thus its cost is still proportional to the number of
+    clusters.
+
+    With truncation, the lower bound is computed for the truncated
+    responsibilities, that is, the terms of `z` are corrected to those of
+    the truncated distribution.  Thus, `z` must be a `Categorical` node.
+    """
 
     @useconstructor
-    def __init__(self, z, node_class, *args, cluster_plate=-1, **kwargs):
+    def __init__(self, z, node_class, *args, cluster_plate=-1, 
+                 truncation=None, **kwargs):
         self.cluster_plate = cluster_plate
+        self.truncation = truncation
         super().__init__(z, *args, **kwargs)
 
     @classmethod
-    def _constructor(cls, z, node_class, *args, cluster_plate=-1, plates=None, **kwargs):
+    def _constructor(cls, z, node_class, *args, cluster_plate=-1, 
+                     truncation=None, plates=None, **kwargs):
         """
         Constructs distribution and moments objects.
         """
@@ -330,6 +457,9 @@ class Mixture(ExponentialFamily):
         # Convert a node to get the number of clusters
         z = z._convert(CategoricalMoments)
         K = z.dims[0][0]
+        if truncation is not None and not isinstance(z, Categorical):
+            raise ValueError("Truncation requires the cluster assignments to "
+                             "be a Categorical node")
 
         # Check that at least one of the parents has the cluster plate axis
         if len(mixture_plates) < abs(cluster_plate):
@@ -343,7 +473,10 @@ class Mixture(ExponentialFamily):
         plates = cls._total_plates(plates, mixture_plates, z.plates)
         
         # Convert the distribution to a mixture
-        distribution = MixtureDistribution(distribution, cluster_plate, K)
+        distribution = MixtureDistribution(distribution, 
+                                           cluster_plate, 
+                                           K,
+                                           truncation=truncation)
 
         # Add cluster assignments to parents
         parent_moments = (CategoricalMoments(K),) + parent_moments
@@ -354,6 +487,198 @@ class Mixture(ExponentialFamily):
                 moments, 
                 parent_moments)
 
+    def _prune_cluster_axis(self, index):
+        """
+        Return the cluster axis of a parameter parent.
+
+        None is returned if the parent broadcasts over the clusters.
+        """
+        parent = self.parents[index]
+        n_extra = len(self._plates_to_parent(index)) - len(self.plates) - 1
+        axis = self.cluster_plate - n_extra
+        if -axis > len(parent.plates) or parent.plates[axis] == 1:
+            return None
+        return axis - len(parent.dims[0])
+
+    def _prune_axis_to_parent(self, index, axis):
+        if axis is None:
+            return None
+        raise NotImplementedError("Pruning the plates or the dimensions of a "
+                                  "mixture is not implemented")
+
+    def _prune_from_parent(self, index, axis, keep, plan):
+        if axis is None:
+            return
+        if index == 0:
+            cluster_axis = -1
+        else:
+            cluster_axis = self._prune_cluster_axis(index)
+        if axis != cluster_axis:
+            raise NotImplementedError("Pruning the plates or the dimensions "
+                                      "of a mixture is not implemented")
+        # Remove the clusters from the assignments and all the parameters
+        if self in plan:
+            return
+        plan[self] = None
+        self.parents[0]._prune_plan(-1, keep, plan)
+        for index in range(1, len(self.parents)):
+            axis = self._prune_cluster_axis(index)
+            if axis is not None:
+                self.parents[index]._prune_plan(axis, keep, plan)
+
+    def _prune_self(self, axis, keep):
+        if axis is None:
+            # Clusters removed
+            K = np.count_nonzero(keep)
+            self._distribution.K = K
+            self._parent_moments = ((CategoricalMoments(K),)
+                                    + tuple(self._parent_moments[1:]))
+        super()._prune_self(axis, keep)
+
+    def _dead_components(self, tol):
+        """
+        Find the clusters with less than a fraction `tol` of the assignments.
+        """
+        z = self.parents[0]
+        if not isinstance(z, Stochastic):
+            return None
+        K = self._distribution.K
+        n = np.sum(np.reshape(z.u[0], (-1, K)), axis=0)
+        keep = (n > tol * np.sum(n))
+        keep[np.argmax(n)] = True
+        if np.all(keep):
+            return None
+        return (z, -1, keep)
+
+    def lower_bound_contribution(self, gradient=False):
+        L = super().lower_bound_contribution(gradient=gradient)
+        if self._distribution.truncation is not None:
+            L = L + self._truncation_bound_correction()
+        return L
+
+    def _truncation_bound_correction(self):
+        """
+        Correct the terms of the cluster assignments to the truncated ones.
+
+        The terms E[log p(z)] - E[log q(z)] of the assignments node are
+        computed from its full responsibilities.  The difference to the
+        terms of the truncated responsibilities, which are used for this
+        node, is added to the bound of this node.
+        """
+        z = self.parents[0]
+        p = z.u[0]
+        q = self._distribution.responsibilities(p)
+        if q is p:
+            return 0
+        (phi, _) = z._get_phi_and_cgf_from_parents()
+        def terms(r):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.sum(np.where(r > 0, r * (phi[0] - np.log(r)), 0),
+                              axis=-1)
+        L = terms(q) - terms(p)
+        # Only the latent assignments are corrected
+        mask = np.logical_and(z.mask, np.logical_not(z.observed))
+        return (np.sum(np.where(mask, L, 0), dtype=np.float64)
+                * z._plate_multiplier(z.plates, np.shape(L), np.shape(mask)))
+
+    def _lower_bound_stamp(self):
+        stamp = super()._lower_bound_stamp()
+        if stamp is None or self._distribution.truncation is None:
+            return stamp
+        # The correction depends on the parents of the assignments, too
+        stamps = self.parents[0]._parent_stamps()
+        if stamps is None:
+            return None
+        return (stamp, stamps)
+
+    def _get_message_to_parent(self, index):
+        m = None
+        if index > 0:
+            m = self._get_truncated_message_to_parent(index)
+        if m is None:
+            m = super()._get_message_to_parent(index)
+        return m
+
+    def _get_truncated_message_to_parent(self, index):
+        """
+        Compute the message to a cluster parameter for the kept clusters only.
+
+        The messages of the kept clusters are summed to the clusters with a
+        sparse matrix, so the cost is proportional to the number of kept
+        clusters instead of all the clusters.  This is used if the parent has
+        the cluster plate axis but no other plates of this node.  Returns
+        None if not applicable.
+        """
+        distribution = self._distribution
+        parent = self.parents[index]
+        c = self.cluster_plate
+
+        # Check that the parent has only the cluster plate axis
+        plates = list(self.plates)
+        plates.insert(len(plates) + c + 1, distribution.K)
+        if tuple(self._plates_to_parent(index)) != tuple(plates):
+            return None
+        if (len(parent.plates) < abs(c) 
+            or parent.plates[c] != distribution.K
+            or np.prod(parent.plates) != distribution.K):
+            return None
+
+        u_parents = self._message_from_parents(exclude=index)
+        truncated = distribution.truncate(u_parents[0][0])
+        if truncated is None:
+            return None
+        (idx, w) = truncated
+        k = np.shape(idx)[-1]
+        idx = np.broadcast_to(idx, self.plates + (k,))
+        mask = utils.add_trailing_axes(self.mask, 1)
+        w = np.broadcast_to(w * mask, self.plates + (k,))
+
+        # Moments of the other parameters of the kept clusters with the
+        # clusters on the cluster plate axis
+        u_gathered = []
+        for (ind, u_parent) in enumerate(u_parents[1:]):
+            if u_parent is None:
+                u_gathered.append(None)
+                continue
+            u_k = []
+            for (u, D) in zip(u_parent, distribution.ndims_parents[ind]):
+                u = distribution.gather_clusters(u, idx, D)
+                if np.ndim(u) >= D + 1:
+                    u = utils.moveaxis(u, -1-D, c-D)
+                u_k.append(u)
+            u_gathered.append(u_k)
+        u_self = [np.expand_dims(u, axis=c-D)
+                  for (u, D) in zip(self._get_moments_block(),
+                                    distribution.ndims)]
+        m = distribution.distribution.compute_message_to_parent(parent,
+                                                                index-1,
+                                                                u_self,
+                                                                *u_gathered)
+
+        # Sum the weighted messages of the kept clusters for each cluster
+        n = int(np.prod(np.shape(idx)))
+        S = sparse.csr_matrix((np.ones(n), (np.ravel(idx), np.arange(n))),
+                              shape=(distribution.K, n))
+        for i in range(len(m)):
+            if m[i] is None:
+                continue
+            ndim_diag = None
+            dims = parent.dims[i]
+            if isinstance(m[i], utils.DiagonalMatrix):
+                ndim_diag = m[i].ndim_diag
+                dims = dims[ndim_diag:]
+                m[i] = m[i].d
+            D = len(dims)
+            if np.ndim(m[i]) >= D + abs(c):
+                m[i] = utils.moveaxis(m[i], c-D, -1-D)
+            m_i = utils.add_trailing_axes(w, D) * m[i]
+            m_i = np.broadcast_to(m_i, self.plates + (k,) + dims)
+            m_i = S.dot(np.reshape(m_i, (n, -1)))
+            m[i] = np.reshape(m_i, parent.plates + dims)
+            if ndim_diag is not None:
+                m[i] = utils.DiagonalMatrix(m[i], ndim=ndim_diag)
+        return m
+
     def integrated_logpdf_from_parents(self, x, index):
 
         """ Approximates the posterior predictive pdf \int
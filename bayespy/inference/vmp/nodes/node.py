@@ -57,11 +57,30 @@ def message_sum_multiply(plates_parent, dims_parent, *arrays):
     m = utils.sum_multiply(*arrays,
                            axis=sum_axes,
                            sumaxis=True,
-                           keepdims=True) / r
+                           keepdims=True)
+    # Summing over empty plates gives zero and the plate multiplier is zero,
+    # too
+    if r != 0:
+        m = m / r
     # Remove extra axes
     m = utils.squeeze_to_dim(m, len(shape_parent))
     return m
 
+
+def prune_array(x, axis, keep):
+    """
+    Keep the given elements along a (negative) axis of an array.
+
+    Broadcasted (unit length or missing) axes are not changed.
+    """
+    if np.ndim(x) < -axis or np.shape(x)[axis] == 1:
+        return x
+    if np.shape(x)[axis] != len(keep):
+        raise ValueError("Array axis %d has length %d but %d components "
+                         "were given"
+                         % (axis, np.shape(x)[axis], len(keep)))
+    return np.compress(keep, np.asarray(x), axis=axis)
+
 class Moments():
     """
     Base class for defining the expectation of the sufficient statistics.
@@ -152,6 +171,23 @@ class Node():
        _compute_mask_to_parent(index, mask)
        _plates_to_parent(self, index)
        _plates_from_parent(self, index)
+    2. For caching the messages and the lower bound terms:
+       _moments_stamp(self)
+       _message_stamp_to_parent(self, index)
+       _lower_bound_stamp(self)
+    3. For computing the messages to parents in blocks of plates:
+       _message_block_axes(self, index)
+       _get_message_and_mask_to_parent_block(self, index, axis, start, end)
+    4. For pruning components (if they store arrays depending on the shape or
+       map the axes to the parents differently):
+       _prune_check(self, axis)
+       _prune_self(self, axis, keep)
+       _prune_axis_to_parent(self, index, axis)
+       _prune_from_parent(self, index, axis, keep, plan)
+
+    If `message_block_size` is given, the messages to parents are computed in
+    blocks of at most that many plates (if the node supports it) and the
+    blocks are summed over the plates that the parent does not have.
     """
 
     # These are objects of the _parent_moments_class. If the default way of
@@ -159,14 +195,27 @@ class Node():
     _moments = None
     _parent_moments = None
 
+    # Version number of the state of the node. It must be incremented whenever
+    # the moments or the mask of the node change so that cached messages
+    # depending on them are recomputed.
+    _version = 0
+    _message_cache = None
+
+    # Floating point type of the stored moments, parameters and messages.
+    # Setting this class attribute changes the default for all nodes, use
+    # set_dtype to change it for one node.  The lower bound is computed in
+    # double precision in any case.
+    dtype = np.float64
+
     @ensureparents
     def __init__(self, *parents, dims=None, plates=None, name="", 
-                 notify_parents=True, plotter=None):
+                 notify_parents=True, plotter=None, message_block_size=None):
 
         self.parents = parents
         self.dims = dims
         self.name = name
         self._plotter = plotter
+        self.message_block_size = message_block_size
 
         # Inform parent nodes
         if notify_parents:
@@ -230,6 +279,20 @@ class Node():
     def get_shape(self, ind):
         return self.plates + self.dims[ind]
 
+    def set_dtype(self, dtype):
+        """
+        Set the floating point type of the arrays of the node.
+
+        For instance, `numpy.float32` halves the memory and the memory
+        bandwidth of the updates compared to the default `numpy.float64`.
+        """
+        dtype = np.dtype(dtype)
+        if not np.issubdtype(dtype, np.floating):
+            raise ValueError("Data type must be a floating point type, "
+                             "got %s" % dtype)
+        self.dtype = dtype.type
+        self._version += 1
+
     def _add_child(self, child, index):
         """
         Add a child node.
@@ -260,6 +323,7 @@ class Node():
         # Sub-classes may overwrite this method if they have some other masks to
         # be combined (for instance, observation mask)
         self.mask = mask
+        self._version += 1
     
     def _update_mask(self):
         # Combine masks from children
@@ -379,14 +443,160 @@ class Node():
                            self.name))
         return u
                 
+    def _moments_stamp(self):
+        """
+        Return a stamp which identifies the current moments of the node.
+
+        The stamp changes whenever the moments may have changed.  If None is
+        returned, the moments are not tracked and the messages depending on
+        them are not cached.
+        """
+        return None
+
+    def _message_stamp_to_parent(self, index):
+        """
+        Return a stamp which identifies the inputs of the message to a parent.
+
+        If None is returned, the message is not cached.
+        """
+        return None
+
+    def _lower_bound_stamp(self):
+        """
+        Return a stamp which identifies the inputs of the lower bound term.
+
+        If None is returned, the term is always recomputed.
+        """
+        return None
+
+    def _parent_stamps(self, exclude=None):
+        """
+        Return the moment stamps of the parents or None if any is untracked.
+        """
+        stamps = tuple(parent._moments_stamp() 
+                       for (ind, parent) in enumerate(self.parents)
+                       if ind != exclude)
+        if any(stamp is None for stamp in stamps):
+            return None
+        return stamps
+
     def _message_to_parent(self, index):
+        """
+        Return the message to a parent, reusing the cached one if possible.
+        """
+
+        if index >= len(self.parents):
+            raise ValueError("Parent index larger than the number of parents")
+
+        stamp = self._message_stamp_to_parent(index)
+        if stamp is not None:
+            if self._message_cache is None:
+                self._message_cache = {}
+            cached = self._message_cache.get(index)
+            if cached is not None and cached[0] == stamp:
+                return list(cached[1])
+
+        m = self._get_message_to_parent(index)
+
+        if stamp is not None:
+            self._message_cache[index] = (stamp, list(m))
+        return m
+
+    def _message_block_axes(self, index):
+        """
+        Return the plate axes along which the message to a parent can be
+        computed in blocks.
+
+        The axes are negative indices to the plates of this node with respect
+        to the parent.  See `_get_message_and_mask_to_parent_block`.
+        """
+        return []
+
+    def _get_message_and_mask_to_parent_block(self, index, axis, start, end):
+        """
+        Compute the message and mask to a parent for a block of plates.
+
+        The block is given by the slice `start:end` of the plate `axis`
+        (negative index) of the plates of this node with respect to the
+        parent.
+        """
+        raise NotImplementedError()
+
+    def _message_blocks(self, index):
+        """
+        Find the blocks in which the message to a parent is computed.
+
+        Returns the plate axis and the limits of the blocks or None if the
+        message is computed at once.  The blocks are taken along the longest
+        plate axis that is summed over for the parent.
+        """
+        if self.message_block_size is None:
+            return None
+        plates = self._plates_to_parent(index)
+        size = int(np.prod(plates))
+        if size <= self.message_block_size:
+            return None
+        plates_parent = self.parents[index].plates
+        axis = None
+        for j in self._message_block_axes(index):
+            if -j <= len(plates_parent) and plates_parent[j] != 1:
+                continue
+            if axis is None or plates[j] > plates[axis]:
+                axis = j
+        if axis is None or plates[axis] == 1:
+            return None
+        return (axis, self._block_limits(plates, axis))
+
+    def _block_limits(self, plates, axis):
+        """
+        Split a plate axis into blocks of at most `message_block_size` plates.
+        """
+        N = plates[axis]
+        size = int(np.prod(plates))
+        length = max(1, (self.message_block_size * N) // size)
+        return list(range(0, N, length)) + [N]
+
+    def _get_message_to_parent(self, index):
 
         # Compute the message, check plates, apply mask and sum over some plates
         if index >= len(self.parents):
             raise ValueError("Parent index larger than the number of parents")
 
-        # Compute the message and mask
-        (m, mask) = self._get_message_and_mask_to_parent(index)
+        plates_self = self._plates_to_parent(index)
+
+        blocks = self._message_blocks(index)
+        if blocks is None:
+            (m, mask) = self._get_message_and_mask_to_parent(index)
+            return self._reduce_message_to_parent(index, m, mask, plates_self)
+
+        # Accumulate the messages of the blocks
+        (axis, limits) = blocks
+        msg = None
+        for (start, end) in zip(limits[:-1], limits[1:]):
+            (m, mask) = self._get_message_and_mask_to_parent_block(index,
+                                                                   axis,
+                                                                   start,
+                                                                   end)
+            plates_block = list(plates_self)
+            plates_block[axis] = end - start
+            m = self._reduce_message_to_parent(index, 
+                                               m, 
+                                               mask, 
+                                               tuple(plates_block))
+            if msg is None:
+                msg = m
+            else:
+                for i in range(len(m)):
+                    if m[i] is not None:
+                        msg[i] = msg[i] + m[i]
+        return msg
+
+    def _reduce_message_to_parent(self, index, m, mask, plates_self):
+        """
+        Apply the mask to the message and sum over the plates of this node
+        that the parent does not have.
+        """
+
         mask = utils.squeeze(mask)
 
         # Plates in the mask
@@ -401,9 +611,17 @@ class Node():
             # Empty messages are given as None. We can ignore those.
             if m[i] is not None:
 
+                # Reduce only the diagonal elements of diagonal messages
+                dims_parent = parent.dims[i]
+                ndim_diag = None
+                if isinstance(m[i], utils.DiagonalMatrix):
+                    ndim_diag = m[i].ndim_diag
+                    dims_parent = dims_parent[ndim_diag:]
+                    m[i] = m[i].d
+
                 # Plates in the message
                 shape_m = np.shape(m[i])
-                dim_parent = len(parent.dims[i])
+                dim_parent = len(dims_parent)
                 if dim_parent > 0:
                     plates_m = shape_m[:-dim_parent]
                 else:
@@ -414,7 +632,6 @@ class Node():
                 # plates).  Such a plate is meant to be broadcasted but because
                 # the parent has singular plate axis, it won't broadcast (and
                 # sum over it), so we need to multiply it.
-                plates_self = self._plates_to_parent(index)
                 try:
                     r = self._plate_multiplier(plates_self, 
                                                plates_m,
@@ -440,11 +657,11 @@ class Node():
                                         parent.plates))
 
                 # Add variable axes to the mask
-                shape_mask = np.shape(mask) + (1,) * len(parent.dims[i])
+                shape_mask = np.shape(mask) + (1,) * len(dims_parent)
                 mask_i = np.reshape(mask, shape_mask)
 
                 # Sum over plates that are not in the message nor in the parent
-                shape_parent = parent.get_shape(i)
+                shape_parent = parent.plates + dims_parent
                 shape_msg = utils.broadcasted_shape(shape_m, shape_parent)
                 axes_mask = utils.axes_to_collapse(shape_mask, shape_msg)
                 mask_i = np.sum(mask_i, axis=axes_mask, keepdims=True)
@@ -460,15 +677,44 @@ class Node():
                 # those plate axes.
                 m[i] = utils.squeeze_to_dim(m[i], len(shape_parent))
 
+                if ndim_diag is not None:
+                    m[i] = utils.DiagonalMatrix(m[i], ndim=ndim_diag)
+
         return m
 
-    def _message_from_children(self):
-        msg = [np.zeros(shape) for shape in self.dims]
+    def _message_from_children(self, multipliers=None):
+        """
+        Sum the messages from the children.
+
+        Parameters
+        ----------
+        multipliers : dict, optional
+            Scalar multipliers for the messages of some children, given as
+            child node -> multiplier.  For instance, stochastic variational
+            inference uses this to scale up the messages from mini-batches.
+        """
+        if multipliers is None:
+            multipliers = {}
+        msg = [np.zeros(shape, dtype=self.dtype) for shape in self.dims]
         #msg = [np.array(0.0) for i in range(len(self.dims))]
+        # Diagonal messages are summed separately to keep them diagonal if
+        # all the messages are diagonal
+        diagonal = [None for shape in self.dims]
+        dense = [False for shape in self.dims]
         for (child,index) in self.children:
             m = child._message_to_parent(index)
+            r = multipliers.get(child, 1)
             for i in range(len(self.dims)):
                 if m[i] is not None:
+                    if r != 1:
+                        m[i] = r * m[i]
+                    if isinstance(m[i], utils.DiagonalMatrix):
+                        if diagonal[i] is None:
+                            diagonal[i] = m[i]
+                        else:
+                            diagonal[i] = diagonal[i] + m[i]
+                        continue
+                    dense[i] = True
                     # Check broadcasting shapes
                     sh = utils.broadcasted_shape(self.get_shape(i), np.shape(m[i]))
                     try:
@@ -477,7 +723,14 @@ class Node():
                     except ValueError:
                         msg[i] = msg[i] + m[i]
 
-        return msg
+        for i in range(len(self.dims)):
+            if diagonal[i] is not None:
+                if dense[i]:
+                    msg[i] = msg[i] + np.asarray(diagonal[i])
+                else:
+                    msg[i] = diagonal[i]
+
+        return [utils.astype(m, self.dtype) for m in msg]
 
     def _message_from_parents(self, exclude=None):
         return [list(parent._message_to_child())
@@ -497,6 +750,230 @@ class Node():
         for (ind, parent) in enumerate(self.parents):
             parent._remove_child(self, ind)
 
+    def prune(self, axis, keep):
+        """
+        Remove components along an axis of this node and the connected nodes.
+
+        The components are removed from all the nodes which share the axis
+        (parents, children and co-parents through sum-products), thus the
+        subsequent updates are computed only for the kept components.  The
+        posterior approximations of the pruned stochastic nodes are
+        recomputed from their natural parameters.
+
+        Parameters
+        ----------
+        axis : int
+            Negative index of the axis in `plates + dims[0]`.
+        keep : bool array
+            Components to keep along the axis.
+        """
+        keep = np.asarray(keep, dtype=bool)
+        # Find and check all the affected nodes before changing anything so
+        # that unsupported model structures do not leave the model partially
+        # pruned
+        plan = self._prune_checked_plan(axis, keep)
+        for (node, node_axis) in plan.items():
+            node._prune_self(node_axis, keep)
+
+    def _prune_checked_plan(self, axis, keep):
+        """
+        Return the affected nodes and their axes for pruning this node.
+
+        NotImplementedError is raised if any of the nodes can not be pruned.
+        Nothing is changed.
+        """
+        keep = np.asarray(keep, dtype=bool)
+        if np.ndim(keep) != 1:
+            raise ValueError("Components to keep must be a vector")
+        if not np.any(keep):
+            raise ValueError("Can not prune all the components")
+        if axis >= 0:
+            raise ValueError("Axis must be negative")
+        plan = {}
+        self._prune_plan(axis, keep, plan)
+        for (node, node_axis) in plan.items():
+            node._prune_check(node_axis)
+        return plan
+
+    def _prune_plan(self, axis, keep, plan):
+        """
+        Collect the nodes and their axes to prune into the dictionary `plan`.
+
+        Axis None means that the arrays of the node are not pruned but the
+        node depends on the pruned components.
+        """
+        if self in plan:
+            if plan[self] != axis:
+                raise NotImplementedError("Pruning node %s along several "
+                                          "axes is not implemented"
+                                          % self.name)
+            return
+        shape = self.plates + self.dims[0]
+        if axis is not None and (-axis > len(shape)
+                                 or shape[axis] != len(keep)):
+            raise ValueError("Can not prune %d components from axis %d of "
+                             "node %s with shape %s"
+                             % (len(keep), axis, self.name, shape))
+        plan[self] = axis
+        for (index, parent) in enumerate(self.parents):
+            parent_axis = self._prune_axis_to_parent(index, axis)
+            if parent_axis is not None:
+                parent._prune_plan(parent_axis, keep, plan)
+        for (child, index) in self.children:
+            child._prune_from_parent(index, axis, keep, plan)
+
+    def _prune_extra_plates(self, index):
+        """
+        Number of the plates to a parent which correspond to the dimensions.
+
+        For instance, the precision parent of GaussianARD has plates for the
+        dimensions of the node.
+        """
+        plates = self._plates_to_parent(index)
+        n_extra = len(plates) - len(self.plates)
+        dims = self.dims[0]
+        if (n_extra < 0
+            or n_extra > len(dims)
+            or tuple(plates[:len(self.plates)]) != tuple(self.plates)
+            or tuple(plates[len(self.plates):]) != dims[len(dims)-n_extra:]):
+            raise NotImplementedError("Pruning is not implemented for nodes "
+                                      "which manipulate the plates of the "
+                                      "parents")
+        return n_extra
+
+    def _prune_axis_to_parent(self, index, axis):
+        """
+        Return the axis of a parent corresponding to an axis of this node.
+
+        None is returned if the parent broadcasts along the axis.
+        """
+        if axis is None:
+            return None
+        parent = self.parents[index]
+        dims = self.dims[0]
+        dims_parent = parent.dims[0]
+        n_extra = self._prune_extra_plates(index)
+        if axis < -len(dims) or axis >= -n_extra:
+            # Plate axis of the parent
+            if axis < -len(dims):
+                axis = axis + len(dims) - n_extra
+            if -axis > len(parent.plates) or parent.plates[axis] == 1:
+                return None
+            return axis - len(dims_parent)
+        # Dimension axis of the parent, aligned to the right
+        if len(dims_parent) > len(dims) - n_extra:
+            raise NotImplementedError("Pruning the dimensions of node %s is "
+                                      "not implemented" % self.name)
+        axis = axis + n_extra
+        if -axis > len(dims_parent) or dims_parent[axis] == 1:
+            return None
+        return axis
+
+    def _prune_from_parent(self, index, axis, keep, plan):
+        """
+        Prune this node because parent `index` is pruned along `axis`.
+        """
+        if axis is None:
+            return
+        parent = self.parents[index]
+        dims = self.dims[0]
+        dims_parent = parent.dims[0]
+        n_extra = self._prune_extra_plates(index)
+        if axis < -len(dims_parent):
+            # Plate axis of the parent
+            axis = axis + len(dims_parent)
+            if axis < -n_extra:
+                axis = axis + n_extra - len(dims)
+        else:
+            # Dimension axis of the parent, aligned to the right
+            if len(dims_parent) > len(dims) - n_extra:
+                raise NotImplementedError("Pruning the dimensions of node %s "
+                                          "is not implemented" % self.name)
+            axis = axis - n_extra
+        self._prune_plan(axis, keep, plan)
+
+    def _prune_moment_axes(self, axis, ind):
+        """
+        Return the axes of the moment array `ind` for an axis of the node.
+        """
+        dims = self.dims[0]
+        if axis < -len(dims):
+            return [axis + len(dims) - len(self.dims[ind])]
+        # The dimensions of the moments must repeat the dimensions of the
+        # variable (e.g., the mean and the covariance of Gaussians)
+        if len(self.dims[ind]) % len(dims) != 0:
+            raise NotImplementedError("Pruning the dimensions of node %s is "
+                                      "not implemented" % self.name)
+        r = len(self.dims[ind]) // len(dims)
+        if self.dims[ind] != r * dims:
+            raise NotImplementedError("Pruning the dimensions of node %s is "
+                                      "not implemented" % self.name)
+        return [axis - k*len(dims) for k in range(r)]
+
+    def _prune_moments(self, u, axis, keep):
+        """
+        Prune a list of moment (or natural parameter) arrays.
+        """
+        u = list(u)
+        for ind in range(len(u)):
+            for a in self._prune_moment_axes(axis, ind):
+                u[ind] = prune_array(u[ind], a, keep)
+        return u
+
+    def _prune_plates(self, x, axis, keep):
+        """
+        Prune an array of the plates (e.g., a mask) if the axis is a plate.
+        """
+        if axis < -len(self.dims[0]):
+            return prune_array(x, axis + len(self.dims[0]), keep)
+        return x
+
+    def _prune_check(self, axis):
+        """
+        Raise NotImplementedError if this node can not be pruned along the axis.
+
+        This is called for all the affected nodes before any of them is
+        pruned, thus `_prune_self` must not fail if this passes.
+        """
+        if axis is not None and axis >= -len(self.dims[0]):
+            for ind in range(len(self.dims)):
+                self._prune_moment_axes(axis, ind)
+
+    def _prune_self(self, axis, keep):
+        """
+        Remove the components along the axis from the arrays of this node.
+
+        Sub-classes with arrays or distributions depending on the shape must
+        extend this.
+        """
+        if axis is not None:
+            n = np.count_nonzero(keep)
+            dims = self.dims[0]
+            if axis < -len(dims):
+                plates = list(self.plates)
+                plates[axis + len(dims)] = n
+                self.plates = tuple(plates)
+                self.mask = self._prune_plates(self.mask, axis, keep)
+            else:
+                new_dims = []
+                for ind in range(len(self.dims)):
+                    dim = list(self.dims[ind])
+                    for a in self._prune_moment_axes(axis, ind):
+                        dim[a] = n
+                    new_dims.append(tuple(dim))
+                self.dims = tuple(new_dims)
+        self._version += 1
+        self._message_cache = None
+
+    def _dead_components(self, tol):
+        """
+        Find components of the model which can be pruned.
+
+        Returns a tuple (node, axis, keep) for `Node.prune` or None.
+        Sub-classes may implement this (e.g., for empty mixture clusters).
+        """
+        return None
+
     @staticmethod
     def _plate_multiplier(plates, *args):
         """
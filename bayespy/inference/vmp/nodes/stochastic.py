@@ -78,6 +78,9 @@ class Stochastic(Node):
     # Sub-classes must over-write this
     _distribution = None
 
+    # Observations which are read in blocks instead of storing their moments
+    _observation = None
+
     def __init__(self, *args, initialize=True, **kwargs):
 
         super().__init__(*args,
@@ -85,7 +88,8 @@ class Stochastic(Node):
 
         # Initialize moment array
         axes = len(self.plates)*(1,)
-        self.u = [utils.nans(axes+dim) for dim in self.dims]
+        self.u = [utils.astype(utils.nans(axes+dim), self.dtype)
+                  for dim in self.dims]
 
         # Not observed
         self.observed = False
@@ -106,26 +110,115 @@ class Stochastic(Node):
     def get_moments(self):
         # Just for safety, do not return a reference to the moment list of this
         # node but instead create a copy of the list. 
-        return [ui for ui in self.u]
+        return [ui for ui in self._get_moments_block()]
+
+    def _get_moments_block(self, axis=None, start=None, end=None):
+        """
+        Return the moments for the block `start:end` of a plate axis.
+
+        By default, the moments for all plates are returned.  Sub-classes may
+        compute the moments here instead of storing them (e.g., for
+        observations which do not fit in memory).
+        """
+        if axis is None:
+            return self.u
+        return [utils.take_block(ui, axis - len(dims), start, end)
+                for (ui, dims) in zip(self.u, self.dims)]
 
     def _get_message_and_mask_to_parent(self, index):
         u_parents = self._message_from_parents(exclude=index)
+        u_self = self._get_moments_block()
         m = self._distribution.compute_message_to_parent(self.parents[index], 
                                                          index, 
-                                                         self.u, 
+                                                         u_self, 
                                                          *u_parents)
         mask = self._distribution.compute_mask_to_parent(index, self.mask)
         ## m = self._compute_message_to_parent(self.parents[index], index, self.u, *u_parents)
         ## mask = self._compute_mask_to_parent(index, self.mask)
         return (m, mask)
 
+    def _message_block_axes(self, index):
+        # The moments can be sliced consistently only if the parents have the
+        # plates of this node as leading plates
+        extra = []
+        for ind in range(len(self.parents)):
+            plates = self._distribution.plates_to_parent(ind, self.plates)
+            if tuple(plates[:len(self.plates)]) != tuple(self.plates):
+                return []
+            extra.append(len(plates) - len(self.plates))
+        return [j - extra[index] for j in range(-len(self.plates), 0)]
+
+    def _get_message_and_mask_to_parent_block(self, index, axis, start, end):
+
+        def extra_plates(ind):
+            plates = self._distribution.plates_to_parent(ind, self.plates)
+            return len(plates) - len(self.plates)
+
+        # The plate axis of this node
+        axis = axis + extra_plates(index)
+
+        u_parents = self._message_from_parents(exclude=index)
+        u_parents = [None if u is None else
+                     [utils.take_block(ui, 
+                                       axis - extra_plates(ind) - len(dims),
+                                       start,
+                                       end)
+                      for (ui, dims) in zip(u, self.parents[ind].dims)]
+                     for (ind, u) in enumerate(u_parents)]
+        u_self = self._get_moments_block(axis, start, end)
+        m = self._distribution.compute_message_to_parent(self.parents[index], 
+                                                         index, 
+                                                         u_self, 
+                                                         *u_parents)
+        mask = utils.take_block(self.mask, axis, start, end)
+        mask = self._distribution.compute_mask_to_parent(index, mask)
+        return (m, mask)
+
     def _set_mask(self, mask):
         self.mask = np.logical_or(mask, self.observed)
+        self._version += 1
+
+    def set_dtype(self, dtype):
+        super().set_dtype(dtype)
+        self.u = [utils.astype(u, self.dtype) for u in self.u]
+
+    def _prune_check(self, axis):
+        if axis is not None and self._observation is not None:
+            raise NotImplementedError("Pruning out-of-core observations is "
+                                      "not implemented")
+        super()._prune_check(axis)
+
+    def _prune_self(self, axis, keep):
+        if axis is not None:
+            self.u = self._prune_moments(self.u, axis, keep)
+            self.observed = self._prune_plates(self.observed, axis, keep)
+        super()._prune_self(axis, keep)
+
+    def _moments_stamp(self):
+        # The identities of the arrays catch moments replaced directly
+        return (self._version,) + tuple(id(ui) for ui in self.u)
+
+    def _message_stamp_to_parent(self, index):
+        stamps = self._parent_stamps(exclude=index)
+        if stamps is None:
+            return None
+        return (self._moments_stamp(), stamps)
     
     def _set_moments(self, u, mask=True):
         # Store the computed moments u but do not change moments for
         # observations, i.e., utilize the mask.
+        self._version += 1
         for ind in range(len(u)):
+            # Keep implicit moments (e.g., outer products of observations)
+            # implicit if they replace all the moments
+            if (isinstance(u[ind], utils.OuterProduct) 
+                and np.all(mask)
+                and np.shape(u[ind]) == self.get_shape(ind)):
+                self.u[ind] = u[ind]
+                continue
+            if isinstance(self.u[ind], utils.OuterProduct):
+                self.u[ind] = np.array(self.u[ind], dtype=self.dtype)
+
             # Add axes to the mask for the variable dimensions (mask
             # contains only axes for the plates).
             u_mask = utils.add_trailing_axes(mask, self._distribution.ndims[ind])
@@ -133,7 +226,12 @@ class Stochastic(Node):
             # Enlarge self.u[ind] as necessary so that it can store the
             # broadcasted result.
             sh = utils.broadcasted_shape_from_arrays(self.u[ind], u[ind], u_mask)
-            self.u[ind] = utils.repeat_to_shape(self.u[ind], sh)
+            if np.all(mask):
+                # Replace the whole array so that references to the previous
+                # moments stay valid
+                self.u[ind] = np.empty(sh, dtype=self.dtype)
+            else:
+                self.u[ind] = utils.repeat_to_shape(self.u[ind], sh)
 
             # TODO/FIXME/BUG: The mask of observations is not used, observations
             # may be overwritten!!! ???
@@ -186,6 +284,7 @@ class Stochastic(Node):
     def unobserve(self):
         # Update mask
         self.observed = False
+        self._observation = None
         self._update_mask()
 
     def lowerbound(self):
@@ -208,8 +307,10 @@ class Stochastic(Node):
         ##     name = self.name
         ## subgroup = group.create_group(name)
         
-        for i in range(len(self.u)):
-            utils.write_to_hdf5(group, self.u[i], 'u%d' % i)
+        # The moments of out-of-core observations are not stored
+        if self._observation is None:
+            for i in range(len(self.u)):
+                utils.write_to_hdf5(group, self.u[i], 'u%d' % i)
         utils.write_to_hdf5(group, self.observed, 'observed')
 
     def load(self, group):
@@ -218,8 +319,9 @@ class Stochastic(Node):
         """
         # TODO/FIXME: Check that the shapes are correct!
         for i in range(len(self.u)):
-            ui = group['u%d' % i][...]
-            self.u[i] = ui
+            if 'u%d' % i in group:
+                self.u[i] = group['u%d' % i][...]
+        self._version += 1
 
         old_observed = self.observed
         self.observed = group['observed'][...]
@@ -29,7 +29,12 @@ import numpy as np
 from bayespy.utils import utils
 
 from bayespy.inference.vmp.nodes import CategoricalMarkovChain, \
-                                        Dirichlet
+                                        Dirichlet, \
+                                        Gaussian, \
+                                        Mixture
+from bayespy.inference.vmp.vmp import VB
+from bayespy.inference.vmp.nodes.categorical_markov_chain import \
+    CategoricalMarkovChainToCategorical
 
 class TestCategoricalMarkovChain(utils.TestCase):
 
@@ -184,4 +189,94 @@ class TestCategoricalMarkovChain(utils.TestCase):
                                [0.0, 1.0]] ])
 
 
+        pass
+
+    def test_transitions(self):
+        """
+        Test CategoricalMarkovChain with restricted state transitions
+        """
+
+        # Left-to-right topology with skips
+        K = 5
+        N = 10
+        mask = np.triu(np.ones((K,K))) - np.triu(np.ones((K,K)), 3)
+        p0 = np.random.rand(2, K)
+        P = mask * np.random.rand(N-1, K, K)
+
+        # The disallowed transitions have zero probabilities
+        with np.errstate(divide='ignore'):
+            Z = CategoricalMarkovChain(p0, P, transitions=mask)
+            self.assertEqual(Z.dims, ((K,), (N-1,K,3)))
+            Z_dense = CategoricalMarkovChain(p0, P)
+            u = Z._message_to_child()
+            u_dense = Z_dense._message_to_child()
+            self.assertAllClose(u[0], u_dense[0])
+            self.assertAllClose(utils.banded_to_dense(u[1], [0, 1, 2]),
+                                u_dense[1])
+
+        # Marginals of the states
+        X = CategoricalMarkovChainToCategorical(Z)
+        X_dense = CategoricalMarkovChainToCategorical(Z_dense)
+        self.assertAllClose(X.get_moments()[0], X_dense.get_moments()[0])
+
+        # Messages to the transition probabilities are restricted to the
+        # allowed transitions
+        P = Dirichlet(np.ones(K), plates=(N-1,K))
+        Z = CategoricalMarkovChain(p0[0], P, transitions=mask)
+        Y = Mixture(Z, Gaussian, np.arange(K)[:,None], K*[np.identity(1)])
+        Y.observe(np.random.randn(N,1))
+        Q = VB(Y, Z, P)
+        Q.update(repeat=5)
+        m = Z._message_to_parent(1)
+        self.assertEqual(np.shape(m[0]), (N-1,K,K))
+        self.assertAllClose(m[0] * (1-mask), np.zeros((N-1,K,K)))
+        self.assertAllClose(np.sum(m[0], axis=(-1,-2)), np.ones(N-1))
+        self.assertTrue(np.isfinite(Q.compute_lowerbound()))
+
+        pass
+
+    def test_time_homogeneous(self):
+        """
+        Test CategoricalMarkovChain with shared transition probabilities
+        """
+
+        K = 3
+        N = 20
+        p0 = Dirichlet(np.ones(K))
+        alpha = np.random.rand(K, K) + 0.5
+
+        results = []
+        for P in [Dirichlet(alpha),
+                  Dirichlet(alpha*np.ones((N-1,1,1)))]:
+            Z = CategoricalMarkovChain(p0, P, states=N)
+            Y = Mixture(Z, Gaussian, np.arange(K)[:,None], K*[np.identity(1)])
+            Y.observe(np.arange(N)[:,None] % K)
+            Z.update()
+            results.append((Z.get_moments(),
+                            Z._message_to_parent(1),
+                            Z.lower_bound_contribution()))
+
+        # The shared transition matrix is not copied for each time instance
+        Z = CategoricalMarkovChain(p0, Dirichlet(alpha), states=N)
+        (phi, _) = Z._get_phi_and_cgf_from_parents()
+        self.assertEqual(np.shape(phi[1]), (1,K,K))
+
+        # Identical posterior
+        for (u_shared, u_varying) in zip(results[0][0], results[1][0]):
+            self.assertAllClose(u_shared, u_varying)
+        self.assertAllClose(results[0][2], results[1][2])
+
+        # The message to the shared parent is summed over time
+        self.assertAllClose(results[0][1][0], 
+                            np.sum(results[1][1][0], axis=0))
+
+        # A chain of one state gives no message to the transition matrix
+        Z = CategoricalMarkovChain(p0, Dirichlet(alpha), states=1)
+        Z.update()
+        self.assertAllClose(Z.get_moments()[0],
+                            np.exp(p0.get_moments()[0])
+                            / np.sum(np.exp(p0.get_moments()[0])))
+        self.assertAllClose(Z._message_to_parent(1)[0], np.zeros((K,K)))
+        self.assertTrue(np.isfinite(Z.lower_bound_contribution()))
+
         pass
@@ -809,6 +809,76 @@ class TestSumMultiply(TestCase):
 
         pass
 
+    def test_contraction_order(self):
+        """
+        Test that the contraction orders are planned once and reused
+        """
+
+        X = GaussianARD(np.random.randn(4,3), 1, shape=(3,), plates=(4,))
+        A = GaussianARD(np.random.randn(3,3), 1, shape=(3,3))
+        Y = GaussianARD(np.random.randn(4,3), 1, shape=(3,), plates=(4,))
+        F = SumMultiply('i,ij,j', X, A, Y)
+        Z = GaussianARD(F, 1)
+        Z.observe(np.random.randn(4))
+
+        X.update()
+        Y.update()
+        x = X.get_moments()
+        a = A.get_moments()
+        y = Y.get_moments()
+        u = F._compute_moments(x, a, y)
+        self.assertAllClose(u[0],
+                            np.einsum('...i,...ij,...j', x[0], a[0], y[0]))
+        self.assertAllClose(u[1],
+                            np.einsum('...ik,...ijkl,...jl', 
+                                      x[1], a[1], y[1]))
+        F._get_message_to_parent(1)
+        paths = dict(F._einsum_paths)
+
+        # Same shapes use the same contraction orders
+        X.update()
+        Y.update()
+        F._compute_moments(X.get_moments(), a, Y.get_moments())
+        F._get_message_to_parent(1)
+        self.assertEqual(F._einsum_paths, paths)
+
+        pass
+
+    def test_max_bytes(self):
+        """
+        Test that the chunked computations give the same results
+        """
+
+        def check(*args, max_bytes=None):
+            Z = SumMultiply(*args)
+            Y = SumMultiply(*args, max_bytes=max_bytes)
+            self.assertAllClose(Y.get_moments()[0], Z.get_moments()[0])
+            self.assertAllClose(Y.get_moments()[1], Z.get_moments()[1])
+            V = GaussianARD(Y, 1, shape=Y.dims[0])
+            V.observe(np.random.randn(*(Y.plates + Y.dims[0])))
+            W = GaussianARD(Z, 1, shape=Z.dims[0])
+            W.observe(V.get_moments()[0])
+            for i in range(len(Y.parents)):
+                m_y = Y._message_to_parent(i)
+                m_z = Z._message_to_parent(i)
+                self.assertAllClose(m_y[0], m_z[0])
+                self.assertAllClose(m_y[1], m_z[1])
+
+        X = GaussianARD(np.random.randn(20,3), 1, shape=(3,), plates=(20,))
+        A = GaussianARD(np.random.randn(3,2), 1, shape=(3,2))
+        B = GaussianARD(np.random.randn(20,2), 1, shape=(2,), plates=(20,))
+
+        # Plates in the output
+        check('i,ij->j', X, A, max_bytes=100)
+        check('i,ij,j', X, A, B, max_bytes=100)
+        # Sum over the variable axes only
+        check('i,ij->ij', X, A, max_bytes=200)
+        # A budget smaller than a single element
+        check('i,ij,j', X, A, B, max_bytes=1)
+
+        pass
+
+
 def check_performance(scale=1e2):
     """
     Tests that the implementation of SumMultiply is efficient.
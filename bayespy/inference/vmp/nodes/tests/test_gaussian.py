@@ -138,6 +138,48 @@ class TestGaussianFunctions(TestCase):
         pass
 
     
+class TestGaussian(TestCase):
+
+    def test_diagonal_precision(self):
+        """
+        Test Gaussian nodes with diagonal precision matrices.
+        """
+
+        from ..gamma import diagonal
+
+        D = 3
+        mu = GaussianARD(np.random.randn(D), 1, shape=(D,))
+        alpha = Gamma(2, 2, plates=(D,))
+        alpha.initialize_from_value(np.random.gamma(2, size=(D,)))
+        X = Gaussian(mu, diagonal(alpha), plates=(4,))
+        Y = GaussianARD(X, 3, shape=(D,))
+        Y.observe(np.random.randn(4,D))
+        X.update()
+
+        # The precision stays diagonal
+        self.assertIsInstance(X.phi[1], utils.DiagonalMatrix)
+
+        # The moments equal those computed with a full precision
+        (u, g) = X._distribution.compute_moments_and_cgf(
+            [X.phi[0], np.asarray(X.phi[1])])
+        self.assertAllClose(X.u[0], u[0])
+        self.assertAllClose(X.u[1], u[1])
+        self.assertAllClose(X.g, g)
+        Cov = np.diag(1 / (alpha.u[0] + 3))
+        self.assertAllClose(X.u[1] - np.einsum('ni,nj->nij', X.u[0], X.u[0]),
+                            np.tile(Cov, (4,1,1)))
+
+        # The messages to the parents
+        alpha.update()
+        mu.update()
+        Q = VB(Y, X, mu, alpha)
+        Q.update(repeat=3)
+        self.assertAllClose(X.u[1] - np.einsum('ni,nj->nij', X.u[0], X.u[0]),
+                            np.tile(np.diag(1 / (alpha.u[0] + 3)), (4,1,1)))
+
+        pass
+
+
 class TestGaussianARD(TestCase):
 
     def test_init(self):
@@ -690,6 +732,130 @@ class TestGaussianARD(TestCase):
 
         pass
 
+    def test_observe_out_of_core(self):
+        """
+        Test observations which are read in blocks from memmap or HDF5.
+        """
+
+        import tempfile
+        import h5py
+
+        def check(data, y, block_size):
+            def model():
+                mu = GaussianARD(np.random.randn(3), 1, shape=(3,))
+                tau = Gamma(2, 2, plates=(3,))
+                Y = GaussianARD(mu, tau, shape=(3,), plates=(10,),
+                                message_block_size=block_size)
+                return (mu, tau, Y)
+            np.random.seed(1)
+            (mu1, tau1, Y1) = model()
+            Y1.observe(y)
+            np.random.seed(1)
+            (mu2, tau2, Y2) = model()
+            Y2.observe(data)
+            self.assertIs(Y2._observation, data)
+            for index in range(2):
+                m1 = Y1._message_to_parent(index)
+                m2 = Y2._message_to_parent(index)
+                self.assertAllClose(m2[0], m1[0])
+                self.assertAllClose(m2[1], m1[1])
+            self.assertAllClose(Y2.lower_bound_contribution(),
+                                Y1.lower_bound_contribution())
+            Q1 = VB(Y1, mu1, tau1)
+            Q1.update(repeat=3)
+            Q2 = VB(Y2, mu2, tau2)
+            Q2.update(repeat=3)
+            self.assertAllClose(mu2.get_moments()[0], mu1.get_moments()[0])
+            self.assertAllClose(Q2.compute_lowerbound(),
+                                Q1.compute_lowerbound())
+            # The moments of the observations are not stored
+            self.assertRaises(ValueError, Y2.get_moments)
+            with tempfile.NamedTemporaryFile(suffix='.h5') as f:
+                Y2.name = 'Y'
+                mu2.name = 'mu'
+                tau2.name = 'tau'
+                Q2.save(f.name)
+                h5f = h5py.File(f.name, 'r')
+                self.assertNotIn('u0', h5f['nodes/Y'])
+                self.assertIn('u0', h5f['nodes/mu'])
+                h5f.close()
+                Q2.load(Y2, mu2, tau2, filename=f.name)
+
+        y = np.random.randn(10,3)
+
+        # Memory-mapped file
+        with tempfile.NamedTemporaryFile() as f:
+            data = np.memmap(f.name, dtype='float64', mode='w+', shape=(10,3))
+            data[...] = y
+            check(data, y, 4)
+            check(data, y, None)
+            del data
+
+        # HDF5 dataset
+        h5f = h5py.File('out_of_core.h5', 'w', driver='core', 
+                        backing_store=False)
+        data = h5f.create_dataset('y', data=y)
+        check(data, y, 7)
+        # The observations are not read at once if they do not fit in a block
+        mu = GaussianARD(0, 1, shape=(3,), plates=(10,))
+        Y = GaussianARD(mu, 1, shape=(3,), plates=(10,), message_block_size=4)
+        Y.observe(data)
+        self.assertRaises(ValueError, Y._message_to_parent, 0)
+        h5f.close()
+
+        # Missing values are not supported
+        Y = GaussianARD(0, 1, shape=(3,), plates=(10,))
+        f = h5py.File('out_of_core.h5', 'w', driver='core', 
+                      backing_store=False)
+        data = f.create_dataset('y', data=y)
+        self.assertRaises(ValueError,
+                          Y.observe,
+                          data,
+                          mask=np.arange(10) < 5)
+        f.close()
+
+        pass
+
+    def test_observe_implicit(self):
+        """
+        Test that the second moments of observations are kept implicit.
+        """
+
+        from ..dot import SumMultiply
+
+        y = np.random.randn(10,3)
+        mu = GaussianARD(0, 1, shape=(3,))
+        tau = Gamma(2, 2, plates=(3,))
+        Y = GaussianARD(mu, tau, shape=(3,), plates=(10,))
+        Y.observe(y)
+        u = Y.get_moments()
+        self.assertIsInstance(u[1], utils.OuterProduct)
+        self.assertAllClose(np.asarray(u[1]), 
+                            np.einsum('ni,nj->nij', y, y))
+
+        # Messages and the lower bound are the same as for explicit moments
+        tau.update()
+        m = Y._message_to_parent(1)
+        self.assertAllClose(m[0], 
+                            -0.5*np.sum((y - mu.get_moments()[0])**2 
+                                        + mu.get_moments()[1].diagonal()
+                                        - mu.get_moments()[0]**2,
+                                        axis=0))
+        L = Y.lower_bound_contribution()
+        Y.u[1] = np.asarray(Y.u[1])
+        Y._version += 1
+        self.assertAllClose(L, Y.lower_bound_contribution())
+
+        # Observed inputs of a sum-product
+        W = GaussianARD(0, 1, shape=(3,))
+        F = SumMultiply('i,i', W, y)
+        F_u = F.get_moments()
+        self.assertAllClose(F_u[1], 
+                            np.einsum('ij,ni,nj->n', 
+                                      W.get_moments()[1], y, y))
+
+        pass
+
     def test_rotate(self):
         """
         Test the rotation of Gaussian ARD arrays.
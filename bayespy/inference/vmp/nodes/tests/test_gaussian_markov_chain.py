@@ -473,6 +473,119 @@ class TestGaussianMarkovChain(TestCase):
         self.assertTrue(np.allclose(Xh_vb, Xh))
         self.assertTrue(np.allclose(CovXh_vb, CovXh))
         
+    def test_parallel(self):
+        """
+        Test that parallel smoothing over plates gives identical results.
+        """
+
+        N = 20
+        D = 2
+        M = 6
+        A = np.random.randn(N-1,D,D)
+        v = np.random.rand(D) + 0.5
+        Y = np.random.randn(M,N,D)
+
+        u = []
+        for chunks in [1, 3]:
+            X = GaussianMarkovChain(np.zeros(D), np.identity(D), A, v, 
+                                    n=N, plates=(M,))
+            X.set_parallel(chunks)
+            Z = Gaussian(X, np.identity(D), plates=(M,N))
+            Z.observe(Y)
+            X.update()
+            u.append(X.get_moments())
+            u.append(X.g)
+
+        for (u_serial, u_parallel) in zip(u[0], u[2]):
+            np.testing.assert_array_equal(u_parallel, u_serial)
+        np.testing.assert_array_equal(u[3], u[1])
+
+        pass
+
+    def test_cyclic_smoother(self):
+        """
+        Test that the cyclic reduction smoother gives the same moments.
+        """
+
+        N = 50
+        D = 3
+        M = 2
+        A = 0.3 * np.random.randn(N-1,D,D)
+        v = np.random.rand(D) + 0.5
+        Y = np.random.randn(M,N,D)
+
+        results = []
+        for method in ['sequential', 'cyclic']:
+            X = GaussianMarkovChain(np.zeros(D), np.identity(D), A, v, 
+                                    n=N, plates=(M,))
+            X.set_smoother(method)
+            Z = Gaussian(X, np.identity(D), plates=(M,N))
+            Z.observe(Y)
+            X.update()
+            results.append(X.get_moments() + [X.g])
+
+        for (x_sequential, x_cyclic) in zip(*results):
+            self.assertAllClose(x_cyclic, x_sequential)
+
+        self.assertRaises(ValueError, X.set_smoother, 'foo')
+
+        pass
+
+    def test_time_homogeneous(self):
+        """
+        Test that shared dynamics are not copied for each time instance.
+        """
+
+        N = 10
+        D = 2
+        M = 3
+        A_mean = 0.3 * np.random.randn(D,D)
+        v = np.random.rand(D) + 0.5
+        Y = np.random.randn(M,N,D)
+
+        results = []
+        for A in [Gaussian(A_mean, np.identity(D)),
+                  Gaussian(A_mean*np.ones((N-1,1,1)), np.identity(D))]:
+            X = GaussianMarkovChain(np.zeros(D), np.identity(D), A, v, 
+                                    n=N, plates=(M,))
+            Z = Gaussian(X, np.identity(D), plates=(M,N))
+            Z.observe(Y)
+            X.update()
+            results.append((X.get_moments() + [X.g], 
+                            X._message_to_parent(2),
+                            X.lower_bound_contribution()))
+
+        # Only one super-diagonal block from the shared parents
+        X = GaussianMarkovChain(np.zeros(D), np.identity(D), 
+                                Gaussian(A_mean, np.identity(D)), v, 
+                                n=N, plates=(M,))
+        (phi, _) = X._get_phi_and_cgf_from_parents()
+        self.assertEqual(np.shape(phi[2]), (1,1,D,D))
+
+        # Identical posterior
+        for (u_shared, u_varying) in zip(results[0][0], results[1][0]):
+            self.assertAllClose(u_shared, u_varying)
+        self.assertAllClose(results[0][2], results[1][2])
+
+        # The message to the shared parent is summed over time
+        for (m_shared, m_varying) in zip(results[0][1], results[1][1]):
+            self.assertAllClose(m_shared, np.sum(m_varying, axis=0))
+
+        # No transitions in a chain of one time instance
+        A = Gaussian(A_mean, np.identity(D))
+        X = GaussianMarkovChain(np.zeros(D), np.identity(D), A, v, 
+                                n=1, plates=(M,))
+        Z = Gaussian(X, np.identity(D), plates=(M,1))
+        Z.observe(Y[:,:1])
+        X.update()
+        m = X._message_to_parent(2)
+        self.assertAllClose(m[0], np.zeros((D,D)))
+        self.assertAllClose(m[1], np.zeros((D,D,D)))
+        A.update()
+        self.assertAllClose(A.u[0], A_mean)
+
+        pass
+
 
 class TestVaryingGaussianMarkovChain(TestCase):
 
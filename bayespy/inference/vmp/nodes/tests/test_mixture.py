@@ -31,6 +31,7 @@ from ..gaussian import GaussianARD
 from ..gamma import Gamma
 from ..mixture import Mixture
 from ..categorical import Categorical
+from ..categorical_markov_chain import CategoricalMarkovChain
 
 from bayespy.utils import random
 from bayespy.utils import linalg
@@ -238,3 +239,71 @@ class TestMixture(TestCase):
                               mask[:,None,:,None])
                          
         pass
+
+    def test_truncation(self):
+        """
+        Test truncated responsibilities of Mixture node.
+        """
+
+        K = 4
+        N = 6
+        p = np.random.dirichlet(np.ones(K), size=N)
+        p[0] = [0.7, 0.2, 0.06, 0.04]
+        Z = Categorical(p)
+        Mu = GaussianARD(np.random.randn(K,2), 1,
+                         shape=(2,),
+                         plates=(K,))
+        Mu.initialize_from_random()
+        y = np.random.randn(N,2)
+
+        # Keep the two most probable clusters
+        X = Mixture(Z, GaussianARD, Mu, 2, truncation=2)
+        X.observe(y)
+        q = X._distribution.responsibilities(p)
+        self.assertAllClose(q[0], [0.7/0.9, 0.2/0.9, 0, 0])
+        self.assertArrayEqual(np.sum(q > 0, axis=-1), 2*np.ones(N))
+        self.assertAllClose(np.sum(q, axis=-1), np.ones(N))
+
+        # The parameters are averaged over the kept clusters
+        (mu, mumu) = Mu._message_to_child()
+        phi = X._distribution.compute_phi_from_parents(Z._message_to_child(),
+                                                       [mu, mumu],
+                                                       [2, np.log(2)])
+        self.assertAllClose(phi[0], 2 * np.dot(q, mu))
+
+        # The messages to the cluster parameters are summed from the kept
+        # clusters only
+        m = X._message_to_parent(1)
+        self.assertAllClose(m[0], 2 * np.dot(q.T, y))
+        self.assertAllClose(utils.get_diag(m[1]), 
+                            -np.sum(q, axis=0)[:,None] * np.ones(2))
+
+        # NumPy integers are numbers of clusters, too
+        X = Mixture(Z, GaussianARD, Mu, 2, truncation=np.int64(2))
+        self.assertAllClose(X._distribution.responsibilities(p), q)
+        self.assertRaises(ValueError, 
+                          Mixture, Z, GaussianARD, Mu, 2, truncation=True)
+
+        # Drop the responsibilities below a threshold
+        X = Mixture(Z, GaussianARD, Mu, 2, truncation=0.1)
+        q = X._distribution.responsibilities(p)
+        self.assertAllClose(q[0], [0.7/0.9, 0.2/0.9, 0, 0])
+        self.assertTrue(np.all(np.logical_or(q == 0, q >= 0.1)))
+
+        # The bound is computed for the truncated responsibilities
+        X = Mixture(Z, GaussianARD, Mu, 2, truncation=2)
+        X.observe(y)
+        q = X._distribution.responsibilities(p)
+        L = X._message_to_parent(0)[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            L_z = np.where(q > 0, q * (np.log(p) - np.log(q)), 0)
+        self.assertAllClose(X.lower_bound_contribution()
+                            + Z.lower_bound_contribution(),
+                            np.sum(X.f * np.ones(N)) + np.sum(q*L) + np.sum(L_z))
+
+        # The terms of other assignment nodes can not be corrected
+        Z = CategoricalMarkovChain(np.ones(K)/K, np.ones((K,K))/K, states=N)
+        self.assertRaises(ValueError,
+                          Mixture, Z, GaussianARD, Mu, 2, truncation=2)
+
+        pass
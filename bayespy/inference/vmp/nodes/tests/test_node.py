@@ -231,6 +231,120 @@ class TestNode(unittest.TestCase):
                           (4,),
                           (1,))
 
+    def test_message_cache(self):
+        """
+        Test that messages are cached until their inputs change.
+        """
+
+        from ..gaussian import GaussianARD
+        from ..gamma import Gamma
+        from ..dot import SumMultiply
+
+        X = GaussianARD(0, 1, shape=(2,), plates=(3,))
+        W = GaussianARD(1, 1, shape=(2,))
+        tau = Gamma(2, 2)
+        F = SumMultiply('i,i', X, W)
+        Y = GaussianARD(F, tau)
+        Y.observe(np.random.randn(3))
+
+        # Count the computations
+        calls = {'moments': 0, 'messages': 0}
+        compute_moments = F._compute_moments
+        def _compute_moments(*u):
+            calls['moments'] += 1
+            return compute_moments(*u)
+        F._compute_moments = _compute_moments
+        get_message = F._get_message_to_parent
+        def _get_message_to_parent(index):
+            calls['messages'] += 1
+            return get_message(index)
+        F._get_message_to_parent = _get_message_to_parent
+
+        # Moments of the deterministic node are reused
+        u0 = F.get_moments()
+        u1 = F.get_moments()
+        self.assertEqual(calls['moments'], 1)
+        testing.assert_allclose(u0[0], u1[0])
+
+        # Messages are reused
+        m0 = X._message_from_children()
+        m1 = X._message_from_children()
+        self.assertEqual(calls['messages'], 1)
+        testing.assert_allclose(m0[0], m1[0])
+        testing.assert_allclose(m0[1], m1[1])
+
+        # Updating a parent invalidates the moments and the messages to the
+        # other parents but not to the updated one
+        W.update()
+        self.assertEqual(calls['messages'], 2)
+        F.get_moments()
+        self.assertEqual(calls['moments'], 2)
+        X._message_from_children()
+        self.assertEqual(calls['messages'], 3)
+        W._message_from_children()
+        self.assertEqual(calls['messages'], 3)
+
+        # Updating a co-parent of the child invalidates the messages
+        tau.update()
+        X._message_from_children()
+        self.assertEqual(calls['messages'], 4)
+
+        # New observations invalidate the messages
+        Y.observe(np.random.randn(3))
+        m2 = X._message_from_children()
+        self.assertEqual(calls['messages'], 5)
+        self.assertFalse(np.allclose(m0[0], m2[0]))
+
+        # Moments replaced directly invalidate the messages
+        W.u[0] = W.u[0] + 1
+        X._message_from_children()
+        self.assertEqual(calls['messages'], 6)
+
+        pass
+
+    def test_message_blocks(self):
+        """
+        Test that messages computed in blocks of plates equal the full ones.
+        """
+
+        from ..gaussian import GaussianARD
+        from ..gamma import Gamma
+
+        def check(plates, plates_mu, plates_tau, block_size, mask=True):
+            mu = GaussianARD(np.random.randn(*(plates_mu+(2,))), 
+                             1, 
+                             shape=(2,),
+                             plates=plates_mu)
+            tau = Gamma(2, 2, plates=plates_tau+(2,))
+            tau.initialize_from_value(np.random.gamma(2, 
+                                                      size=plates_tau+(2,)))
+            y = np.random.randn(*(plates+(2,)))
+            Y = GaussianARD(mu, tau, shape=(2,), plates=plates)
+            Y.observe(y, mask=mask)
+            Z = GaussianARD(mu, tau, shape=(2,), plates=plates,
+                            message_block_size=block_size)
+            Z.observe(y, mask=mask)
+            if block_size < np.prod(plates):
+                self.assertIsNotNone(Z._message_blocks(0))
+            for index in range(2):
+                m_y = Y._message_to_parent(index)
+                m_z = Z._message_to_parent(index)
+                for (my, mz) in zip(m_y, m_z):
+                    testing.assert_allclose(mz, my)
+
+        # Sum over all plates
+        check((10,), (), (), 3)
+        # Block size larger than the plates
+        check((10,), (), (), 20)
+        # Sum over one of the plates
+        check((10,4), (1,4), (4,), 7)
+        check((10,4), (10,1), (10,1), 7)
+        # Missing values
+        check((10,4), (4,), (), 5, 
+              mask=np.random.rand(10,4) < 0.5)
+
+        pass
+
 class TestSlice(utils.TestCase):
 
     def test_init(self):
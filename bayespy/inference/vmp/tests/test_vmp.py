@@ -0,0 +1,736 @@
+######################################################################
+# Copyright (C) 2014 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `vmp` module.
+"""
+
+import os
+import tempfile
+
+import h5py
+import numpy as np
+
+from bayespy.inference.vmp.nodes.gaussian import Gaussian, GaussianARD
+from bayespy.inference.vmp.nodes.wishart import Wishart
+from bayespy.inference.vmp.nodes.dirichlet import Dirichlet
+from bayespy.inference.vmp.nodes.categorical import Categorical
+from bayespy.inference.vmp.nodes.mixture import Mixture
+from bayespy.inference.vmp.nodes.gamma import Gamma
+from bayespy.inference.vmp.nodes.dot import SumMultiply
+
+from ..vmp import VB
+
+from bayespy.utils.utils import TestCase
+
+class TestVBStochastic(TestCase):
+
+    def test_full_batch(self):
+        """
+        Test that full batches with unit steps give standard VB updates
+        """
+
+        N = 10
+        data = np.random.randn(N) + 3
+
+        # Standard VB
+        mu = GaussianARD(0, 1e-3)
+        tau = Gamma(1e-3, 1e-3)
+        Y = GaussianARD(mu, tau, plates=(N,))
+        Y.observe(data)
+        Q = VB(Y, mu, tau)
+        Q.update(mu, tau, repeat=5, tol=0)
+
+        # Stochastic VB with the full data as the mini-batch
+        mu_svi = GaussianARD(0, 1e-3)
+        tau_svi = Gamma(1e-3, 1e-3)
+        Y_svi = GaussianARD(mu_svi, tau_svi, plates=(N,))
+        Q_svi = VB(Y_svi, mu_svi, tau_svi)
+        Q_svi.update_stochastic(mu_svi, tau_svi,
+                                data={Y_svi: data},
+                                batch_size=N,
+                                repeat=5,
+                                schedule=lambda i: 1.0)
+
+        self.assertAllClose(mu_svi.u[0], mu.u[0])
+        self.assertAllClose(mu_svi.u[1], mu.u[1])
+        self.assertAllClose(tau_svi.u[0], tau.u[0])
+        self.assertAllClose(tau_svi.u[1], tau.u[1])
+        self.assertEqual(Q_svi.iter, 5)
+
+        pass
+
+    def test_message_scaling(self):
+        """
+        Test that the mini-batch messages are scaled
+        """
+
+        N = 10
+        B = 5
+        data = np.random.randn(N)
+        mu = GaussianARD(0, 1)
+        Y = GaussianARD(mu, 1, plates=(B,))
+        Q = VB(Y, mu)
+        Q.update_stochastic(mu,
+                            data={Y: data},
+                            batch_size=B,
+                            schedule=lambda i: 1.0)
+
+        # The posterior precision is as if the full data was used
+        self.assertAllClose(mu.phi[1], -0.5 * (1 + N))
+        # The mean uses the mini-batch scaled by N/B
+        y = Y.u[0]
+        self.assertAllClose(mu.phi[0], N / B * np.sum(y))
+
+        # Step lengths between the previous and the new parameters
+        phi0 = mu.phi[0]
+        Q.update_stochastic(mu,
+                            data={Y: data},
+                            batch_size=B,
+                            schedule=lambda i: 0.25)
+        y = Y.u[0]
+        self.assertAllClose(mu.phi[0],
+                            0.75 * phi0 + 0.25 * N / B * np.sum(y))
+        self.assertAllClose(mu.phi[1], -0.5 * (1 + N))
+
+        pass
+
+    def test_convergence(self):
+        """
+        Test that mini-batches find the full data posterior approximately
+        """
+
+        # Use seed for deterministic testing
+        np.random.seed(42)
+
+        N = 1000
+        data = np.random.randn(N) + 5
+        mu = GaussianARD(0, 1e-3)
+        Y = GaussianARD(mu, 1, plates=(50,))
+        Q = VB(Y, mu)
+        Q.update_stochastic(mu,
+                            data={Y: data},
+                            batch_size=50,
+                            repeat=100)
+        self.assertAllClose(mu.u[0], np.mean(data), rtol=0, atol=0.1)
+
+        pass
+
+    def test_errors(self):
+        """
+        Test that invalid mini-batch settings raise errors
+        """
+
+        mu = GaussianARD(0, 1)
+        Y = GaussianARD(mu, 1, plates=(5,))
+        Q = VB(Y, mu)
+        data = np.random.randn(10)
+        # Wrong plates for the mini-batch
+        self.assertRaises(ValueError,
+                          Q.update_stochastic,
+                          mu,
+                          data={Y: data},
+                          batch_size=4)
+        # Too large mini-batch
+        self.assertRaises(ValueError,
+                          Q.update_stochastic,
+                          mu,
+                          data={Y: data[:4]},
+                          batch_size=5)
+        # No global nodes
+        self.assertRaises(ValueError,
+                          Q.update_stochastic,
+                          data={Y: data},
+                          batch_size=5)
+
+        pass
+
+
+class TestVBUpdate(TestCase):
+
+    def test_early_stopping(self):
+        """
+        Test that the iteration stops when the bound converges
+        """
+
+        mu = GaussianARD(0, 1e-3)
+        tau = Gamma(1e-3, 1e-3)
+        Y = GaussianARD(mu, tau, plates=(20,))
+        Y.observe(np.random.randn(20) + 3)
+        # Start far from the optimum so that the iteration takes a while
+        mu.initialize_from_value(-10)
+        Q = VB(Y, mu, tau, tol=1e-6)
+        converged = Q.update(mu, tau, repeat=1000)
+        self.assertTrue(converged)
+        self.assertLess(Q.iter, 1000)
+        self.assertEqual(np.shape(Q.L), (Q.iter,))
+        self.assertEqual(np.shape(Q.l[mu]), (Q.iter,))
+        self.assertTrue(np.all(np.isfinite(Q.L)))
+        L = Q.L[-1]
+        self.assertLessEqual(abs(L - Q.L[-2]), 1e-6 * abs(L))
+
+        # Disabled early stopping
+        mu.initialize_from_value(-10)
+        Q = VB(Y, mu, tau)
+        converged = Q.update(mu, tau, repeat=50, tol=0)
+        self.assertFalse(converged)
+        self.assertEqual(Q.iter, 50)
+
+        pass
+
+    def test_bound_every(self):
+        """
+        Test computing the bound only every few iterations
+        """
+
+        mu = GaussianARD(0, 1e-3)
+        tau = Gamma(1e-3, 1e-3)
+        Y = GaussianARD(mu, tau, plates=(20,))
+        Y.observe(np.random.randn(20) + 3)
+        mu.initialize_from_value(-10)
+        Q = VB(Y, mu, tau)
+        Q.update(mu, tau, repeat=7, tol=0, bound_every=3)
+        self.assertEqual(Q.iter, 7)
+        # Bound is computed at iterations 3, 6 and the last one
+        self.assertEqual(list(np.nonzero(np.isfinite(Q.L))[0]), [2, 5, 6])
+
+        # Convergence is checked at the computed bounds only
+        mu.initialize_from_value(-10)
+        Q = VB(Y, mu, tau)
+        Q.update(mu, tau, repeat=1000, tol=1e-6, bound_every=4)
+        self.assertEqual(Q.iter % 4, 0)
+        self.assertLess(Q.iter, 1000)
+
+        pass
+
+    def test_changing_nodes(self):
+        """
+        Test reporting of the nodes that are still changing
+        """
+
+        mu = GaussianARD(0, 1e-3)
+        tau = Gamma(1e-3, 1e-3)
+        Y = GaussianARD(mu, tau, plates=(20,))
+        Y.observe(np.random.randn(20) + 3)
+        mu.initialize_from_value(-10)
+        Q = VB(Y, mu, tau)
+        # Nothing to compare yet
+        self.assertEqual(set(Q.get_changing_nodes()), {mu, tau, Y})
+        Q.update(mu, tau, repeat=2, tol=0)
+        self.assertIn(mu, Q.get_changing_nodes(tol=1e-6))
+        Q.update(mu, tau, repeat=1000, tol=1e-10)
+        self.assertEqual(Q.get_changing_nodes(tol=1e-4), [])
+
+        pass
+
+
+class TestVBDtype(TestCase):
+
+    def test_dtype(self):
+        """
+        Test single precision inference
+        """
+
+        y = np.random.randn(20) + 3
+        bounds = []
+        for dtype in [None, np.float32]:
+            mu = GaussianARD(0, 1e-3)
+            tau = Gamma(1e-3, 1e-3)
+            Y = GaussianARD(mu, tau, plates=(20,))
+            Y.observe(y)
+            mu.initialize_from_value(-10)
+            Q = VB(Y, mu, tau, dtype=dtype)
+            Q.update(mu, tau, repeat=10, tol=0)
+            bounds.append(Q.L)
+        for node in (mu, tau, Y):
+            self.assertEqual(node.dtype, np.float32)
+            for u in node.u:
+                self.assertEqual(u.dtype, np.float32)
+        for phi in mu.phi + tau.phi:
+            self.assertEqual(phi.dtype, np.float32)
+        # The bound is computed in double precision
+        self.assertEqual(np.asarray(Q.L).dtype, np.float64)
+        self.assertAllClose(bounds[1], bounds[0], rtol=1e-4)
+
+        self.assertRaises(ValueError, Q.set_dtype, int)
+
+        pass
+
+
+class TestVBSchedule(TestCase):
+
+    def _count_updates(self, *nodes):
+        """
+        Record the update calls of the nodes
+        """
+        calls = []
+        for node in nodes:
+            def update(node=node, update=node.update):
+                calls.append(node)
+                update()
+            node.update = update
+        return calls
+
+    def test_update_order(self):
+        """
+        Test the topological update order
+        """
+
+        tau = Gamma(1, 1, name='tau')
+        X = GaussianARD(0, tau, shape=(2,), name='X')
+        Y = GaussianARD(SumMultiply('i,i', X, X), 1, name='Y')
+        alpha = Gamma(1, 1, name='alpha')
+        Q = VB(Y, X, alpha, tau)
+        self.assertEqual(Q.get_update_order(), [alpha, tau, X, Y])
+
+        pass
+
+    def test_markov_blanket(self):
+        """
+        Test the Markov blankets through deterministic nodes
+        """
+
+        tau = Gamma(1, 1)
+        X = GaussianARD(0, 1, shape=(2,))
+        W = GaussianARD(0, 1, shape=(2,))
+        Y = GaussianARD(SumMultiply('i,i', X, W), tau)
+        self.assertEqual(VB._markov_blanket(X), {Y, W, tau})
+        self.assertEqual(VB._markov_blanket(tau), {Y, X, W})
+        self.assertEqual(VB._markov_blanket(Y), {X, W, tau})
+
+        pass
+
+    def test_skip_unchanged(self):
+        """
+        Test that nodes with unchanged neighbours are not updated
+        """
+
+        y1 = np.random.randn(10)
+        y2 = np.random.randn(10) + 3
+        def model():
+            # Two independent sub-models, the first converges in one step
+            mu1 = GaussianARD(0, 1)
+            Y1 = GaussianARD(mu1, 1, plates=(10,))
+            Y1.observe(y1)
+            mu2 = GaussianARD(0, 1e-3)
+            tau2 = Gamma(1e-3, 1e-3)
+            Y2 = GaussianARD(mu2, tau2, plates=(10,))
+            Y2.observe(y2)
+            return (mu1, mu2, tau2, Y1)
+
+        nodes = model()
+        Q = VB(*nodes)
+        Q.update(*nodes, repeat=10, tol=0)
+
+        nodes_skip = model()
+        calls = self._count_updates(*nodes_skip)
+        Q = VB(*nodes_skip)
+        Q.update(*nodes_skip, repeat=10, tol=0, skip_unchanged=True)
+
+        # The converged node is updated only in the first iteration and
+        # observed nodes never change
+        self.assertEqual(calls.count(nodes_skip[0]), 1)
+        self.assertEqual(calls.count(nodes_skip[3]), 1)
+        self.assertEqual(calls.count(nodes_skip[1]), 10)
+        for (node, node_skip) in zip(nodes, nodes_skip):
+            self.assertAllClose(node_skip.u[0], node.u[0])
+            self.assertAllClose(node_skip.u[1], node.u[1])
+
+        pass
+
+    def test_priority(self):
+        """
+        Test prioritizing the nodes with the largest bound changes
+        """
+
+        mu1 = GaussianARD(0, 1)
+        Y1 = GaussianARD(mu1, 1, plates=(10,))
+        Y1.observe(np.random.randn(10))
+        mu2 = GaussianARD(0, 1e-3)
+        tau2 = Gamma(1e-3, 1e-3)
+        Y2 = GaussianARD(mu2, tau2, plates=(10,))
+        Y2.observe(np.random.randn(10) + 3)
+        mu2.initialize_from_value(-10)
+        Q = VB(mu1, mu2, tau2, Y1, Y2)
+        Q.update(repeat=2, tol=0)
+        calls = self._count_updates(mu1, mu2, tau2)
+        Q.update(repeat=1, tol=0, priority=True)
+        # The converged node is updated last
+        self.assertEqual(calls[-1], mu1)
+
+        pass
+
+
+class TestVBLowerBound(TestCase):
+
+    def test_reuse_phi_from_update(self):
+        """
+        Test that the lower bound reuses the update-time parent terms
+        """
+
+        X = GaussianARD(0, 1, shape=(2,), plates=(10,))
+        W = GaussianARD(0, 1, shape=(2,))
+        tau = Gamma(1e-3, 1e-3)
+        Y = GaussianARD(SumMultiply('i,i', X, W), tau)
+        Y.observe(np.random.randn(10))
+        X.initialize_from_random()
+        calls = []
+        compute_phi = W._distribution.compute_phi_from_parents
+        def compute_phi_from_parents(*args, **kwargs):
+            calls.append(None)
+            return compute_phi(*args, **kwargs)
+        W._distribution.compute_phi_from_parents = compute_phi_from_parents
+
+        W.update()
+        self.assertEqual(len(calls), 1)
+        L = W.lower_bound_contribution()
+        self.assertEqual(len(calls), 1)
+
+        # Compare to the bound computed from scratch
+        del W._phi_from_parents
+        del W._cgf_from_parents
+        self.assertAllClose(L, W.lower_bound_contribution())
+        self.assertEqual(len(calls), 2)
+
+        # Recompute after the parents change
+        tau.update()
+        L = Y.lower_bound_contribution()
+        X.update()
+        self.assertNotEqual(L, Y.lower_bound_contribution())
+
+        pass
+
+    def test_incremental_bound(self):
+        """
+        Test recomputing the bound terms of the changed nodes only
+        """
+
+        y = np.random.randn(10)
+        x = np.random.randn(10, 2)
+        bounds = []
+        for incremental in [False, True]:
+            X = GaussianARD(0, 1, shape=(2,), plates=(10,))
+            W = GaussianARD(0, 1, shape=(2,))
+            tau = Gamma(1e-3, 1e-3)
+            Y = GaussianARD(SumMultiply('i,i', X, W), tau)
+            Y.observe(y)
+            X.initialize_from_value(x)
+            Q = VB(Y, X, W, tau, incremental_bound=incremental)
+            Q.update(X, W, tau, repeat=5, tol=0)
+            Q.update(X, W, repeat=3, tol=0)
+            bounds.append(Q.L)
+        self.assertAllClose(bounds[1], bounds[0])
+
+        # Only the terms of the changed nodes are recomputed
+        calls = []
+        for node in (X, W, tau, Y):
+            def lower_bound_contribution(node=node,
+                                         f=node.lower_bound_contribution):
+                calls.append(node)
+                return f()
+            node.lower_bound_contribution = lower_bound_contribution
+        Q.update(X, repeat=1, tol=0)
+        self.assertEqual(set(calls), {X, Y})
+
+        pass
+
+
+class TestVBPrune(TestCase):
+
+    def assertBoundIncreases(self, Q, repeat):
+        Q.update(repeat=repeat, tol=0)
+        L = Q.L[-repeat:]
+        self.assertTrue(np.all(np.isfinite(L)))
+        self.assertTrue(np.all(np.diff(L) > -1e-6 * np.abs(L[1:])))
+
+    def test_prune_clusters(self):
+        """
+        Test pruning empty clusters of a mixture
+        """
+
+        # Use seed for deterministic testing
+        np.random.seed(42)
+
+        (N, D, K) = (50, 2, 6)
+        y = np.concatenate([np.random.randn(N//2, D) + 5,
+                            np.random.randn(N//2, D) - 5])
+        alpha = Dirichlet(1e-3*np.ones(K))
+        z = Categorical(alpha, plates=(N,))
+        mu = Gaussian(np.zeros(D), 1e-5*np.identity(D), plates=(K,))
+        Lambda = Wishart(D, 1e-5*np.identity(D), plates=(K,))
+        Y = Mixture(z, Gaussian, mu, Lambda)
+        Y.observe(y)
+        z.initialize_from_random()
+        Q = VB(Y, mu, Lambda, z, alpha)
+        Q.update(repeat=100, tol=0)
+
+        p = z.u[0]
+        keep = (np.sum(p, axis=0) > 1e-6 * N)
+        K = np.count_nonzero(keep)
+        self.assertLess(K, 6)
+        L = Q.compute_lowerbound()
+        self.assertTrue(Q.prune(tol=1e-6))
+        # The terms of the removed clusters are kept in the bound
+        self.assertAllClose(Q.compute_lowerbound(), L)
+        self.assertEqual(z.dims, ((K,),))
+        self.assertEqual(alpha.dims, ((K,),))
+        self.assertEqual(mu.plates, (K,))
+        self.assertEqual(Lambda.plates, (K,))
+        self.assertEqual(np.shape(alpha.u[0]), (K,))
+        self.assertEqual(np.shape(mu.u[1]), (K, D, D))
+        self.assertAllClose(z.u[0], p[:,keep])
+        # Nothing left to prune
+        self.assertFalse(Q.prune(tol=1e-6))
+
+        # The pruned model can be learned further
+        self.assertBoundIncreases(Q, 10)
+
+        pass
+
+    def test_prune_ard(self):
+        """
+        Test pruning components shrunk by ARD
+        """
+
+        # Use seed for deterministic testing
+        np.random.seed(42)
+
+        (M, N, D) = (10, 50, 6)
+        w = np.random.randn(M, 1, 2)
+        x = np.random.randn(1, N, 2)
+        y = np.sum(w*x, axis=-1) + 0.1*np.random.randn(M, N)
+        alpha = Gamma(1e-2, 1e-2, plates=(D,))
+        W = GaussianARD(0, alpha, shape=(D,), plates=(M,1))
+        X = GaussianARD(0, 1, shape=(D,), plates=(1,N))
+        F = SumMultiply('i,i', W, X)
+        tau = Gamma(1e-2, 1e-2)
+        Y = GaussianARD(F, tau)
+        Y.observe(y)
+        X.initialize_from_random()
+        W.initialize_from_random()
+        Q = VB(Y, W, X, tau, alpha)
+        Q.update(repeat=100, tol=0)
+
+        e = np.sum(W.u[0]**2, axis=(0,1))
+        keep = (e > 1e-6 * np.amax(e))
+        D = np.count_nonzero(keep)
+        self.assertLess(D, 6)
+        L = Q.L[-1]
+        Q.update(repeat=5, tol=0, prune=1e-6)
+        # The bound does not jump when the components are removed
+        self.assertTrue(np.all(np.diff(np.append(L, Q.L[-5:])) > -1e-6*abs(L)))
+        self.assertEqual(W.dims, ((D,), (D,D)))
+        self.assertEqual(X.dims, ((D,), (D,D)))
+        self.assertEqual(alpha.plates, (D,))
+        self.assertEqual(np.shape(W.u[1]), (M, 1, D, D))
+        self.assertEqual(np.shape(X.phi[0]), (1, N, D))
+        self.assertEqual(F.dims, ((), ()))
+        self.assertBoundIncreases(Q, 10)
+
+        pass
+
+    def test_prune_errors(self):
+        """
+        Test that unsupported structures are not pruned
+        """
+
+        Lambda = Wishart(3, np.identity(3))
+        X = Gaussian(np.zeros(3), Lambda)
+        # Full covariance can not be marginalized by slicing
+        self.assertRaises(NotImplementedError,
+                          X.prune, -1, [True, False, True])
+        self.assertEqual(X.dims, ((3,), (3,3)))
+        self.assertEqual(Lambda.dims, ((3,3), ()))
+        # Can not prune everything
+        Y = GaussianARD(0, 1, shape=(3,))
+        self.assertRaises(ValueError, Y.prune, -1, [False, False, False])
+
+        # Nothing is pruned if any of the affected nodes can not be pruned
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'y.dat')
+            y = np.memmap(filename, dtype='float64', mode='w+', shape=(5,3))
+            y[...] = np.random.randn(5, 3)
+            alpha = Gamma(1, 1, plates=(3,))
+            X = GaussianARD(0, alpha, shape=(3,), plates=(5,))
+            Y = GaussianARD(X, 1, shape=(3,), plates=(5,))
+            Y.observe(y)
+            self.assertRaises(NotImplementedError,
+                              X.prune, -1, [True, False, True])
+            self.assertEqual(X.dims, ((3,), (3,3)))
+            self.assertEqual(np.shape(X.phi[1])[-2:], (3,3))
+            self.assertEqual(alpha.plates, (3,))
+            # The structure is checked before pruning anything
+            X.initialize_from_value(np.array([[1, 0, 1]] * 5))
+            Q = VB(Y, X, alpha)
+            self.assertRaises(ValueError, Q.prune)
+            self.assertEqual(X.dims, ((3,), (3,3)))
+            del y
+
+        # The dimensions of a mixture can not be pruned
+        alpha = Gamma(1, 1, plates=(3,))
+        mu = GaussianARD(0, alpha, shape=(3,), plates=(2,))
+        z = Categorical(0.5*np.ones(2), plates=(4,))
+        Y = Mixture(z, GaussianARD, mu, 1)
+        Y.observe(np.random.randn(4,3))
+        mu.initialize_from_value(np.array([[1, 0, 1]] * 2))
+        Q = VB(Y, mu, alpha, z)
+        self.assertRaises(ValueError, Q.prune)
+        self.assertEqual(mu.dims, ((3,), (3,3)))
+        self.assertEqual(alpha.plates, (3,))
+
+        pass
+
+
+class TestVBAutosave(TestCase):
+
+    def test_autosave(self):
+        """
+        Test writing the auto-saved file in the background
+        """
+
+        y = np.random.randn(20) + 3
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'autosave.hdf5')
+            mu = GaussianARD(0, 1e-3, name='mu')
+            tau = Gamma(1e-3, 1e-3, name='tau')
+            Y = GaussianARD(mu, tau, plates=(20,), name='Y')
+            Y.observe(y)
+            mu.initialize_from_value(-10)
+            Q = VB(Y, mu, tau,
+                   autosave_iterations=2,
+                   autosave_filename=filename,
+                   autosave_async=True)
+            Q.update(mu, tau, repeat=4, tol=0)
+            # The writing is finished when the iteration returns
+            self.assertIsNone(Q._autosave_thread)
+            u = [np.copy(ui) for ui in mu.u]
+            L = np.copy(Q.L)
+            # The file contains the state of the latest auto-save
+            Q.update(mu, tau, repeat=1, tol=0)
+            self.assertEqual(os.listdir(directory), ['autosave.hdf5'])
+            h5f = h5py.File(filename, 'r')
+            try:
+                self.assertEqual(h5f['iter'][...], 4)
+                self.assertAllClose(h5f['L'][...], L)
+                self.assertAllClose(h5f['nodes']['mu']['u0'][...], u[0])
+                self.assertAllClose(h5f['nodes']['mu']['u1'][...], u[1])
+            finally:
+                h5f.close()
+
+            # The synchronous auto-save writes the same state
+            mu = GaussianARD(0, 1e-3, name='mu')
+            tau = Gamma(1e-3, 1e-3, name='tau')
+            Y = GaussianARD(mu, tau, plates=(20,), name='Y')
+            Y.observe(y)
+            mu.initialize_from_value(-10)
+            Q = VB(Y, mu, tau,
+                   autosave_iterations=2,
+                   autosave_filename=filename)
+            Q.update(mu, tau, repeat=4, tol=0)
+            mu.initialize_from_value(0)
+            Q.load(mu)
+            self.assertAllClose(mu.u[0], u[0])
+
+        pass
+
+    def test_errors(self):
+        """
+        Test that writing errors are raised in the main thread
+        """
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'missing', 'autosave.hdf5')
+            mu = GaussianARD(0, 1e-3, name='mu')
+            tau = Gamma(1e-3, 1e-3, name='tau')
+            Y = GaussianARD(mu, tau, plates=(20,), name='Y')
+            Y.observe(np.random.randn(20) + 3)
+            Q = VB(Y, mu, tau,
+                   autosave_iterations=2,
+                   autosave_filename=filename,
+                   autosave_async=True)
+            # The error of the final auto-save is raised by the iteration
+            self.assertRaises(Exception, Q.update, mu, tau, repeat=2, tol=0)
+            # The error is raised only once
+            Q.wait_autosave()
+
+            # Errors of the synchronous auto-save are raised directly
+            Q = VB(Y, mu, tau,
+                   autosave_iterations=2,
+                   autosave_filename=filename)
+            self.assertRaises(Exception, Q.update, mu, tau, repeat=2, tol=0)
+
+        pass
+
+
+class TestVBIncrementalSave(TestCase):
+
+    def test_incremental(self):
+        """
+        Test updating the saved file in place
+        """
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'autosave.hdf5')
+            mu = GaussianARD(0, 1e-3, name='mu')
+            tau = Gamma(1e-3, 1e-3, name='tau')
+            Y = GaussianARD(mu, tau, plates=(20,), name='Y')
+            Y.observe(np.random.randn(20) + 3)
+            Q = VB(Y, mu, tau,
+                   autosave_iterations=2,
+                   autosave_filename=filename,
+                   autosave_async=True,
+                   autosave_incremental=True)
+            Q.update(mu, tau, repeat=4, tol=0)
+            calls = []
+            for node in (mu, tau, Y):
+                def save(group, node=node, f=node.save):
+                    calls.append(node)
+                    return f(group)
+                node.save = save
+            # Only the changed nodes are written
+            Q.update(mu, repeat=2, tol=0)
+            Q.wait_autosave()
+            self.assertEqual(calls, [mu])
+            Q.save(filename, incremental=True)
+            self.assertEqual(calls, [mu])
+            # Non-incremental save writes everything
+            Q.save(filename)
+            self.assertEqual(set(calls[1:]), {mu, tau, Y})
+
+            Q.update(mu, tau, repeat=2, tol=0)
+            Q.wait_autosave()
+            h5f = h5py.File(filename, 'r')
+            try:
+                self.assertEqual(h5f['iter'][...], 8)
+                self.assertAllClose(h5f['L'][...], Q.L)
+                self.assertAllClose(h5f['boundterms']['tau'][...], Q.l[tau])
+                self.assertEqual(h5f['L'].maxshape, (None,))
+                # Appending does not create tiny chunks
+                self.assertEqual(h5f['L'].chunks, (8192,))
+                self.assertAllClose(h5f['nodes']['mu']['u0'][...], mu.u[0])
+                self.assertAllClose(h5f['nodes']['tau']['u0'][...], tau.u[0])
+                self.assertIsNotNone(h5f['nodes']['Y']['u0'].chunks)
+            finally:
+                h5f.close()
+
+        pass
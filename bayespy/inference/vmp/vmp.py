@@ -28,11 +28,55 @@ import time
 import h5py
 import datetime
 import tempfile
+import threading
+import os
 
 from bayespy import utils
 
 from bayespy.inference.vmp.nodes.node import Node
 
+
+class _Snapshot():
+    """
+    In-memory copy of the data written by the save methods of the nodes.
+
+    Implements the part of the interface of HDF5 groups used for saving, so
+    the state can be copied quickly and written to a file later.
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.datasets = {}
+
+    def __contains__(self, name):
+        return name in self.groups or name in self.datasets
+
+    def require_group(self, name):
+        if name not in self.groups:
+            self.groups[name] = _Snapshot()
+        return self.groups[name]
+
+    def create_dataset(self, name, data=None, **kwargs):
+        # The arrays of the nodes may be modified in-place, thus copy
+        self.datasets[name] = (np.array(data), kwargs)
+
+    def write(self, group):
+        """
+        Write the snapshot into an HDF5 group.
+
+        Existing datasets are overwritten in place and resizable datasets
+        are appended.
+        """
+        for (name, (data, kwargs)) in self.datasets.items():
+            if kwargs.get('maxshape') is not None:
+                write = utils.utils.append_to_hdf5
+            else:
+                write = utils.utils.write_to_hdf5
+            write(group, data, name, compression=kwargs.get('compression'))
+        for (name, snapshot) in self.groups.items():
+            snapshot.write(group.require_group(name))
+
+
 class VB():
 
     def __init__(self,
@@ -40,7 +84,11 @@ class VB():
                  tol=1e-6, 
                  autosave_iterations=0, 
                  autosave_filename=None,
-                 callback=None):
+                 callback=None,
+                 incremental_bound=False,
+                 dtype=None,
+                 autosave_async=False,
+                 autosave_incremental=False):
 
         # Remove duplicate nodes
         self.model = utils.utils.unique(nodes)
@@ -63,47 +111,147 @@ class VB():
             self.autosave_filename = autosave_filename
             self.filename = autosave_filename
 
+        # Write the auto-saved files in a background thread while iterating.
+        # The methods which iterate wait for the writing before returning.
+        self.autosave_async = autosave_async
+        self._autosave_thread = None
+        self._autosave_error = None
+
+        # Update the auto-saved file in place and write only the changes
+        self.autosave_incremental = autosave_incremental
+        # The iteration and the moment stamps of the nodes in the saved files
+        self._saved = {}
+
         # Check uniqueness of the node names
         names = [node.name for node in self.model]
         if len(names) != len(self.model):
             raise Exception("Use unique names for nodes.")
 
+        self.tol = tol
+
+        # Recompute the lower bound terms only for the nodes that changed
+        self.incremental_bound = incremental_bound
+        self._bound_cache = {}
+
+        # Constant lower bound terms of the pruned components by node
+        self._bound_offset = {}
+
         self.callback = callback
         self.callback_output = None
 
+        # Floating point type of the nodes (e.g., single precision to save
+        # memory), by default the types of the nodes are kept
+        if dtype is not None:
+            self.set_dtype(dtype)
+
+    def set_dtype(self, dtype):
+        """
+        Set the floating point type of all the nodes in the model.
+
+        The lower bound is computed in double precision in any case.
+        """
+        for node in self.model:
+            node.set_dtype(dtype)
+
     def set_autosave(self, filename, iterations=None):
         self.autosave_filename = filename
         self.filename = filename
         if iterations is not None:
             self.autosave_iterations = iterations
 
-    def update(self, *nodes, repeat=1, plot=False):
+    def update(self, *nodes, repeat=1, plot=False, tol=None, bound_every=1,
+               skip_unchanged=False, priority=False, prune=None):
+        """
+        Update nodes until convergence or for a given number of iterations.
+
+        Parameters
+        ----------
+        nodes : nodes, optional
+            Nodes to update in the given order.  By default, all nodes.
+        repeat : int
+            Maximum number of iterations.
+        plot : bool
+            Plot the nodes after updating them.
+        tol : float, optional
+            Stop when the relative change of the lower bound is below this.
+            By default, the tolerance given to the constructor.  Zero or
+            negative values disable early stopping.
+        bound_every : int
+            Compute the lower bound (and check convergence) only every
+            `bound_every` iterations and after the last iteration.
+        skip_unchanged : bool
+            Skip updating a node if none of the nodes in its Markov blanket
+            have changed since its previous update.  A node is considered
+            changed if its moments changed more than the relative tolerance.
+            Observed nodes never change.  All nodes are updated in the first
+            iteration.
+        priority : bool
+            Update the nodes in the order of the latest absolute changes of
+            their lower bound terms, largest first.
+        prune : float, optional
+            Prune the dead components of the model after each iteration
+            using this relative threshold (see `prune`).
+        """
 
-        # TODO/FIXME:
-        #
-        # If no nodes are given and thus everything is updated, the update order
-        # should be from down to bottom. Or something similar..
+        if tol is None:
+            tol = self.tol
+        if bound_every < 1:
+            raise ValueError("bound_every must be a positive integer")
 
         # Append the cost arrays
         self.L = np.append(self.L, utils.utils.nans(repeat))
         for (node, l) in self.l.items():
             self.l[node] = np.append(l, utils.utils.nans(repeat))
 
-        # By default, update all nodes
+        # By default, update all nodes in topological order
         if len(nodes) == 0:
-            nodes = self.model
+            nodes = self.get_update_order()
+        nodes = [self[node] for node in nodes]
+
+        # Book-keeping for skipping nodes with unchanged neighbours
+        if skip_unchanged:
+            blankets = {X: self._markov_blanket(X) for X in nodes}
+            last_update = {}
+            last_change = {}
+            step = 0
 
+        converged = False
         for i in range(repeat):
             t = time.clock()
 
+            if priority:
+                order = self._prioritize(nodes)
+            else:
+                order = nodes
+
             # Update nodes
-            for node in nodes:
-                X = self[node]
+            for X in order:
                 if hasattr(X, 'update') and callable(X.update):
+                    if skip_unchanged:
+                        if (X in last_update and 
+                            all(last_change.get(Y, 0) <= last_update[X]
+                                for Y in blankets[X])):
+                            continue
+                        # Updates replace the moment arrays, so keeping the
+                        # references is enough
+                        stamp = X._moments_stamp()
+                        u_old = list(X.u)
                     X.update()
+                    if skip_unchanged:
+                        step += 1
+                        last_update[X] = step
+                        if ((stamp is None or X._moments_stamp() != stamp)
+                            and self._moments_changed(u_old, X.u, tol)):
+                            last_change[X] = step
                     if plot:
                         self.plot(X)
 
+            # Remove dead components so that the next iterations are cheaper
+            if prune is not None and self.prune(tol=prune):
+                if skip_unchanged:
+                    # Update all nodes in the next iteration
+                    last_update = {}
+
             # Call the custom function provided by the user
             if callable(self.callback):
                 z = self.callback()
@@ -115,56 +263,483 @@ class VB():
                         self.callback_output = np.concatenate((self.callback_output,z),
                                                               axis=-1)
 
-            # Compute lower bound
+            # Compute lower bound only every few iterations
+            if (i + 1) % bound_every != 0 and i + 1 < repeat:
+                print("Iteration %d: (%.3f seconds)"
+                      % (self.iter+1, time.clock()-t))
+                self.iter += 1
+                self._autosave()
+                continue
+
+            L_prev = self._previous_lowerbound()
             L = self.loglikelihood_lowerbound()
             print("Iteration %d: loglike=%e (%.3f seconds)" 
                   % (self.iter+1, L, time.clock()-t))
 
             # Check the progress of the iteration
-            if self.iter > 0:
+            if L_prev is not None:
                 # Check for errors
-                if self.L[self.iter-1] - L > 1e-6:
-                    L_diff = (self.L[self.iter-1] - L)
+                if L_prev - L > 1e-6:
+                    L_diff = (L_prev - L)
                     warnings.warn("Lower bound decreased %e! Bug somewhere or "
                                   "numerical inaccuracy?" % L_diff)
 
                 # Check for convergence
-                if L - self.L[self.iter-1] < 1e-12:
-                    print("Converged.")
+                if tol > 0 and abs(L - L_prev) <= tol * abs(L):
+                    converged = True
 
             self.L[self.iter] = L
             self.iter += 1
+            self._autosave()
+
+            if converged:
+                print("Converged.")
+                break
+
+        # Remove the unused iterations from the cost arrays
+        self.L = self.L[:self.iter]
+        for (node, l) in self.l.items():
+            self.l[node] = l[:self.iter]
+
+        if not converged and tol > 0:
+            changing = self.get_changing_nodes(tol=tol)
+            if len(changing) > 0:
+                print("Nodes still changing: %s" 
+                      % ', '.join(node.name for node in changing))
+
+        # Report errors of the latest auto-save
+        self.wait_autosave()
 
-            # Auto-save, if requested
-            if (self.autosave_iterations > 0 
-                and np.mod(self.iter, self.autosave_iterations) == 0):
+        return converged
 
-                self.save(self.autosave_filename)
-                print('Auto-saved to %s' % self.autosave_filename)
+    def prune(self, tol=1e-6):
+        """
+        Remove the dead components from the model.
+
+        Empty clusters of mixtures (with less than a fraction `tol` of the
+        assignments) and the components of GaussianARD nodes shrunk to zero
+        by ARD (with less than a fraction `tol` of the squared means of the
+        largest component) are removed from all the connected nodes.  Returns
+        True if anything was pruned.
+
+        The lower bound terms of the removed components (e.g., the
+        normalization of the prior over them) are kept as constants, thus the
+        lower bound is continuous over pruning and the bounds before and
+        after pruning are comparable.
+
+        All the dead components are checked before pruning any of them.
+        ValueError is raised if the model structure does not support pruning
+        them (e.g., a node which depends on the components is a deterministic
+        function without pruning support or a mixture whose dimensions would
+        change).
+        """
+        l_before = None
+        while True:
+            dead = [(node, node._dead_components(tol)) for node in self.model]
+            dead = [(node,) + d for (node, d) in dead if d is not None]
+            if len(dead) == 0:
+                break
+            for (node, X, axis, keep) in dead:
+                try:
+                    X._prune_checked_plan(axis, keep)
+                except NotImplementedError as error:
+                    raise ValueError("Can not prune the dead components "
+                                     "found by %s: %s" % (node.name, error))
+            if l_before is None:
+                l_before = {X: self._lower_bound_contribution(X)
+                            for X in self.model}
+            # Pruning changes the shapes, thus find the remaining dead
+            # components again
+            (node, X, axis, keep) = dead[0]
+            X.prune(axis, keep)
+        if l_before is None:
+            return False
+        self._bound_cache = {}
+        for X in self.model:
+            dl = l_before[X] - self._lower_bound_contribution(X)
+            self._bound_offset[X] = self._bound_offset.get(X, 0) + dl
+        return True
+
+    def get_update_order(self):
+        """
+        Return the updatable nodes of the model in topological order.
 
+        Parents are updated before their children.  Deterministic nodes are
+        traversed but not included.  Ties are resolved by the order of the
+        nodes in the model.
+        """
+        remaining = [node for node in self.model if self._is_updatable(node)]
+        order = []
+        while len(remaining) > 0:
+            for node in remaining:
+                parents = self._stochastic_parents(node)
+                if not any(parent in remaining for parent in parents):
+                    break
+            order.append(node)
+            remaining.remove(node)
+        return order
+
+    def _prioritize(self, nodes):
+        """
+        Sort nodes by the latest change of their lower bound terms.
+        """
+        L = self.L[:self.iter]
+        ind = np.nonzero(np.isfinite(L))[0]
+        if len(ind) < 2:
+            return nodes
+        (prev, last) = ind[-2:]
+        def change(node):
+            if node not in self.l:
+                return 0
+            dl = abs(self.l[node][last] - self.l[node][prev])
+            return dl if np.isfinite(dl) else np.inf
+        # Stable sort keeps the given order for equal changes
+        return sorted(nodes, key=lambda node: -change(node))
+
+    @staticmethod
+    def _is_updatable(node):
+        return hasattr(node, 'update') and callable(node.update)
+
+    @staticmethod
+    def _stochastic_parents(node):
+        """
+        Return the updatable parents, traversing through deterministic nodes.
+        """
+        parents = set()
+        for parent in node.parents:
+            if VB._is_updatable(parent):
+                parents.add(parent)
+            else:
+                parents |= VB._stochastic_parents(parent)
+        return parents
 
+    @staticmethod
+    def _stochastic_children(node):
+        """
+        Return the updatable children, traversing through deterministic nodes.
+        """
+        children = set()
+        for (child, _) in node.children:
+            if VB._is_updatable(child):
+                children.add(child)
+            else:
+                children |= VB._stochastic_children(child)
+        return children
+
+    @staticmethod
+    def _markov_blanket(node):
+        """
+        Return the parents, the children and the co-parents of a node.
+        """
+        children = VB._stochastic_children(node)
+        blanket = VB._stochastic_parents(node) | children
+        for child in children:
+            blanket |= VB._stochastic_parents(child)
+        blanket.discard(node)
+        return blanket
+
+    @staticmethod
+    def _moments_changed(u_old, u_new, tol):
+        """
+        Check whether the moments changed more than the relative tolerance.
+
+        Arrays modified in place and implicit arrays which were replaced are
+        considered changed.
+        """
+        for (u0, u1) in zip(u_old, u_new):
+            if u0 is u1:
+                if isinstance(u0, np.ndarray):
+                    return True
+                continue
+            if (isinstance(u0, utils.utils.ImplicitArray)
+                or isinstance(u1, utils.utils.ImplicitArray)):
+                return True
+            if np.shape(u0) != np.shape(u1):
+                return True
+            scale = np.max(np.abs(u0)) if np.size(u0) > 0 else 0
+            if np.any(np.abs(u1 - u0) > tol * scale):
+                return True
+        return False
+
+    def _autosave(self):
+        """
+        Auto-save, if requested
+        """
+        if (self.autosave_iterations > 0 
+            and np.mod(self.iter, self.autosave_iterations) == 0):
+
+            if self.autosave_async:
+                # Copy the state and let the inference continue while the
+                # file is written
+                filename = self.autosave_filename
+                self.wait_autosave()
+                (incremental, nodes) = self._checkpoint(
+                    filename,
+                    self.autosave_incremental)
+                snapshot = _Snapshot()
+                self._write(snapshot, nodes)
+                self._autosave_thread = threading.Thread(
+                    target=self._write_autosave,
+                    args=(snapshot, filename, incremental))
+                self._autosave_thread.start()
+            else:
+                self.save(self.autosave_filename,
+                          incremental=self.autosave_incremental)
+            print('Auto-saved to %s' % self.autosave_filename)
+
+    def _write_autosave(self, snapshot, filename, incremental):
+        # Run in the writer thread, errors are raised in the main thread
+        try:
+            self._write_file(snapshot.write, filename, incremental)
+        except Exception as error:
+            self._saved.pop(filename, None)
+            self._autosave_error = error
+
+    def wait_autosave(self):
+        """
+        Wait until the auto-saved file has been written.
+
+        An error from writing the file is raised here.
+        """
+        if self._autosave_thread is not None:
+            self._autosave_thread.join()
+            self._autosave_thread = None
+        if self._autosave_error is not None:
+            error = self._autosave_error
+            self._autosave_error = None
+            raise error
+
+    def __del__(self):
+        # Do not leave a partially written file behind
+        if getattr(self, '_autosave_thread', None) is None:
+            return
+        try:
+            self.wait_autosave()
+        except Exception as error:
+            warnings.warn("Auto-saving to %s failed: %s"
+                          % (self.autosave_filename, error))
+
+    def _previous_lowerbound(self):
+        """
+        Return the latest computed lower bound or None.
+        """
+        L = self.L[:self.iter]
+        L = L[np.isfinite(L)]
+        if len(L) == 0:
+            return None
+        return L[-1]
+
+    def get_changing_nodes(self, tol=None):
+        """
+        Return the nodes whose lower bound terms changed more than `tol`.
+
+        The change of each term between the two latest computed lower bounds
+        is compared to the magnitude of the total lower bound.
+        """
+        if tol is None:
+            tol = self.tol
+        L = self.L[:self.iter]
+        ind = np.nonzero(np.isfinite(L))[0]
+        if len(ind) < 2:
+            return list(self.model)
+        (prev, last) = ind[-2:]
+        changing = []
+        for node in self.model:
+            dl = self.l[node][last] - self.l[node][prev]
+            if not (abs(dl) <= tol * abs(L[last])):
+                changing.append(node)
+        return changing
+
+    def update_stochastic(self, *nodes, data=None, batch_size=None,
+                          plate_axis=0, repeat=1, local_iterations=1,
+                          delay=1.0, forgetting_rate=0.7, schedule=None):
+        """
+        Stochastic variational inference using mini-batches of the data.
+
+        At each iteration, a random mini-batch is taken from the full data and
+        set as the observations of the corresponding nodes.  The local nodes
+        (those not given as global nodes) are updated using the mini-batch,
+        and the global nodes take a natural gradient step in which the
+        messages from the local children are scaled by N/batch_size.
+
+        Parameters
+        ----------
+        nodes : nodes
+            The global nodes.  All the other nodes in the model are local.
+        data : dict
+            The full data sets, given as observed node -> array.  The plates
+            of the observed nodes must have length `batch_size` on the
+            mini-batch plate axis.
+        batch_size : int
+            Size of the mini-batches.
+        plate_axis : int
+            The plate axis of the data arrays along which mini-batches are
+            taken.  Negative values index from the end of the plates.
+        repeat : int
+            Number of iterations.
+        local_iterations : int
+            Number of times the local nodes are updated in each iteration.
+        delay, forgetting_rate : float
+            Parameters of the default step length schedule
+            (iteration + delay) ** (-forgetting_rate).
+        schedule : callable, optional
+            Custom step length schedule as a function of the iteration index.
+        """
+
+        if len(nodes) == 0:
+            raise ValueError("Give the global nodes")
+        if not data:
+            raise ValueError("Give the full data sets")
+        if batch_size is None or batch_size < 1:
+            raise ValueError("Give a positive mini-batch size")
+
+        global_nodes = [self[node] for node in nodes]
+        data = {self[node]: np.asanyarray(x) for (node, x) in data.items()}
+
+        # Check the data sets and the mini-batch plates
+        N = None
+        for (node, x) in data.items():
+            axis = plate_axis
+            if axis < 0:
+                axis += len(node.plates)
+            if axis < 0 or axis >= len(node.plates):
+                raise ValueError("Node %s does not have plate axis %d"
+                                 % (node.name, plate_axis))
+            if node.plates[axis] != batch_size:
+                raise ValueError("The plate axis %d of node %s has length "
+                                 "%d but the mini-batch size is %d"
+                                 % (plate_axis,
+                                    node.name,
+                                    node.plates[axis],
+                                    batch_size))
+            # The plate axes are the leading axes of the data arrays
+            n = np.shape(x)[axis]
+            if N is None:
+                N = n
+            elif N != n:
+                raise ValueError("The data sets have different sizes")
+        if batch_size > N:
+            raise ValueError("The mini-batch size is larger than the data set")
+
+        # Nodes updated using the mini-batch
+        local_nodes = [node for node in self.model
+                       if node not in global_nodes and node not in data]
+
+        # Scale the messages from the local children
+        multipliers = {}
+        for node in global_nodes:
+            multipliers[node] = {
+                child: N / batch_size
+                for (child, _) in node.children
+                if not self._is_global_child(child, global_nodes)
+            }
+
+        # Append the cost arrays (the bound is not computed)
+        self.L = np.append(self.L, utils.utils.nans(repeat))
+        for (node, l) in self.l.items():
+            self.l[node] = np.append(l, utils.utils.nans(repeat))
+
+        for i in range(repeat):
+            t = time.clock()
+
+            # Observe a random mini-batch
+            inds = np.random.choice(N, size=batch_size, replace=False)
+            for (node, x) in data.items():
+                axis = plate_axis
+                if axis < 0:
+                    axis += len(node.plates)
+                node.observe(np.take(x, inds, axis=axis))
+
+            # Update the local nodes
+            for j in range(local_iterations):
+                for node in local_nodes:
+                    if hasattr(node, 'update') and callable(node.update):
+                        node.update()
+
+            # Take a natural gradient step for the global nodes
+            if callable(schedule):
+                step = schedule(self.iter)
+            else:
+                step = (self.iter + delay) ** (-forgetting_rate)
+            for node in global_nodes:
+                node.update_natural_gradient(step,
+                                             multipliers=multipliers[node])
+
+            print("Iteration %d: step=%e (%.3f seconds)" 
+                  % (self.iter+1, step, time.clock()-t))
+
+            self.iter += 1
+            self._autosave()
+
+        # Report errors of the latest auto-save
+        self.wait_autosave()
+
+    @staticmethod
+    def _is_global_child(child, global_nodes):
+        """
+        Check whether the messages from a child do not depend on mini-batches.
+
+        Deterministic children are global if all their stochastic descendants
+        are global.
+        """
+        if child in global_nodes:
+            return True
+        if hasattr(child, 'update') and callable(child.update):
+            # A local stochastic node
+            return False
+        if len(child.children) == 0:
+            return False
+        return all(VB._is_global_child(grandchild, global_nodes)
+                   for (grandchild, _) in child.children)
 
     def compute_lowerbound(self):
         L = 0
         for node in self.model:
-            L += node.lower_bound_contribution()
+            L += self._lower_bound_term(node)
         return L
 
     def compute_lowerbound_terms(self, *nodes):
         if len(nodes) == 0:
             nodes = self.model
-        return {node: node.lower_bound_contribution()
+        return {node: self._lower_bound_term(node)
                 for node in nodes}
 
     def loglikelihood_lowerbound(self):
         L = 0
         for node in self.model:
-            lp = node.lower_bound_contribution()
+            lp = self._lower_bound_term(node)
             L += lp
             self.l[node][self.iter] = lp
             
         return L
 
+    def _lower_bound_term(self, node):
+        """
+        Return the lower bound term of a node in the model.
+
+        The constant terms of the pruned components are included.
+        """
+        return (self._lower_bound_contribution(node)
+                + self._bound_offset.get(node, 0))
+
+    def _lower_bound_contribution(self, node):
+        if self.incremental_bound:
+            return self._cached_lower_bound_contribution(node)
+        return node.lower_bound_contribution()
+
+    def _cached_lower_bound_contribution(self, node):
+        """
+        Return the lower bound term of a node, recomputing it only if needed.
+        """
+        stamp = node._lower_bound_stamp()
+        cached = self._bound_cache.get(node)
+        if stamp is not None and cached is not None and cached[0] == stamp:
+            return cached[1]
+        lp = node.lower_bound_contribution()
+        if stamp is not None:
+            self._bound_cache[node] = (stamp, lp)
+        return lp
+
     def plot_iteration_by_nodes(self):
         """
         Plot the cost function per node during the iteration.
@@ -188,17 +763,18 @@ class VB():
         return self.l
 
 
-    def save(self, filename=None):
+    def save(self, filename=None, incremental=False):
+        """
+        Save the state of the nodes and the iteration into an HDF5 file.
 
-        if self.iter == 0:
-            # Check HDF5 version.
-            if h5py.version.hdf5_version_tuple < (1,8,7): 
-                warnings.warn("WARNING! Your HDF5 version is %s. HDF5 versions "
-                              "<1.8.7 are not able to save empty arrays, thus "
-                              "you may experience problems if you for instance "
-                              "try to save before running any iteration steps."
-                              % str(h5py.version.hdf5_version_tuple))
-            
+        The file is written under a temporary name and renamed, thus an
+        interrupted save does not corrupt an existing file.
+
+        If `incremental` is True and the file was saved previously by this
+        object, the file is updated in place: only the nodes whose moments
+        have changed are written and the new iterations are appended to the
+        lower bound arrays.  The in-place update is not atomic.
+        """
 
         # By default, use the same file as for auto-saving
         if not filename:
@@ -207,31 +783,102 @@ class VB():
             else:
                 raise Exception("Filename must be given.")
 
-        # Open HDF5 file
-        h5f = h5py.File(filename, 'w')
+        # Finish a pending auto-save first (it may write the same file)
+        self.wait_autosave()
+        (incremental, nodes) = self._checkpoint(filename, incremental)
+        try:
+            self._write_file(lambda h5f: self._write(h5f, nodes),
+                             filename,
+                             incremental)
+        except:
+            self._saved.pop(filename, None)
+            raise
+
+    def _checkpoint(self, filename, incremental):
+        """
+        Find the nodes to save and mark their current state as saved.
+
+        Returns whether the file can be updated in place and the nodes.
+        """
+        saved = self._saved.get(filename)
+        if (not incremental
+            or saved is None
+            or saved[0] > self.iter
+            or not os.path.exists(filename)):
+            incremental = False
+            saved = (0, {})
+        stamps = {node: node._moments_stamp() for node in self.model}
+        nodes = [node for node in self.model
+                 if stamps[node] is None or saved[1].get(node) != stamps[node]]
+        self._saved[filename] = (self.iter, stamps)
+        return (incremental, nodes)
+
+    @staticmethod
+    def _write_file(write, filename, incremental=False):
+        """
+        Write an HDF5 file using the function `write(h5f)`.
 
+        A new file is written atomically, otherwise the file is updated in
+        place.
+        """
+        if incremental:
+            h5f = h5py.File(filename, 'a')
+            try:
+                write(h5f)
+            finally:
+                h5f.close()
+            return
+        tmpfile = filename + '.tmp'
+        h5f = h5py.File(tmpfile, 'w')
         try:
-            # Write each node
-            nodegroup = h5f.create_group('nodes')
-            for node in self.model:
-                if node.name == '':
-                    raise Exception("In order to save nodes, they must have "
-                                    "(unique) names.")
-                if hasattr(node, 'save') and callable(node.save):
-                    node.save(nodegroup.create_group(node.name))
-            # Write iteration statistics
-            utils.utils.write_to_hdf5(h5f, self.L, 'L')
-            utils.utils.write_to_hdf5(h5f, self.iter, 'iter')
-            if self.callback_output is not None:
-                utils.utils.write_to_hdf5(h5f, 
-                                          self.callback_output,
-                                          'callback_output')
-            boundgroup = h5f.create_group('boundterms')
-            for node in self.model:
-                utils.utils.write_to_hdf5(boundgroup, self.l[node], node.name)
-        finally:
-            # Close file
+            write(h5f)
+        except:
             h5f.close()
+            os.remove(tmpfile)
+            raise
+        h5f.close()
+        os.replace(tmpfile, filename)
+
+    def _write(self, h5f, nodes=None):
+        """
+        Write the state into an HDF5 group (or a snapshot).
+
+        Only the given nodes are written, by default all.
+        """
+        if nodes is None:
+            nodes = self.model
+
+        if self.iter == 0:
+            # Check HDF5 version.
+            if h5py.version.hdf5_version_tuple < (1,8,7): 
+                warnings.warn("WARNING! Your HDF5 version is %s. HDF5 versions "
+                              "<1.8.7 are not able to save empty arrays, thus "
+                              "you may experience problems if you for instance "
+                              "try to save before running any iteration steps."
+                              % str(h5py.version.hdf5_version_tuple))
+
+        # Write each node
+        nodegroup = h5f.require_group('nodes')
+        for node in self.model:
+            if node.name == '':
+                raise Exception("In order to save nodes, they must have "
+                                "(unique) names.")
+        for node in nodes:
+            if hasattr(node, 'save') and callable(node.save):
+                node.save(nodegroup.require_group(node.name))
+        # Write iteration statistics (the bounds of the finished iterations
+        # do not change, thus they can be appended)
+        utils.utils.append_to_hdf5(h5f, self.L[:self.iter], 'L')
+        utils.utils.write_to_hdf5(h5f, self.iter, 'iter')
+        if self.callback_output is not None:
+            utils.utils.write_to_hdf5(h5f, 
+                                      self.callback_output,
+                                      'callback_output')
+        boundgroup = h5f.require_group('boundterms')
+        for node in self.model:
+            utils.utils.append_to_hdf5(boundgroup,
+                                       self.l[node][:self.iter],
+                                       node.name)
 
     def load(self, *nodes, filename=None):
 
@@ -241,6 +888,9 @@ class VB():
                 filename = self.filename
             else:
                 raise Exception("Filename must be given.")
+
+        # The file may be still being written
+        self.wait_autosave()
             
         # Open HDF5 file
         h5f = h5py.File(filename, 'r')
@@ -35,6 +35,7 @@ from bayespy.inference.vmp.nodes.categorical import CategoricalMoments
 from bayespy.inference.vmp.nodes.gaussian import GaussianMoments
 
 from bayespy.utils import utils
+from bayespy.utils import linalg
 
 def timeseries_gaussian_mc(X, scale=2):
     """
@@ -492,7 +493,7 @@ def gaussian_mixture_logpdf(x, w, mu, Sigma):
     D = np.shape(x)[-1]
 
     # Cholesky decomposition of the covariance matrix
-    U = utils.m_chol(Sigma)
+    U = linalg.chol(Sigma)
 
     # Reshape x:
     # Shape(x)     = (N, 1, D)
@@ -502,11 +503,11 @@ def gaussian_mixture_logpdf(x, w, mu, Sigma):
     # Shape(v)     = (N, K, D)
     # Shape(z)     = (N, K)
     v = x - mu
-    z = np.einsum('...i,...i', v, utils.m_chol_solve(U, v))
+    z = np.einsum('...i,...i', v, linalg.chol_solve(U, v))
 
     # Log-determinant of Sigma:
     # Shape(ldet)  = (K,)
-    ldet = utils.m_chol_logdet(U)
+    ldet = linalg.chol_logdet(U)
 
     # Compute log pdf for each cluster:
     # Shape(lpdf)  = (N, K)
@@ -27,6 +27,7 @@ General numerical functions and methods.
 """
 
 import itertools
+from concurrent import futures
 import numpy as np
 import scipy as sp
 #import scipy.linalg.decomp_cholesky as decomp
@@ -44,28 +45,104 @@ import scipy.sparse as sparse
 #from .utils import nested_iterator
 from . import utils
 
+# Number of rows in the blocks of the plate-wise triangular solves
+_SOLVE_BLOCK_SIZE = 64
+
 def chol(C):
+    """
+    Compute the upper triangular Cholesky factors U (C = U.T*U).
+
+    The last two axes of C are considered as the matrix and the other axes as
+    plates.  The matrices of all plates are factorized with a single stacked
+    LAPACK call.
+    """
     if sparse.issparse(C):
         # Sparse Cholesky decomposition (returns a Factor object)
         return cholmod.cholesky(C)
     else:
-        # Computes Cholesky decomposition for a collection of matrices.
-        # The last two axes of C are considered as the matrix.
         C = np.atleast_2d(C)
-        U = np.empty(np.shape(C))
-        for i in utils.nested_iterator(np.shape(U)[:-2]):
-            try:
-                U[i] = linalg.cho_factor(C[i])[0]
-            except np.linalg.linalg.LinAlgError:
-                print(C[i])
-                raise Exception("Matrix not positive definite")
-        return U
+        try:
+            L = np.linalg.cholesky(C)
+        except np.linalg.LinAlgError:
+            raise np.linalg.LinAlgError("Matrix not positive definite")
+        return np.swapaxes(L, -1, -2)
+
+def _solve_triangular_plates(U, B, lower=False, trans=False):
+    """
+    Solve U*X=B (or U.T*X=B) for a collection of triangular matrices U.
+
+    U has shape (...,D,D) and B has shape (...,D,M), the plates are
+    broadcasted.  Only the given triangle of U is used.  The system is solved
+    in blocks of rows for all plates at once: the diagonal blocks by
+    substitution and the remaining rows by matrix products.  The blocks
+    depend only on D, thus the result of each plate does not depend on the
+    other plates.
+    """
+    U = np.asarray(U)
+    B = np.asarray(B)
+    dtype = np.result_type(U, B, np.float32)
+    plates = utils.broadcasted_shape(np.shape(U)[:-2], np.shape(B)[:-2])
+    U = np.broadcast_to(U, plates + np.shape(U)[-2:])
+    X = np.empty(plates + np.shape(B)[-2:], dtype=dtype)
+    X[...] = B
+    if trans:
+        U = np.swapaxes(U, -1, -2)
+        lower = not lower
+    D = np.shape(U)[-1]
+
+    limits = list(range(0, D, _SOLVE_BLOCK_SIZE)) + [D]
+    blocks = list(zip(limits[:-1], limits[1:]))
+    if not lower:
+        blocks = blocks[::-1]
+    for (start, end) in blocks:
+        # Subtract the solved rows
+        known = slice(0, start) if lower else slice(end, D)
+        if known.stop > known.start:
+            X[...,start:end,:] -= np.matmul(U[...,start:end,known],
+                                            X[...,known,:])
+        # Forward (or back) substitution within the block, one row for all
+        # plates at a time
+        rows = range(start, end) if lower else range(end-1, start-1, -1)
+        for i in rows:
+            known = slice(start, i) if lower else slice(i+1, end)
+            X[...,i,:] -= np.einsum('...j,...jm->...m',
+                                    U[...,i,known],
+                                    X[...,known,:])
+            X[...,i,:] /= U[...,i,i,None]
+    return X
+
+def _log_diag(U):
+    """
+    Compute the logarithm of the diagonal of matrices in double precision.
+
+    Log-determinants are accumulated in double precision also for single
+    precision matrices.
+    """
+    return np.log(np.asarray(np.einsum('...ii->...i', U),
+                             dtype=np.float64))
 
 def chol_solve(U, b, out=None, matrix=False):
     if isinstance(U, np.ndarray):
         if sparse.issparse(b):
             b = b.toarray()
 
+        if np.ndim(U) > 2:
+            # Solve all plates at once with two triangular solves
+            if matrix:
+                if np.ndim(b) < 2:
+                    raise ValueError("b is not a matrix")
+                x = _solve_triangular_plates(U, b, trans=True)
+                x = _solve_triangular_plates(U, x)
+            else:
+                x = _solve_triangular_plates(U, 
+                                             np.asarray(b)[...,None], 
+                                             trans=True)
+                x = _solve_triangular_plates(U, x)[...,0]
+            if out is None:
+                return x
+            out[...] = x
+            return out
+
         if matrix:
             if np.ndim(b) < 2:
                 raise ValueError("b is not a matrix")
@@ -90,7 +167,7 @@ def chol_solve(U, b, out=None, matrix=False):
             # Shape of the result (broadcasting rules)
             sh = utils.broadcasted_shape(sh_u, sh_b)
             #out = np.zeros(np.shape(B))
-            out = np.zeros(sh + B.shape[-1:])
+            out = np.zeros(sh + B.shape[-1:], dtype=np.result_type(U, B))
         for i in utils.nested_iterator(np.shape(U)[:-2]):
 
             # The goal is to run Cholesky solver once for all vectors of B
@@ -138,6 +215,12 @@ def chol_solve(U, b, out=None, matrix=False):
 
 def chol_inv(U):
     if isinstance(U, np.ndarray):
+        if np.ndim(U) > 2:
+            # Invert all plates at once with two triangular solves
+            I = np.identity(np.shape(U)[-1])
+            V = _solve_triangular_plates(U, I, trans=True)
+            return _solve_triangular_plates(U, V)
+
         # Allocate memory
         V = np.tile(np.identity(np.shape(U)[-1]), np.shape(U)[:-2]+(1,1))
         for i in utils.nested_iterator(np.shape(U)[:-2]):
@@ -156,16 +239,121 @@ def chol_inv(U):
 
 def chol_logdet(U):
     if isinstance(U, np.ndarray):
-        return 2*np.sum(np.log(np.einsum('...ii->...i',U)), axis=-1)
+        return 2*np.sum(_log_diag(U), axis=-1)
     elif isinstance(U, cholmod.Factor):
         return np.sum(np.log(U.D()))
     else:
         raise ValueError("Unknown type of Cholesky factor")
     
+def _unique_matrices(C, search=True):
+    """
+    Find the unique matrices of a collection of matrices.
+
+    Broadcasted plate axes (with zero strides) are reduced to length one.  If
+    `search` is True, also the plate axes along which the matrices are equal
+    are reduced and the duplicates among the remaining plates are searched.
+    Returns the unique matrices as a stack and the indices of the matrices of
+    the remaining plates in that stack, or None as the indices if there are
+    no duplicates among the remaining plates.
+    """
+    C = np.asarray(C)
+    for axis in range(np.ndim(C)-2):
+        if np.shape(C)[axis] > 1:
+            C0 = C[(slice(None),)*axis + (slice(0,1),)]
+            if C.strides[axis] == 0 or (search and np.all(C == C0)):
+                C = C0
+    plates = np.shape(C)[:-2]
+    if not search or np.prod(plates) <= 1:
+        return (C, None)
+    D = np.shape(C)[-2:]
+    C = np.reshape(C, (-1,) + D)
+    # Quick check: duplicates must have equal first elements
+    if len(np.unique(C[:,0,0])) == len(C):
+        return (np.reshape(C, plates + D), None)
+    C = np.ascontiguousarray(C)
+    # View each matrix as a single element in order to sort them
+    rows = np.reshape(C, (len(C), -1))
+    rows = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1])))
+    rows = rows[:,0]
+    (_, first, index) = np.unique(rows, 
+                                  return_index=True, 
+                                  return_inverse=True)
+    if len(first) == len(rows):
+        return (np.reshape(C, plates + D), None)
+    return (C[first], np.reshape(index, plates))
+
+class Cholesky():
+    """
+    Cholesky decomposition of a collection of positive-definite matrices.
+
+    The last two axes are the matrices and the other axes are plates.  All the
+    matrices are factorized in one vectorized call, and solving, inverting and
+    computing the log-determinant reuse the same triangular factors.  The
+    inverse is computed only if requested.
+
+    Broadcasted plate axes of the matrices (with zero strides) are kept as
+    singleton axes in the results, which broadcast to the original plates.
+    If `unique` is True, the matrices are also searched for equal matrices
+    and only the unique matrices are factorized.  The search costs a pass
+    over all the matrices, thus it pays off only if duplicates are likely.
+    """
+
+    def __init__(self, C, unique=False):
+        C = np.atleast_2d(C)
+        self._index = None
+        if np.ndim(C) > 2:
+            (C, self._index) = _unique_matrices(C, search=unique)
+        try:
+            self.L = np.linalg.cholesky(C)
+        except np.linalg.LinAlgError:
+            raise np.linalg.LinAlgError("Matrix not positive definite")
+        self._inv = None
+
+    def _expand(self, X):
+        """
+        Map the results for the unique matrices to the plates.
+        """
+        if self._index is None:
+            return X
+        return X[self._index]
+
+    def logdet(self):
+        """
+        Compute the log-determinant of the matrices.
+        """
+        return self._expand(2*np.sum(_log_diag(self.L), axis=-1))
+
+    def inv(self):
+        """
+        Compute the inverse of the matrices.
+        """
+        if self._inv is None:
+            # Two triangular solves against the identity
+            I = np.identity(np.shape(self.L)[-1])
+            L_inv = _solve_triangular_plates(self.L, I, lower=True)
+            self._inv = self._expand(_solve_triangular_plates(self.L, 
+                                                              L_inv,
+                                                              lower=True,
+                                                              trans=True))
+        return self._inv
+
+    def solve(self, b, matrix=False):
+        """
+        Solve the linear systems for vectors b (or matrices if matrix=True).
+        """
+        L = self._expand(self.L)
+        if not matrix:
+            b = np.asarray(b)[...,None]
+        x = _solve_triangular_plates(L, b, lower=True)
+        x = _solve_triangular_plates(L, x, lower=True, trans=True)
+        if not matrix:
+            x = x[...,0]
+        return x
+
 def logdet_chol(U):
     if isinstance(U, np.ndarray):
         # Computes Cholesky decomposition for a collection of matrices.
-        return 2*np.sum(np.log(np.einsum('...ii->...i', U)), axis=(-1,))
+        return 2*np.sum(_log_diag(U), axis=(-1,))
     elif isinstance(U, cholmod.Factor):
         return np.sum(np.log(U.D()))
     
@@ -178,7 +366,18 @@ def logdet_tri(R):
 def logdet_cov(C):
     return logdet_chol(chol(C))
 
-def solve_triangular(U, B, **kwargs):
+def solve_triangular(U, B, trans=0, lower=False, **kwargs):
+
+    if np.ndim(U) > 2:
+        # Solve all plates at once
+        return _solve_triangular_plates(U, 
+                                        np.asarray(B)[...,None], 
+                                        lower=lower,
+                                        trans=(trans in (1, 'T', 'C')))[...,0]
+
+    kwargs['trans'] = trans
+    kwargs['lower'] = lower
+
     # Allocate memory
     U = np.atleast_2d(U)
     B = np.atleast_1d(B)
@@ -330,7 +529,7 @@ def m_dot(A,b):
     # TODO: Use einsum!!
     #return np.sum(A*b[...,np.newaxis,:], axis=(-1,))
 
-def block_banded_solve(A, B, y):
+def block_banded_solve(A, B, y, chunks=1, pool='thread', method='sequential'):
     """
     Invert symmetric, banded, positive-definite matrix.
 
@@ -351,11 +550,107 @@ def block_banded_solve(A, B, y):
 
     Assume each block has the same size.
 
+    If `chunks` is larger than one, the plates (the leading axes) are
+    split into chunks along the longest plate axis and the chunks are
+    solved in parallel using a pool of workers. The results are
+    identical to the serial solution. `pool` is either 'thread',
+    'process' or an existing `concurrent.futures.Executor`.
+
+    `method` selects the algorithm. 'sequential' runs the forward and
+    backward recursions over the N blocks. 'cyclic' uses odd-even cyclic
+    reduction, which needs only about log2(N) levels of operations
+    vectorized over the blocks, thus it is much faster for long chains.
+
     Return:
     * inverse blocks
     * solution to the system
     * log-determinant
     """
+
+    if method == 'sequential':
+        solve = _block_banded_solve
+    elif method == 'cyclic':
+        solve = _cyclic_block_banded_solve
+    else:
+        raise ValueError("Unknown method %s" % method)
+
+    if chunks > 1:
+        return _parallel_block_banded_solve(A, B, y, chunks, pool, solve)
+    return solve(A, B, y)
+
+
+def _parallel_block_banded_solve(A, B, y, chunks, pool, solve):
+    """
+    Solve independent chunks of the plates of block_banded_solve in parallel.
+    """
+
+    plates_VC = utils.broadcasted_shape(np.shape(A)[:-3],
+                                        np.shape(B)[:-3])
+    plates_y = utils.broadcasted_shape(plates_VC,
+                                       np.shape(y)[:-2])
+
+    # Split along the longest plate axis
+    if len(plates_y) == 0 or max(plates_y) == 1:
+        return solve(A, B, y)
+    axis = int(np.argmax(plates_y))
+    chunks = min(chunks, plates_y[axis])
+    limits = np.linspace(0, plates_y[axis], chunks+1).astype(int)
+    slices = [slice(start, end) 
+              for (start, end) in zip(limits[:-1], limits[1:])]
+
+    def _axis(ndim_plates):
+        # The split axis in an array with the given number of plate axes
+        return axis - (len(plates_y) - ndim_plates)
+
+    def _is_split(X, ndim):
+        ax = _axis(np.ndim(X) - ndim)
+        return ax >= 0 and np.shape(X)[ax] > 1
+
+    def _split(X, ndim):
+        if not _is_split(X, ndim):
+            return len(slices) * [X]
+        index = [slice(None)] * np.ndim(X)
+        parts = []
+        for s in slices:
+            index[_axis(np.ndim(X) - ndim)] = s
+            parts.append(X[tuple(index)])
+        return parts
+
+    def _combine(parts, ndim_plates, split):
+        if not split:
+            # The result is identical for all chunks
+            return parts[0]
+        return np.concatenate(parts, axis=_axis(ndim_plates))
+
+    A = np.asarray(A)
+    B = np.asarray(B)
+    y = np.asarray(y)
+    split_VC = _is_split(A, 3) or _is_split(B, 3)
+    args = (_split(A, 3), _split(B, 3), _split(y, 2))
+
+    if isinstance(pool, str):
+        if pool == 'thread':
+            executor = futures.ThreadPoolExecutor(max_workers=chunks)
+        elif pool == 'process':
+            executor = futures.ProcessPoolExecutor(max_workers=chunks)
+        else:
+            raise ValueError("Unknown pool type %s" % pool)
+        with executor:
+            results = list(executor.map(solve, *args))
+    else:
+        results = list(pool.map(solve, *args))
+
+    (V, C, x, ldet) = zip(*results)
+    return (_combine(V, len(plates_VC), split_VC),
+            _combine(C, len(plates_VC), split_VC),
+            _combine(x, len(plates_y), True),
+            _combine(ldet, len(plates_VC), split_VC))
+
+
+def _block_banded_solve(A, B, y):
+    """
+    Serial implementation of block_banded_solve.
+    """
     
     # Number of time instance and dimensionality
     N = np.shape(y)[-2]
@@ -378,9 +673,11 @@ def block_banded_solve(A, B, y):
     plates_y = utils.broadcasted_shape(plates_VC,
                                        np.shape(y)[:-2])
                       
-    V = np.empty(plates_VC+(N,D,D))
-    C = np.empty(plates_VC+(N-1,D,D))
-    x = np.empty(plates_y+(N,D))
+    # Keep single precision inputs in single precision
+    dtype = np.result_type(A, B, y, np.float32)
+    V = np.empty(plates_VC+(N,D,D), dtype=dtype)
+    C = np.empty(plates_VC+(N-1,D,D), dtype=dtype)
+    x = np.empty(plates_y+(N,D), dtype=dtype)
 
     #
     # Forward recursion
@@ -435,4 +732,139 @@ def block_banded_solve(A, B, y):
         V[...,n,:,:] = 0.5 * (V[...,n,:,:] + utils.T(V[...,n,:,:]))
 
     return (V, C, x, ldet)
+
+
+def _cyclic_block_banded_solve(A, B, y):
+    """
+    Cyclic reduction implementation of block_banded_solve.
+
+    The odd blocks are eliminated, which gives a block-banded system of half
+    the size for the even blocks.  After solving the reduced system
+    recursively, the solution and the inverse blocks of the odd blocks are
+    recovered.  Each level is vectorized over the blocks.
+    """
+
+    # Number of time instance and dimensionality
+    N = np.shape(y)[-2]
+    D = np.shape(y)[-1]
+
+    # Check the shapes of the blocks
+    if np.shape(A)[-3] != N:
+        raise ValueError("The number of diagonal blocks is incorrect")
+    if np.shape(A)[-2:] != (D,D):
+        raise ValueError("The diagonal blocks have wrong shape")
+    if np.shape(B)[-3] != N-1:
+        raise ValueError("The number of super-diagonal blocks is incorrect")
+    if np.shape(B)[-2:] != (D,D):
+        raise ValueError("The diagonal blocks have wrong shape")
+
+    plates_VC = utils.broadcasted_shape(np.shape(A)[:-3],
+                                        np.shape(B)[:-3])
+    plates_y = utils.broadcasted_shape(plates_VC,
+                                       np.shape(y)[:-2])
+
+    A = np.broadcast_to(A, plates_VC+(N,D,D))
+    B = np.broadcast_to(B, plates_VC+(N-1,D,D))
+    y = np.broadcast_to(y, plates_y+(N,D))
+
+    return _cyclic_reduction(A, B, y)
+
+
+def _cyclic_reduction(A, B, y):
+    """
+    Recursion of the cyclic reduction for block-banded systems.
+    """
+
+    N = np.shape(A)[-3]
+    D = np.shape(A)[-1]
+    plates = np.shape(A)[:-3]
+    plates_y = np.shape(y)[:-2]
+    dtype = np.result_type(A, B, y, np.float32)
+
+    if N <= 2:
+        # Solve small systems as dense matrices
+        J = np.empty(plates+(N,D,N,D), dtype=dtype)
+        J[...,:,:,0,:] = 0
+        J[...,:,:,-1,:] = 0
+        for n in range(N):
+            J[...,n,:,n,:] = A[...,n,:,:]
+        if N == 2:
+            J[...,0,:,1,:] = B[...,0,:,:]
+            J[...,1,:,0,:] = utils.T(B[...,0,:,:])
+        J = np.reshape(J, plates+(N*D,N*D))
+        L = np.linalg.cholesky(J)
+        ldet = 2*np.sum(_log_diag(L), axis=-1)
+        invJ = np.reshape(np.linalg.inv(J), plates+(N,D,N,D))
+        V = np.empty(plates+(N,D,D), dtype=dtype)
+        for n in range(N):
+            V[...,n,:,:] = invJ[...,n,:,n,:]
+        C = np.array(invJ[...,:N-1,:,1:,:])
+        C = np.reshape(C, plates+(N-1,D,D))
+        x = np.einsum('...ikjl,...jl->...ik', invJ, y)
+        return (V, C, x, ldet)
+
+    if N % 2 == 0:
+        # Add an independent block with an identity matrix so that the number
+        # of blocks is odd and each odd block has two even neighbours
+        I = np.identity(D) * np.ones(plates+(1,D,D), dtype=dtype)
+        A = np.concatenate([A, I], axis=-3)
+        B = np.concatenate([B, np.zeros(plates+(1,D,D), dtype=dtype)], axis=-3)
+        y = np.concatenate([y, np.zeros(plates_y+(1,D), dtype=dtype)], axis=-2)
+        (V, C, x, ldet) = _cyclic_reduction(A, B, y)
+        return (V[...,:-1,:,:], C[...,:-1,:,:], x[...,:-1,:], ldet)
+
+    # Odd blocks and their links to the previous and the next even blocks
+    A_odd = A[...,1::2,:,:]
+    B_prev = B[...,0::2,:,:]
+    B_next = B[...,1::2,:,:]
+
+    # Eliminate the odd blocks
+    L = np.linalg.cholesky(A_odd)
+    ldet = 2*np.sum(_log_diag(L), axis=(-1,-2))
+    invA_odd = np.linalg.inv(A_odd)
+    G_prev = mmdot(invA_odd, utils.T(B_prev))
+    G_next = mmdot(invA_odd, B_next)
+    z = mvdot(invA_odd, y[...,1::2,:])
+
+    # The reduced system for the even blocks
+    A_even = np.array(A[...,0::2,:,:])
+    A_even[...,:-1,:,:] -= mmdot(B_prev, G_prev)
+    A_even[...,1:,:,:] -= mmdot(utils.T(B_next), G_next)
+    A_even = 0.5 * (A_even + utils.T(A_even))
+    B_even = -mmdot(B_prev, G_next)
+    y_even = np.array(y[...,0::2,:])
+    y_even[...,:-1,:] -= mvdot(B_prev, z)
+    y_even[...,1:,:] -= mvdot(utils.T(B_next), z)
+
+    (V_even, C_even, x_even, ldet_even) = _cyclic_reduction(A_even, 
+                                                            B_even, 
+                                                            y_even)
+
+    # Recover the odd blocks of the solution
+    x_odd = (z 
+             - mvdot(G_prev, x_even[...,:-1,:]) 
+             - mvdot(G_next, x_even[...,1:,:]))
+
+    # Recover the odd blocks of the inverse
+    S_prev = -(mmdot(G_prev, V_even[...,:-1,:,:]) 
+               + mmdot(G_next, utils.T(C_even)))
+    S_next = -(mmdot(G_prev, C_even) 
+               + mmdot(G_next, V_even[...,1:,:,:]))
+    V_odd = (invA_odd 
+             - mmdot(S_prev, utils.T(G_prev)) 
+             - mmdot(S_next, utils.T(G_next)))
+    V_odd = 0.5 * (V_odd + utils.T(V_odd))
+
+    # Interleave the even and the odd blocks
+    V = np.empty(plates+(N,D,D), dtype=dtype)
+    V[...,0::2,:,:] = V_even
+    V[...,1::2,:,:] = V_odd
+    C = np.empty(plates+(N-1,D,D), dtype=dtype)
+    C[...,0::2,:,:] = utils.T(S_prev)
+    C[...,1::2,:,:] = S_next
+    x = np.empty(np.shape(x_even)[:-2]+(N,D), dtype=dtype)
+    x[...,0::2,:] = x_even
+    x[...,1::2,:] = x_odd
+
+    return (V, C, x, ldet + ldet_even)
     
@@ -277,7 +277,7 @@ def categorical(p, size=None):
 
     return z
 
-def alpha_beta_recursion(logp0, logP):
+def alpha_beta_recursion(logp0, logP, offsets=None, states=None):
     """
     Compute alpha-beta recursion for Markov chain
 
@@ -287,27 +287,180 @@ def alpha_beta_recursion(logp0, logP):
 
     logp0 = log P(z_0) + log P(y_0|z_0)
     logP[...,n,:,:] = log P(z_{n+1}|z_n) + log P(y_{n+1}|z_{n+1})
+
+    If `offsets` is given, the transition matrices and the resulting pairwise
+    marginals are in the banded representation of `utils.band_indices`, that
+    is, only the transitions from z_n=i to z_{n+1}=i+offsets[m] are allowed.
+    The cost of the recursion is then linear in the number of allowed
+    transitions.
+
+    If the length of the chain is given by `states`, `logP` may have a
+    singleton time axis.  The same transition matrix is then used for all
+    transitions without making copies of it.
+
+    The recursions are run with scaled probabilities and the log-space
+    recursions are used only if the scaled recursions underflow.
     """
 
     logp0 = utils.atleast_nd(logp0, 1)
     logP = utils.atleast_nd(logP, 3)
     
     D = np.shape(logp0)[-1]
-    N = np.shape(logP)[-3]
+    if offsets is None:
+        M = D
+    else:
+        M = len(offsets)
+
+    # Broadcast the transition matrices but not the time axis
+    logP = np.broadcast_to(logP, np.shape(logP)[:-2] + (D,M))
+
+    if states is None:
+        N = np.shape(logP)[-3]
+    else:
+        N = states - 1
+        if np.shape(logP)[-3] not in (1, N):
+            raise ValueError("The number of transition matrices (%d) does "
+                             "not match the length of the chain (%d)"
+                             % (np.shape(logP)[-3],
+                                states))
+
+    if N == 0:
+        # A chain of one state has no transitions
+        plates = utils.broadcasted_shape(np.shape(logp0)[:-1],
+                                         np.shape(logP)[:-3])
+        logp0 = np.broadcast_to(logp0, plates + (D,))
+        g = utils.logsumexp(logp0, axis=-1)
+        z0 = np.exp(logp0 - g[...,None])
+        zz = np.zeros(plates + (0,D,M), dtype=z0.dtype)
+        return (z0, zz, -g)
+
+    result = _scaled_alpha_beta_recursion(logp0, logP, offsets=offsets, N=N)
+    if result is None:
+        logP = np.broadcast_to(logP, np.shape(logP)[:-3] + (N,D,M))
+        if offsets is None:
+            result = _log_alpha_beta_recursion(logp0, logP)
+        else:
+            logP = utils.banded_to_dense(logP, offsets, fill=-np.inf)
+            (z0, zz, g) = _log_alpha_beta_recursion(logp0, logP)
+            result = (z0, utils.dense_to_banded(zz, offsets), g)
+    return result
+
+def _scaled_alpha_beta_recursion(logp0, logP, offsets=None, N=None):
+    """
+    Compute alpha-beta recursion using scaled probabilities
+
+    The transition matrices are exponentiated once after subtracting the
+    maximum of each matrix, and the forward and backward messages are
+    normalized at each step. The normalizers give the cumulant generating
+    function. The pairwise marginals are computed in place in the buffer of
+    the transition matrices unless a single transition matrix is shared by
+    all the N transitions. Returns None if the scaled recursion underflows.
+    """
+
+    D = np.shape(logp0)[-1]
+    (T, _, M) = np.shape(logP)[-3:]
+    if N is None:
+        N = T
     plates = utils.broadcasted_shape(np.shape(logp0)[:-1], np.shape(logP)[:-3])
 
-    if np.shape(logP)[-2:] != (D,D):
-        raise ValueError("Dimension mismatch %s != %s"
-                         % (np.shape(logP)[-2:],
-                            (D,D)))
+    if offsets is None:
+        def forward(a, P):
+            return np.einsum('...i,...ij->...j', a, P)
+        def backward(P, b):
+            return np.einsum('...ij,...j->...i', P, b)
+    else:
+        (cols, valid) = utils.band_indices(D, offsets)
+        def forward(a, P):
+            return utils.banded_column_sum(a[...,:,None] * P, offsets)
+        def backward(P, b):
+            return np.einsum('...ij,...ij->...i', P, b[...,cols])
+
+    # Single precision inputs are kept in single precision but the
+    # normalizers are accumulated in double precision
+    dtype = np.result_type(logp0, logP, np.float32)
+
+    # Scaled transition probabilities (T is either N or one)
+    P = np.empty(plates+(T,D,M), dtype=dtype)
+    P[...] = logP
+    if offsets is not None:
+        P[...,~valid] = -np.inf
+    s = np.amax(P, axis=(-1,-2), keepdims=True)
+    if not np.all(np.isfinite(s)):
+        return None
+    P -= s
+    np.exp(P, out=P)
+    def transition(n):
+        return P[...,n if T > 1 else 0,:,:]
+
+    # Scaled initial probabilities
+    m0 = np.amax(logp0, axis=-1, keepdims=True)
+    if not np.all(np.isfinite(m0)):
+        return None
+    p0 = np.exp(logp0 - m0)
+
+    # Allocate memory
+    alpha = np.empty(plates+(N,D), dtype=dtype)
+    beta = np.empty(plates+(N,D), dtype=dtype)
+    logc = np.zeros(plates)
+
+    # Forward recursion
+    alpha[...,0,:] = p0 / np.sum(p0, axis=-1, keepdims=True)
+    for n in range(1,N+1):
+        a = forward(alpha[...,n-1,:], transition(n-1))
+        c = np.sum(a, axis=-1, keepdims=True)
+        if not np.all(c > 0):
+            return None
+        logc += np.log(c[...,0])
+        if n < N:
+            np.divide(a, c, out=alpha[...,n,:])
+
+    # Backward recursion
+    beta[...,N-1,:] = 1
+    for n in reversed(range(N-1)):
+        b = backward(transition(n+1), beta[...,n+1,:])
+        c = np.sum(b, axis=-1, keepdims=True)
+        if not np.all(c > 0):
+            return None
+        np.divide(b, c, out=beta[...,n,:])
+
+    # Pairwise marginals
+    if T == N:
+        zz = P
+        zz *= alpha[...,:,:,None]
+    else:
+        zz = alpha[...,:,:,None] * P
+    if offsets is None:
+        zz *= beta[...,:,None,:]
+    else:
+        zz *= beta[...,:,cols]
+    zz /= np.sum(zz, axis=(-1,-2), keepdims=True)
+
+    z0 = np.sum(zz[...,0,:,:], axis=-1)
+
+    g = -(m0[...,0]
+          + np.log(np.sum(p0, axis=-1))
+          + (N // T) * np.sum(s[...,0,0], axis=-1)
+          + logc)
+
+    return (z0, zz, g)
+
+def _log_alpha_beta_recursion(logp0, logP):
+    """
+    Compute alpha-beta recursion in log-space
+    """
+
+    D = np.shape(logp0)[-1]
+    N = np.shape(logP)[-3]
+    plates = utils.broadcasted_shape(np.shape(logp0)[:-1], np.shape(logP)[:-3])
 
     #
     # Run the recursion algorithm
     #
 
     # Allocate memory
-    logalpha = np.zeros(plates+(N,D))
-    logbeta = np.zeros(plates+(N,D))
+    dtype = np.result_type(logp0, logP, np.float32)
+    logalpha = np.zeros(plates+(N,D), dtype=dtype)
+    logbeta = np.zeros(plates+(N,D), dtype=dtype)
     g = np.zeros(plates)
 
     # Forward recursion
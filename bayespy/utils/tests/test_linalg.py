@@ -25,6 +25,8 @@
 Unit tests for bayespy.utils.utils module.
 """
 
+from concurrent import futures
+
 import numpy as np
 
 from ..utils import TestCase
@@ -127,6 +129,136 @@ class TestDot(TestCase):
                           [[1,2,3],
                            [4,5,6]])
 
+class TestCholesky(TestCase):
+
+    def test_cholesky(self):
+        """
+        Test the batched Cholesky decomposition
+        """
+
+        A = np.random.randn(4,3,3)
+        C = np.einsum('nij,nkj->nik', A, A) + 3*np.identity(3)
+        L = linalg.Cholesky(C)
+
+        # Vectors with broadcasted plates
+        b = np.random.randn(3)
+        x = np.linalg.solve(C, np.tile(b, (4,1))[...,None])[...,0]
+        self.assertAllClose(L.solve(b), x)
+        # Solving uses the factors, not the inverse
+        self.assertIsNone(L._inv)
+
+        self.assertAllClose(L.inv(),
+                            np.linalg.inv(C))
+        self.assertAllClose(L.logdet(),
+                            np.linalg.slogdet(C)[1])
+        # Matrices
+        B = np.random.randn(4,3,2)
+        self.assertAllClose(L.solve(B, matrix=True),
+                            np.linalg.solve(C, B))
+
+        # Not positive definite
+        self.assertRaises(np.linalg.LinAlgError,
+                          linalg.Cholesky,
+                          -C)
+
+        pass
+
+    def test_cholesky_unique(self):
+        """
+        Test that equal matrices are factorized only once
+        """
+
+        A = np.random.randn(2,3,3)
+        C = np.einsum('nij,nkj->nik', A, A) + 3*np.identity(3)
+
+        # Duplicate matrices in arbitrary plates
+        C_dup = C[[0,1,1,0,1]]
+        L = linalg.Cholesky(C_dup, unique=True)
+        self.assertEqual(np.shape(L.L), (2,3,3))
+        self.assertAllClose(L.inv(), np.linalg.inv(C_dup))
+        self.assertAllClose(L.logdet(), np.linalg.slogdet(C_dup)[1])
+        b = np.random.randn(5,3)
+        self.assertAllClose(L.solve(b),
+                            np.linalg.solve(C_dup, b[...,None])[...,0])
+
+        # Matrices equal along a plate axis are kept broadcasted
+        C_bc = np.broadcast_to(C[:,None], (2,4,3,3))
+        L = linalg.Cholesky(C_bc)
+        self.assertEqual(np.shape(L.L), (2,1,3,3))
+        b = np.random.randn(2,4,3)
+        self.assertAllClose(L.solve(b),
+                            np.linalg.solve(C_bc, b[...,None])[...,0])
+        self.assertAllClose(L.logdet() * np.ones((2,4)),
+                            np.linalg.slogdet(C_bc)[1])
+
+        # Equal but not broadcasted matrices are searched only on request
+        C_rep = np.tile(C[:,None], (1,4,1,1))
+        L = linalg.Cholesky(C_rep, unique=True)
+        self.assertEqual(np.shape(L.L), (2,1,3,3))
+        L = linalg.Cholesky(C_rep)
+        self.assertEqual(np.shape(L.L), (2,4,3,3))
+
+        # Without looking for duplicates
+        L = linalg.Cholesky(C_dup)
+        self.assertEqual(np.shape(L.L), (5,3,3))
+
+        pass
+
+    def test_chol_plates(self):
+        """
+        Test Cholesky helpers on collections of matrices
+        """
+
+        A = np.random.randn(2,4,3,3)
+        C = np.einsum('...ij,...kj->...ik', A, A) + 3*np.identity(3)
+        U = linalg.chol(C)
+        self.assertAllClose(np.einsum('...ji,...jk->...ik', U, U),
+                            C)
+        self.assertAllClose(U, np.triu(U))
+        self.assertAllClose(linalg.chol_inv(U),
+                            np.linalg.inv(C))
+
+        # Vectors with broadcasted plates
+        b = np.random.randn(4,3)
+        x = np.linalg.solve(C, (b*np.ones((2,4,3)))[...,None])[...,0]
+        self.assertAllClose(linalg.chol_solve(U, b), x)
+        self.assertAllClose(utils.m_chol_solve(utils.m_chol(C), b), x)
+        # Matrices
+        B = np.random.randn(2,4,3,5)
+        self.assertAllClose(linalg.chol_solve(U, B, matrix=True),
+                            np.linalg.solve(C, B))
+
+        # Triangular systems
+        self.assertAllClose(linalg.solve_triangular(U, b),
+                            np.linalg.solve(U, (b*np.ones((2,4,3)))[...,None])[...,0])
+        L = np.swapaxes(U, -1, -2)
+        self.assertAllClose(linalg.solve_triangular(U, b, trans='T'),
+                            linalg.solve_triangular(L, b, lower=True))
+        # Only the triangle is used
+        U_full = U + np.tril(np.random.randn(3,3), -1)
+        self.assertAllClose(linalg.chol_solve(U_full, b), x)
+        self.assertAllClose(linalg.chol_inv(U_full), np.linalg.inv(C))
+
+        # Large matrices
+        A = np.random.randn(2,80,80)
+        C = np.einsum('...ij,...kj->...ik', A, A) + 80*np.identity(80)
+        U = linalg.chol(C)
+        b = np.random.randn(80)
+        x = np.linalg.solve(C, (b*np.ones((2,80)))[...,None])[...,0]
+        self.assertAllClose(linalg.chol_solve(U, b), x)
+        self.assertAllClose(linalg.chol_inv(U), np.linalg.inv(C))
+        self.assertAllClose(linalg.solve_triangular(U, b, trans='T'),
+                            linalg.solve_triangular(np.swapaxes(U, -1, -2),
+                                                    b, 
+                                                    lower=True))
+
+        # Not positive definite
+        self.assertRaises(np.linalg.LinAlgError,
+                          linalg.chol,
+                          -C)
+
+        pass
+
 class TestBandedSolve(TestCase):
 
     def test_block_banded_solve(self):
@@ -198,3 +330,123 @@ class TestBandedSolve(TestCase):
         # Check the log determinant
         self.assertAlmostEqual(ldet/np.linalg.slogdet(C)[1], 1)
 
+
+    def test_parallel_block_banded_solve(self):
+        """
+        Test that parallel chunks over the plates give identical results.
+        """
+
+        np.random.seed(42)
+
+        def random_system(plates_A, plates_B, plates_y, N=10, D=3):
+            W = np.random.randn(*(plates_A + (N,D,2*D)))
+            A = linalg.dot(W, utils.T(W)) + 10*np.identity(D)
+            B = np.random.randn(*(plates_B + (N-1,D,D)))
+            y = np.random.randn(*(plates_y + (N,D)))
+            return (A, B, y)
+
+        def check(plates_A, plates_B, plates_y, chunks, pool='thread'):
+            (A, B, y) = random_system(plates_A, plates_B, plates_y)
+            serial = linalg.block_banded_solve(A, B, y)
+            parallel = linalg.block_banded_solve(A, B, y,
+                                                 chunks=chunks,
+                                                 pool=pool)
+            for (x_serial, x_parallel) in zip(serial, parallel):
+                self.assertEqual(np.shape(x_parallel), np.shape(x_serial))
+                np.testing.assert_array_equal(x_parallel, x_serial)
+
+        check((6,), (6,), (6,), 3)
+        check((5,), (5,), (5,), 2)
+        check((2,), (2,), (2,), 2)
+        # More chunks than plates
+        check((3,), (3,), (3,), 8)
+        # Split along the longest axis
+        check((2,7), (2,7), (2,7), 3)
+        # Broadcasting over plates
+        check((), (), (6,), 3)
+        check((1,), (6,), (6,), 2)
+        check((4,1), (4,1), (1,5), 2)
+        check((4,1), (4,1), (4,5), 3)
+        # No plates
+        check((), (), (), 2)
+        # Process pool
+        check((4,), (4,), (4,), 2, pool='process')
+        # Existing executor
+        with futures.ThreadPoolExecutor(max_workers=2) as executor:
+            check((4,), (4,), (4,), 2, pool=executor)
+
+        pass
+
+    def test_cyclic_block_banded_solve(self):
+        """
+        Test the cyclic reduction against the sequential algorithm.
+        """
+
+        np.random.seed(42)
+
+        def check(plates_A, plates_B, plates_y, N, D):
+            W = np.random.randn(*(plates_A + (N,D,2*D)))
+            A = linalg.dot(W, utils.T(W)) + 3*np.identity(D)
+            B = 0.5 * np.random.randn(*(plates_B + (N-1,D,D)))
+            y = np.random.randn(*(plates_y + (N,D)))
+            sequential = linalg.block_banded_solve(A, B, y)
+            cyclic = linalg.block_banded_solve(A, B, y, method='cyclic')
+            for (x_sequential, x_cyclic) in zip(sequential, cyclic):
+                self.assertAllClose(x_cyclic, x_sequential)
+
+        # Different number of blocks (odd, even, powers of two)
+        for N in [1, 2, 3, 4, 5, 8, 17, 40]:
+            check((), (), (), N, 2)
+        # Plates and broadcasting
+        check((3,), (3,), (3,), 10, 3)
+        check((), (), (4,), 13, 2)
+        check((2,1), (2,1), (2,5), 9, 2)
+        # Together with parallel chunks
+        (A, B, y) = (3*np.identity(2) * np.ones((4,7,2,2)),
+                     0.5*np.ones((4,6,2,2)),
+                     np.random.randn(4,7,2))
+        sequential = linalg.block_banded_solve(A, B, y)
+        cyclic = linalg.block_banded_solve(A, B, y, chunks=2, method='cyclic')
+        for (x_sequential, x_cyclic) in zip(sequential, cyclic):
+            self.assertAllClose(x_cyclic, x_sequential)
+
+        self.assertRaises(ValueError,
+                          linalg.block_banded_solve,
+                          A, B, y, method='foo')
+
+        pass
+
+
+def check_performance():
+    """
+    Compare the batched Cholesky helpers to a loop over the plates.
+
+    This is not a unit test (not run automatically), but rather a
+    performance test, which you may run to see the speedup of factorizing
+    and solving all plates at once.
+    """
+
+    import time
+    import scipy.linalg
+
+    for (plates, D) in [((1000,), 3),
+                        ((100,10), 10),
+                        ((10,), 50),
+                        ((), 200)]:
+        A = np.random.randn(*(plates + (D,D)))
+        C = np.einsum('...ij,...kj->...ik', A, A) + D*np.identity(D)
+        b = np.random.randn(*(plates + (D,)))
+
+        t = time.time()
+        x = np.empty(plates + (D,))
+        for i in np.ndindex(*plates):
+            x[i] = scipy.linalg.cho_solve(scipy.linalg.cho_factor(C[i]),
+                                          b[i])
+        t_loop = time.time() - t
+
+        t = time.time()
+        y = linalg.chol_solve(linalg.chol(C), b)
+        t_batch = time.time() - t
+
+        print("plates=%s D=%d: loop %.4fs, batched %.4fs, max error %.1e"
+              % (plates, D, t_loop, t_batch, np.max(np.abs(x-y))))
@@ -237,3 +237,52 @@ class TestAlphaBetaRecursion(utils.TestCase):
                         msg="Nans in results, algorithm not stable")
 
         pass
+
+    def test_scaled(self):
+        """
+        Test that the scaled and log-space recursions give the same results
+        """
+
+        np.random.seed(42)
+
+        def check(logp0, logP, f=random.alpha_beta_recursion):
+            y = f(logp0, logP)
+            x = random._log_alpha_beta_recursion(logp0, logP)
+            for (yi, xi) in zip(y, x):
+                self.assertAllClose(yi, xi)
+
+        # Random chains with plates and broadcasting
+        logp0 = np.random.randn(3, 1, 4)
+        logP = 10 * np.random.randn(2, 20, 4, 4)
+        check(logp0, logP, f=random._scaled_alpha_beta_recursion)
+        check(logp0, logP)
+
+        # Long chain with large magnitudes
+        logp0 = np.random.randn(3)
+        logP = 1e3 * np.random.randn(500, 3, 3)
+        check(logp0, logP)
+
+        # Banded transition matrices
+        offsets = [-1, 0, 2]
+        logp0 = np.random.randn(2, 5)
+        logP = np.random.randn(2, 30, 5, 3)
+        logP[...,1,1] = -np.inf
+        (z0, zz, g) = random.alpha_beta_recursion(logp0, logP,
+                                                  offsets=offsets)
+        check(logp0, utils.banded_to_dense(logP, offsets, fill=-np.inf))
+        (z0_d, zz_d, g_d) = random.alpha_beta_recursion(
+            logp0,
+            utils.banded_to_dense(logP, offsets, fill=-np.inf))
+        self.assertAllClose(z0, z0_d)
+        self.assertAllClose(zz, utils.dense_to_banded(zz_d, offsets))
+        self.assertAllClose(g, g_d)
+
+        # Underflow in the scaled recursion falls back to log-space
+        logp0 = np.array([-1e5, -np.inf])
+        logP = np.array(10*[[[-np.inf, 1e5],
+                             [1e0, -np.inf]]])
+        self.assertEqual(random._scaled_alpha_beta_recursion(logp0, logP),
+                         None)
+        check(logp0, logP)
+
+        pass
@@ -389,6 +389,233 @@ class TestLogSumExp(utils.TestCase):
 
         pass
 
+class TestEinsumPath(utils.TestCase):
+
+    def test_einsum_path(self):
+        """
+        Test pairwise contractions of sum-products
+        """
+
+        def check(keys_in, keys_out, *shapes):
+            X = [np.random.randn(*shape) for shape in shapes]
+            path = utils.einsum_path(shapes, keys_in, keys_out)
+            self.assertEqual(len(path), max(len(shapes)-1, 0))
+            args = utils.zipper_merge(X, keys_in) + [keys_out]
+            self.assertAllClose(utils.einsum_with_path(path, X, 
+                                                       keys_in, 
+                                                       keys_out),
+                                np.einsum(*args))
+
+        # Chain of matrix products
+        check([[0,1], [1,2], [2,3], [3,4]], [0,4],
+              (2,3), (3,4), (4,5), (5,6))
+        # Vector-matrix-vector with plates and broadcasting
+        check([[9,0], [1,0,2], [9,2]], [9],
+              (4,3), (1,3,3), (4,3))
+        # Sum over all axes
+        check([[0], [0], [0]], [],
+              (3,), (3,), (3,))
+        # Scalars
+        check([[], [], []], [],
+              (), (), ())
+        # Single operand
+        check([[0,1]], [1],
+              (2,3))
+
+        # The small intermediate result is computed first
+        path = utils.einsum_path([(100,100), (100,100), (100,)],
+                                 [[0,1], [1,2], [2]],
+                                 [0])
+        self.assertEqual(path[0][2], [1])
+
+        pass
+
+    def test_matmul_plan(self):
+        """
+        Test the recognition of matrix products in sum-products
+        """
+
+        def check(keys_a, keys_b, keys_out, shape_a, shape_b, plan):
+            self.assertEqual(utils.matmul_plan(shape_a, keys_a,
+                                               shape_b, keys_b,
+                                               keys_out),
+                             plan)
+            if plan is not None:
+                a = np.random.randn(*shape_a)
+                b = np.random.randn(*shape_b)
+                self.assertAllClose(utils.matmul_sum_product(a, keys_a,
+                                                             b, keys_b,
+                                                             keys_out,
+                                                             plan),
+                                    np.einsum(a, keys_a, b, keys_b, keys_out))
+
+        # Inner product
+        check([0], [0], [], (3,), (3,), ([], [], [], [0]))
+        # Matrix-vector product
+        check([0,1], [1], [0], (4,3), (3,), ([], [0], [], [1]))
+        # Matrix-matrix product with transposed output
+        check([0,1], [1,2], [2,0], (4,3), (3,5), ([], [0], [2], [1]))
+        # Inner products over broadcasted plates form a matrix product
+        check([9,8,0], [9,8,0], [9,8], (4,1,3), (1,5,3),
+              ([], [9], [8], [0]))
+        # Axes not in the output are summed
+        check([0,1], [1,2], [2], (4,3), (3,5), ([], [], [2], [1]))
+        # Outer product
+        check([0], [1], [0,1], (4,), (3,), None)
+        # Small batched products are left for einsum
+        check([9,0,1], [9,1,2], [9,0,2], (10,3,3), (10,3,3), None)
+        # Large batched products use BLAS
+        check([9,0,1], [9,1,2], [9,0,2], (2,20,20), (2,20,20), 
+              ([9], [0], [2], [1]))
+
+        pass
+
+    def test_einsum_path_size(self):
+        """
+        Test the size of the largest array in a contraction
+        """
+
+        # Outer product of vectors
+        path = utils.einsum_path([(4,), (3,)], [[0], [1]], [0,1])
+        self.assertEqual(utils.einsum_path_size(path,
+                                                [(4,), (3,)],
+                                                [[0], [1]]),
+                         12)
+        # The matrix passed to BLAS is the largest array
+        path = utils.einsum_path([(10,5), (5,20), (20,)],
+                                 [[0,1], [1,2], [2]],
+                                 [0])
+        self.assertEqual(utils.einsum_path_size(path,
+                                                [(10,5), (5,20), (20,)],
+                                                [[0,1], [1,2], [2]]),
+                         100)
+
+        pass
+
+class TestOuterProduct(utils.TestCase):
+
+    def test_outer_product(self):
+        """
+        Test the implicit outer product
+        """
+
+        class Implicit(utils.OuterProduct):
+            # Fail if the outer product is computed explicitly
+            def __array__(self, dtype=None):
+                raise RuntimeError("Outer product computed explicitly")
+
+        x = np.random.randn(4,3)
+        xx = np.einsum('ni,nj->nij', x, x)
+        X = utils.OuterProduct(x)
+        self.assertEqual(np.shape(X), (4,3,3))
+        self.assertEqual(np.ndim(X), 3)
+        self.assertAllClose(np.asarray(X), xx)
+        self.assertAllClose(-X, -xx)
+        self.assertAllClose(2*X - xx, xx)
+
+        # Slicing plates keeps the product implicit
+        self.assertIsInstance(X[1:3,:,:], utils.OuterProduct)
+        self.assertAllClose(np.asarray(X[1:3,:,:]), xx[1:3])
+        self.assertAllClose(X[1,0], xx[1,0])
+
+        # Sum-products use the factors
+        A = np.random.randn(3,3)
+        self.assertAllClose(utils.sum_multiply(Implicit(x), A, axis=(-1,-2)),
+                            np.einsum('nij,ij->n', xx, A))
+        self.assertAllClose(utils.get_diag(Implicit(x)),
+                            x**2)
+        self.assertAllClose(utils.get_diag(Implicit(x, ndim=0), ndim=0),
+                            x**2)
+
+        # Array methods are not computed from the explicit array
+        for name in ['sum', 'reshape', 'T', 'copy']:
+            self.assertRaises(AttributeError, getattr, X, name)
+
+        # Multi-dimensional arrays
+        x = np.random.randn(4,2,3)
+        X = utils.OuterProduct(x, ndim=2)
+        self.assertEqual(np.shape(X), (4,2,3,2,3))
+        self.assertAllClose(np.asarray(X), 
+                            np.einsum('nij,nkl->nijkl', x, x))
+        self.assertAllClose(utils.get_diag(X, ndim=2), x**2)
+
+        pass
+
+    def test_diagonal_matrix(self):
+        """
+        Test the implicit diagonal array
+        """
+
+        d = np.random.rand(4,3)
+        D = np.einsum('ni,ij->nij', d, np.identity(3))
+        X = utils.DiagonalMatrix(d)
+        self.assertEqual(np.shape(X), (4,3,3))
+        self.assertAllClose(np.asarray(X), D)
+        self.assertAllClose(utils.get_diag(X), d)
+        self.assertAllClose(utils.m_dot(X, d), d**2)
+
+        # Scaling and sums keep the array diagonal
+        self.assertIsInstance(2*X + X, utils.DiagonalMatrix)
+        self.assertAllClose(np.asarray(-0.5*X - X), -1.5*D)
+        self.assertAllClose(X + np.ones((3,3)), D + 1)
+        for name in ['sum', 'reshape', 'T', 'copy']:
+            self.assertRaises(AttributeError, getattr, X, name)
+
+        # Sum-products use the diagonal
+        A = np.random.randn(3,3)
+        self.assertAllClose(utils.sum_multiply(X, A, axis=(-1,-2)),
+                            np.einsum('nij,ij->n', D, A))
+
+        # Multi-dimensional arrays
+        d = np.random.rand(4,2,3)
+        X = utils.DiagonalMatrix(d, ndim=2)
+        self.assertAllClose(np.asarray(X), utils.diag(d, ndim=2))
+
+        pass
+
+class TestBanded(utils.TestCase):
+
+    def test_banded(self):
+        """
+        Test the conversions between dense and banded matrices
+        """
+
+        X = np.array([[1, 2, 3],
+                      [4, 5, 6],
+                      [7, 8, 9]])
+
+        # Main diagonal and the first super-diagonal
+        Y = utils.dense_to_banded(X, [0, 1])
+        self.assertAllClose(Y,
+                            [[1, 2],
+                             [5, 6],
+                             [9, 0]])
+        self.assertAllClose(utils.banded_to_dense(Y, [0, 1]),
+                            [[1, 2, 0],
+                             [0, 5, 6],
+                             [0, 0, 9]])
+        self.assertAllClose(utils.banded_column_sum(Y, [0, 1]),
+                            [1, 7, 15])
+
+        # Sub-diagonal with plates and a custom fill value
+        Y = utils.dense_to_banded([X, 2*X], [-1], fill=-1)
+        self.assertAllClose(Y,
+                            [[[-1], [4], [8]],
+                             [[-1], [8], [16]]])
+        self.assertAllClose(utils.banded_to_dense(Y[0], [-1], fill=-1),
+                            [[-1, -1, -1],
+                             [4, -1, -1],
+                             [-1, 8, -1]])
+
+        # The type of the dense matrices follows the elements and the fill
+        Y = utils.dense_to_banded(np.float32(X), [0, 1])
+        self.assertEqual(utils.banded_to_dense(Y, [0, 1]).dtype, np.float32)
+        Y = utils.dense_to_banded(X > 4, [0, 1], fill=False)
+        self.assertEqual(utils.banded_to_dense(Y, [0, 1], fill=False).dtype,
+                         bool)
+
+        pass
+
 class TestMean(utils.TestCase):
 
     def test_mean(self):
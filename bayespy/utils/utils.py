@@ -116,21 +116,91 @@ def unique(l):
 def tempfile(prefix='', suffix=''):
     return tmp.NamedTemporaryFile(prefix=prefix, suffix=suffix).name
 
-def write_to_hdf5(group, data, name):
+# Approximate size of the chunks of HDF5 datasets in bytes
+_HDF5_CHUNK_BYTES = 2**16
+
+def _hdf5_chunks(shape, itemsize, growing=False):
+    """
+    Choose the chunk shape of an HDF5 dataset.
+
+    The chunks have at most about _HDF5_CHUNK_BYTES bytes and they are split
+    along the leading axes.  The first axis of a growing dataset is chunked
+    by the chunk size instead of its current length, thus appending to a
+    short dataset does not create tiny chunks.  Returns None for scalars and
+    empty arrays, which can not be chunked.
+    """
+    if len(shape) == 0 or (not growing and 0 in shape):
+        return None
+    chunks = [max(n, 1) for n in shape]
+    if growing:
+        chunks[0] = None
+    for axis in range(len(chunks)):
+        rest = itemsize * int(np.prod(chunks[axis+1:]))
+        n = max(_HDF5_CHUNK_BYTES // rest, 1)
+        if chunks[axis] is None or chunks[axis] > n:
+            chunks[axis] = n
+        if rest <= _HDF5_CHUNK_BYTES:
+            break
+    return tuple(chunks)
+
+def write_to_hdf5(group, data, name, compression='gzip'):
     """
     Writes the given array into the HDF5 file.
+
+    An existing dataset with the same shape and type is overwritten in place,
+    otherwise a new chunked and (optionally) compressed dataset is created.
     """
+    data = np.asarray(data)
+    if name in group:
+        dataset = group[name]
+        if dataset.shape == data.shape and dataset.dtype == data.dtype:
+            dataset[...] = data
+            return
+        del group[name]
+    chunks = _hdf5_chunks(data.shape, data.dtype.itemsize)
+    if chunks is None:
+        # Chunks and compression don't work for scalars and empty arrays
+        group.create_dataset(name, data=data)
+        return
     try:
-        # Try using compression. It doesn't work for scalars.
+        # Try using chunks and compression
         group.create_dataset(name, 
                              data=data, 
-                             compression='gzip')
+                             chunks=chunks,
+                             compression=compression)
     except TypeError:
         group.create_dataset(name, 
                              data=data)
     except ValueError:
         raise ValueError('Could not write %s' % data)
 
+def append_to_hdf5(group, data, name, compression='gzip'):
+    """
+    Writes a growing array into the HDF5 file by appending to the dataset.
+
+    The elements along the first axis which already exist in the dataset are
+    assumed to be unchanged and only the new elements are written.
+    """
+    data = np.asarray(data)
+    if name in group:
+        dataset = group[name]
+        if (dataset.maxshape[0] is None
+            and dataset.shape[1:] == data.shape[1:]
+            and dataset.shape[0] <= data.shape[0]
+            and dataset.dtype == data.dtype):
+            n = dataset.shape[0]
+            dataset.resize(data.shape[0], axis=0)
+            dataset[n:] = data[n:]
+            return
+        del group[name]
+    group.create_dataset(name,
+                         data=data,
+                         maxshape=(None,) + data.shape[1:],
+                         chunks=_hdf5_chunks(data.shape, 
+                                             data.dtype.itemsize,
+                                             growing=True),
+                         compression=compression)
+
 
 def nans(size=()):
     return np.tile(np.nan, size)
@@ -419,6 +489,218 @@ def sum_to_dim(A, dim):
         A = np.sum(A, axis=axes)
     return A
 
+class ImplicitArray():
+    """
+    Base class for arrays with a structure that is not stored explicitly.
+
+    Sum-products (`sum_multiply` and `SumMultiply`) replace the array by the
+    factors given by `factors`.  Indexing, arithmetic and NumPy functions
+    compute the explicit array on demand.  NumPy array methods (e.g., `sum`
+    or `reshape`) are not available, so use the corresponding functions
+    explicitly.  Sub-classes implement `shape`, `factors` and `__array__`.
+    """
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def factors(self, keys):
+        """
+        Return the factors and their keys for the keys of the array.
+        """
+        raise NotImplementedError()
+
+    def __array__(self, dtype=None):
+        raise NotImplementedError()
+
+    def __getitem__(self, index):
+        return np.asarray(self)[index]
+
+    def __neg__(self):
+        return -np.asarray(self)
+
+    def __add__(self, other):
+        return np.asarray(self) + other
+
+    def __radd__(self, other):
+        return other + np.asarray(self)
+
+    def __sub__(self, other):
+        return np.asarray(self) - other
+
+    def __rsub__(self, other):
+        return other - np.asarray(self)
+
+    def __mul__(self, other):
+        return np.asarray(self) * other
+
+    def __rmul__(self, other):
+        return other * np.asarray(self)
+
+    def __truediv__(self, other):
+        return np.asarray(self) / other
+
+class OuterProduct(ImplicitArray):
+    """
+    Implicit outer product of an array with itself.
+
+    Represents the array x*x.T over the last `ndim` axes of x without
+    computing it.  Slicing the plate axes (leading axes) keeps the product
+    implicit.
+    """
+
+    def __init__(self, x, ndim=1):
+        self.x = np.asanyarray(x)
+        self.ndim_outer = ndim
+        if np.ndim(self.x) < ndim:
+            raise ValueError("The array does not have enough axes")
+
+    @property
+    def plates(self):
+        return np.shape(self.x)[:(np.ndim(self.x)-self.ndim_outer)]
+
+    @property
+    def dims(self):
+        return np.shape(self.x)[(np.ndim(self.x)-self.ndim_outer):]
+
+    @property
+    def shape(self):
+        return self.plates + self.dims + self.dims
+
+    @property
+    def dtype(self):
+        return self.x.dtype
+
+    def factors(self, keys):
+        keys = list(keys)
+        n = self.ndim_outer
+        plate_keys = keys[:(len(keys)-2*n)]
+        keys1 = keys[(len(keys)-2*n):(len(keys)-n)]
+        keys2 = keys[(len(keys)-n):]
+        return [(self.x, plate_keys + keys1), (self.x, plate_keys + keys2)]
+
+    def diagonal(self):
+        """
+        Return the diagonal, that is, the squared elements of x.
+        """
+        return self.x**2
+
+    def __array__(self, dtype=None):
+        n = self.ndim_outer
+        x1 = np.reshape(self.x, np.shape(self.x) + (1,)*n)
+        x2 = np.reshape(self.x, self.plates + (1,)*n + self.dims)
+        return np.asarray(x1 * x2, dtype=dtype)
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        n = len(self.plates)
+        if (len(index) == self.ndim 
+            and all(isinstance(i, slice) for i in index[:n])
+            and all(i == slice(None) for i in index[n:])):
+            return OuterProduct(self.x[index[:n]], ndim=self.ndim_outer)
+        return np.asarray(self)[index]
+
+class DiagonalMatrix(ImplicitArray):
+    """
+    Implicit diagonal array.
+
+    Represents the diagonal array given by the diagonal elements d (see
+    `diag`) without storing the off-diagonal zeros.  Scaling by scalars and
+    adding other diagonal arrays keeps the array implicit.
+    """
+
+    def __init__(self, d, ndim=1):
+        self.d = np.asanyarray(d)
+        self.ndim_diag = ndim
+        if np.ndim(self.d) < ndim:
+            raise ValueError("The array does not have enough axes")
+
+    @property
+    def plates(self):
+        return np.shape(self.d)[:(np.ndim(self.d)-self.ndim_diag)]
+
+    @property
+    def dims(self):
+        return np.shape(self.d)[(np.ndim(self.d)-self.ndim_diag):]
+
+    @property
+    def shape(self):
+        return self.plates + self.dims + self.dims
+
+    @property
+    def dtype(self):
+        return self.d.dtype
+
+    def factors(self, keys):
+        keys = list(keys)
+        n = self.ndim_diag
+        plate_keys = keys[:(len(keys)-2*n)]
+        keys1 = keys[(len(keys)-2*n):(len(keys)-n)]
+        keys2 = keys[(len(keys)-n):]
+        return [(self.d, plate_keys + keys1), 
+                (identity(*self.dims), keys1 + keys2)]
+
+    def diagonal(self):
+        return self.d
+
+    def __array__(self, dtype=None):
+        return np.asarray(diag(self.d, ndim=self.ndim_diag), dtype=dtype)
+
+    def __add__(self, other):
+        if (isinstance(other, DiagonalMatrix) 
+            and other.ndim_diag == self.ndim_diag):
+            return DiagonalMatrix(self.d + other.d, ndim=self.ndim_diag)
+        return np.asarray(self) + other
+
+    def __sub__(self, other):
+        if (isinstance(other, DiagonalMatrix) 
+            and other.ndim_diag == self.ndim_diag):
+            return DiagonalMatrix(self.d - other.d, ndim=self.ndim_diag)
+        return np.asarray(self) - other
+
+    def __neg__(self):
+        return DiagonalMatrix(-self.d, ndim=self.ndim_diag)
+
+    def __mul__(self, other):
+        if np.ndim(other) == 0:
+            return DiagonalMatrix(other * self.d, ndim=self.ndim_diag)
+        return np.asarray(self) * other
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+def astype(x, dtype):
+    """
+    Cast a floating point array to the given floating point type.
+
+    Implicit arrays are kept implicit.  Arrays of other types (e.g.,
+    integers) are returned as they are.
+    """
+    if isinstance(x, DiagonalMatrix):
+        return DiagonalMatrix(astype(x.d, dtype), ndim=x.ndim_diag)
+    if isinstance(x, OuterProduct):
+        return OuterProduct(astype(x.x, dtype), ndim=x.ndim_outer)
+    x = np.asanyarray(x)
+    if not np.issubdtype(x.dtype, np.floating) or x.dtype == dtype:
+        return x
+    return x.astype(dtype)
+
+def expand_implicit_arrays(operands, keys_in):
+    """
+    Replace implicit arrays in a sum-product by their factors.
+    """
+    (operands_out, keys_out) = ([], [])
+    for (x, keys) in zip(operands, keys_in):
+        if isinstance(x, ImplicitArray):
+            for (factor, factor_keys) in x.factors(keys):
+                operands_out.append(factor)
+                keys_out.append(factor_keys)
+        else:
+            operands_out.append(x)
+            keys_out.append(keys)
+    return (operands_out, keys_out)
+
 def sum_multiply(*args, axis=None, sumaxis=True, keepdims=False):
 
     # Computes sum(arg[0]*arg[1]*arg[2]*..., axis=axes_to_sum) without
@@ -469,9 +751,20 @@ def sum_multiply(*args, axis=None, sumaxis=True, keepdims=False):
     # Output axes are those which are not summed
     pairs.append(axes)
 
+    # Use the factors of implicit arrays
+    (args, keys) = expand_implicit_arrays(args, pairs[1:-1:2])
+    pairs = zipper_merge(args, keys) + [axes]
+
     # Compute the sum-product
     try:
-        y = np.einsum(*pairs)
+        if len(args) > 2:
+            # Contract pairwise in a good order
+            path = einsum_path([np.shape(arg) for arg in args],
+                               pairs[1:-1:2],
+                               axes)
+            y = einsum_with_path(path, args, pairs[1:-1:2], axes)
+        else:
+            y = np.einsum(*pairs)
     except ValueError as err:
         if str(err) == ("If 'op_axes' or 'itershape' is not NULL in "
                         "theiterator constructor, 'oa_ndim' must be greater "
@@ -500,6 +793,229 @@ def sum_multiply(*args, axis=None, sumaxis=True, keepdims=False):
 
     return y
 
+def einsum_path(shapes, keys_in, keys_out):
+    """
+    Find a pairwise contraction order for a sum-product of several arrays.
+
+    The operands are given by their shapes and axis keys similarly to the
+    list format of numpy.einsum.  The order is found greedily: at each step,
+    the pair of operands which gives the smallest intermediate result is
+    contracted.  The axes which are not needed by the remaining operands nor
+    the output are summed as early as possible.
+
+    Returns a list of (i, j, keys, matmul) tuples: operands i and j are
+    removed from the list of operands and their product with axes `keys` is
+    appended to the list.  If `matmul` is not None, the product is computed
+    as a matrix product (see `matmul_plan`).  Use `einsum_with_path` to
+    evaluate the sum-product.
+    """
+
+    # The sizes of the axes (taking broadcasting into account)
+    sizes = {}
+    for (shape, keys) in zip(shapes, keys_in):
+        for (key, size) in zip(keys, shape):
+            sizes[key] = max(sizes.get(key, 1), size)
+
+    def size_of(keys):
+        return functools.reduce(lambda a, b: a*b, 
+                                [sizes[key] for key in keys], 
+                                1)
+
+    def contract(i, j, keys):
+        # Contract operands i and j and find the shape of the result
+        size_i = dict(zip(keys_in[i], shapes[i]))
+        size_j = dict(zip(keys_in[j], shapes[j]))
+        shape = tuple(max(size_i.get(key, 1), size_j.get(key, 1))
+                      for key in keys)
+        plan = matmul_plan(shapes[i], keys_in[i], shapes[j], keys_in[j], keys)
+        path.append((i, j, keys, plan))
+        return shape
+
+    keys_in = [list(keys) for keys in keys_in]
+    shapes = [tuple(shape) for shape in shapes]
+    path = []
+    while len(keys_in) > 2:
+        best = None
+        for (i, j) in itertools.combinations(range(len(keys_in)), 2):
+            # Keys needed after contracting operands i and j
+            needed = set(keys_out)
+            for (k, keys) in enumerate(keys_in):
+                if k != i and k != j:
+                    needed.update(keys)
+            keys = [key for key in unique(keys_in[i] + keys_in[j])
+                    if key in needed]
+            cost = (size_of(keys), size_of(unique(keys_in[i]+keys_in[j])))
+            if best is None or cost < best[0]:
+                best = (cost, i, j, keys)
+        (_, i, j, keys) = best
+        shape = contract(i, j, keys)
+        keys_in = ([keys_in[k] 
+                    for k in range(len(keys_in)) 
+                    if k != i and k != j] 
+                   + [keys])
+        shapes = ([shapes[k] 
+                   for k in range(len(shapes)) 
+                   if k != i and k != j] 
+                  + [shape])
+
+    if len(keys_in) == 2:
+        contract(0, 1, list(keys_out))
+
+    return path
+
+# Matrix products smaller than this (for each plate) are computed with einsum
+# because of the overhead of calling BLAS for each plate
+MATMUL_MIN_SIZE = 1000
+
+def matmul_plan(shape_a, keys_a, shape_b, keys_b, keys_out):
+    """
+    Find how to compute a sum-product of two arrays as a matrix product.
+
+    The axes are classified as batch axes (in both arrays and the output),
+    the rows (only in the first array and the output), the columns (only in
+    the second array and the output) and the contracted axes (in both arrays
+    but not in the output).  Thus, inner products, matrix-vector products,
+    matrix-matrix products and their batched versions are all handled.
+
+    Returns the keys of the four groups or None if nothing is contracted or
+    the matrices would be too small for BLAS to be beneficial.
+    """
+    size_a = dict(zip(keys_a, shape_a))
+    size_b = dict(zip(keys_b, shape_b))
+    (batch, rows, cols, inner) = ([], [], [], [])
+    for key in unique(list(keys_a) + list(keys_b)):
+        m = size_a.get(key, 1)
+        n = size_b.get(key, 1)
+        if m > 1 and n > 1:
+            if m != n:
+                return None
+            if key in keys_out:
+                batch.append(key)
+            else:
+                inner.append(key)
+        elif m > 1 and key in keys_out:
+            rows.append(key)
+        elif n > 1 and key in keys_out:
+            cols.append(key)
+
+    if len(inner) == 0:
+        return None
+
+    def size_of(keys):
+        return functools.reduce(lambda x, y: x*y, 
+                                [max(size_a.get(key, 1), size_b.get(key, 1))
+                                 for key in keys],
+                                1)
+
+    if (len(batch) > 0 
+        and size_of(rows) * size_of(cols) * size_of(inner) < MATMUL_MIN_SIZE):
+        return None
+
+    return (batch, rows, cols, inner)
+
+def matmul_sum_product(a, keys_a, b, keys_b, keys_out, plan):
+    """
+    Compute a sum-product of two arrays as a matrix product.
+
+    The axes are grouped as given by `matmul_plan`.
+    """
+    (batch, rows, cols, inner) = plan
+    sizes = dict(zip(keys_a, np.shape(a)))
+    for (key, size) in zip(keys_b, np.shape(b)):
+        sizes[key] = max(sizes.get(key, 1), size)
+    shape_batch = tuple(sizes[key] for key in batch)
+    shape_rows = tuple(sizes[key] for key in rows)
+    shape_cols = tuple(sizes[key] for key in cols)
+    M = int(np.prod(shape_rows))
+    N = int(np.prod(shape_cols))
+    K = int(np.prod([sizes[key] for key in inner]))
+
+    # Transpose (and sum the axes which are not needed) and reshape to
+    # matrices
+    a = np.einsum(a, keys_a, batch + rows + inner)
+    b = np.einsum(b, keys_b, batch + inner + cols)
+    a = np.reshape(a, shape_batch + (M,K))
+    b = np.reshape(b, shape_batch + (K,N))
+
+    if len(batch) == 0:
+        y = np.dot(a, b)
+    else:
+        y = np.matmul(a, b)
+
+    # Reorder the axes as in the output
+    y = np.reshape(y, shape_batch + shape_rows + shape_cols)
+    keys_y = batch + rows + cols
+    y = np.einsum(y, keys_y, [key for key in keys_out if key in keys_y])
+    return np.reshape(y, tuple(sizes[key] for key in keys_out))
+
+def einsum_path_size(path, shapes, keys_in):
+    """
+    Compute the number of elements in the largest array of a contraction.
+
+    The arrays include the intermediate results and the copies made for
+    matrix products when the contraction path given by `einsum_path` is
+    evaluated.
+    """
+    shapes = [tuple(shape) for shape in shapes]
+    keys_in = [list(keys) for keys in keys_in]
+    largest = 0
+    for (i, j, keys, plan) in path:
+        sizes = dict(zip(keys_in[i], shapes[i]))
+        for (key, size) in zip(keys_in[j], shapes[j]):
+            sizes[key] = max(sizes.get(key, 1), size)
+        def size_of(keys):
+            return int(np.prod([sizes[key] for key in keys]))
+        shape = tuple(sizes[key] for key in keys)
+        largest = max(largest, size_of(keys))
+        if plan is not None:
+            (batch, rows, cols, inner) = plan
+            largest = max(largest,
+                          size_of(batch + rows + inner),
+                          size_of(batch + inner + cols))
+        shapes = ([shapes[k] 
+                   for k in range(len(shapes)) 
+                   if k != i and k != j] 
+                  + [shape])
+        keys_in = ([keys_in[k] 
+                    for k in range(len(keys_in)) 
+                    if k != i and k != j] 
+                   + [keys])
+    return largest
+
+def einsum_with_path(path, operands, keys_in, keys_out):
+    """
+    Evaluate a sum-product of several arrays using a contraction order.
+
+    The contraction order is given by `einsum_path`.
+    """
+    operands = list(operands)
+    keys_in = [list(keys) for keys in keys_in]
+    for (i, j, keys, plan) in path:
+        if plan is not None:
+            y = matmul_sum_product(operands[i], keys_in[i],
+                                   operands[j], keys_in[j],
+                                   keys,
+                                   plan)
+        elif np.ndim(operands[i]) == 0 and np.ndim(operands[j]) == 0:
+            # NumPy's einsum fails if all the operands are scalars
+            y = np.multiply(operands[i], operands[j])
+        else:
+            y = np.einsum(operands[i], keys_in[i],
+                          operands[j], keys_in[j],
+                          keys)
+        operands = ([operands[k] 
+                     for k in range(len(operands)) 
+                     if k != i and k != j] 
+                    + [y])
+        keys_in = ([keys_in[k] 
+                    for k in range(len(keys_in)) 
+                    if k != i and k != j] 
+                   + [keys])
+    if len(operands) == 1:
+        # Sum over the axes not in the output
+        return np.einsum(operands[0], keys_in[0], list(keys_out))
+    return operands[-1]
+
 def sum_product(*args, axes_to_keep=None, axes_to_sum=None, keepdims=False):
     if axes_to_keep is not None:
         return sum_multiply(*args, 
@@ -581,6 +1097,10 @@ def is_shape_subset(sub_shape, full_shape):
 
 
 def add_leading_axes(x, n):
+    if isinstance(x, DiagonalMatrix):
+        return DiagonalMatrix(add_leading_axes(x.d, n), ndim=x.ndim_diag)
+    if isinstance(x, OuterProduct):
+        return OuterProduct(add_leading_axes(x.x, n), ndim=x.ndim_outer)
     shape = (1,)*n + np.shape(x)
     return np.reshape(x, shape)
     
@@ -625,6 +1145,22 @@ def squeeze(X):
         shape = shape[inds[0]:]
     return np.reshape(X, shape)
     
+def take_block(x, axis, start, end):
+    """
+    Take the block `start:end` of an axis (negative index) of an array.
+
+    If the array does not have the axis or the axis is broadcasted (i.e., has
+    unit length), the array is returned as it is.  The array can be any object
+    supporting NumPy indexing, such as `np.memmap` or `h5py.Dataset`, in which
+    case only the block is read into memory.
+    """
+    shape = np.shape(x)
+    if -axis > len(shape) or shape[axis] == 1:
+        return x
+    index = [slice(None)] * len(shape)
+    index[axis] = slice(start, end)
+    return x[tuple(index)]
+
 def squeeze_to_dim(X, dim):
     s = tuple(range(np.ndim(X)-dim))
     return np.squeeze(X, axis=s)
@@ -738,144 +1274,43 @@ def logdet_chol(U):
         return np.sum(np.log(U.D()))
 
 def m_solve_triangular(U, B, **kwargs):
-    # Allocate memory
-    U = np.atleast_2d(U)
-    B = np.atleast_1d(B)
-    sh_u = U.shape[:-2]
-    sh_b = B.shape[:-1]
-    l_u = len(sh_u)
-    l_b = len(sh_b)
-
-    # Check which axis are iterated over with B along with U
-    ind_b = [Ellipsis] * l_b
-    l_min = min(l_u, l_b)
-    jnd_b = tuple(i for i in range(-l_min,0) if sh_b[i]==sh_u[i])
-
-    # Shape of the result (broadcasting rules)
-    sh = broadcasted_shape(sh_u, sh_b)
-    #out = np.zeros(np.shape(B))
-    out = np.zeros(sh + B.shape[-1:])
-    ## if out == None:
-    ##     # Shape of the result (broadcasting rules)
-    ##     sh = broadcasted_shape(sh_u, sh_b)
-    ##     #out = np.zeros(np.shape(B))
-    ##     out = np.zeros(sh + B.shape[-1:])
-    for i in nested_iterator(np.shape(U)[:-2]):
-
-        # The goal is to run triangular solver once for all vectors of
-        # B for which the matrices of U are the same (according to the
-        # broadcasting rules). Thus, we collect all the axes of B for
-        # which U is singleton and form them as a 2-D matrix and then
-        # run the solver once.
-        
-        # Select those axes of B for which U and B are not singleton
-        for j in jnd_b:
-            ind_b[j] = i[j]
-            
-        # Collect all the axes for which U is singleton
-        b = B[tuple(ind_b) + (Ellipsis,)]
-
-        # Reshape it to a 2-D (or 1-D) array
-        orig_shape = b.shape
-        if b.ndim > 1:
-            b = b.reshape((-1, b.shape[-1]))
-
-        # Ellipsis to all preceeding axes and ellipsis for the last
-        # axis:
-        if len(ind_b) < len(sh):
-            ind_out = (Ellipsis,) + tuple(ind_b) + (Ellipsis,)
-        else:
-            ind_out = tuple(ind_b) + (Ellipsis,)
+    """
+    Solve triangular systems for a collection of matrices.
+
+    See :func:`bayespy.utils.linalg.solve_triangular`.
+    """
+    from . import linalg
+    return linalg.solve_triangular(U, B, **kwargs)
 
-        #print('utils.m_solve_triangular', np.shape(U[i]), np.shape(b))
-        out[ind_out] = linalg.solve_triangular(U[i],
-                                               b.T,
-                                               **kwargs).T.reshape(orig_shape)
-        #out[ind_out] = out[ind_out].T.reshape(orig_shape)
 
-        
-    return out
-    
-    
 def m_chol(C):
-    # Computes Cholesky decomposition for a collection of matrices.
-    # The last two axes of C are considered as the matrix.
-    C = np.atleast_2d(C)
-    U = np.empty(np.shape(C))
-    #print('m_chol', C)
-    for i in nested_iterator(np.shape(U)[:-2]):
-        try:
-            U[i] = linalg.cho_factor(C[i])[0]
-        except np.linalg.linalg.LinAlgError:
-            print(C[i])
-            raise Exception("Matrix not positive definite")
-    return U
+    """
+    Compute Cholesky decomposition for a collection of matrices.
 
+    See :func:`bayespy.utils.linalg.chol`.
+    """
+    from . import linalg
+    return linalg.chol(C)
 
-def m_chol_solve(U, B, out=None):
 
-    
-    # Allocate memory
-    U = np.atleast_2d(U)
-    B = np.atleast_1d(B)
-    sh_u = U.shape[:-2]
-    sh_b = B.shape[:-1]
-    l_u = len(sh_u)
-    l_b = len(sh_b)
-
-    # Check which axis are iterated over with B along with U
-    ind_b = [Ellipsis] * l_b
-    l_min = min(l_u, l_b)
-    jnd_b = tuple(i for i in range(-l_min,0) if sh_b[i]==sh_u[i])
-
-    if out == None:
-        # Shape of the result (broadcasting rules)
-        sh = broadcasted_shape(sh_u, sh_b)
-        #out = np.zeros(np.shape(B))
-        out = np.zeros(sh + B.shape[-1:])
-    for i in nested_iterator(np.shape(U)[:-2]):
-
-        # The goal is to run Cholesky solver once for all vectors of B
-        # for which the matrices of U are the same (according to the
-        # broadcasting rules). Thus, we collect all the axes of B for
-        # which U is singleton and form them as a 2-D matrix and then
-        # run the solver once.
-        
-        # Select those axes of B for which U and B are not singleton
-        for j in jnd_b:
-            ind_b[j] = i[j]
-            
-        # Collect all the axes for which U is singleton
-        b = B[tuple(ind_b) + (Ellipsis,)]
-
-        # Reshape it to a 2-D (or 1-D) array
-        orig_shape = b.shape
-        if b.ndim > 1:
-            b = b.reshape((-1, b.shape[-1]))
-
-        # Ellipsis to all preceeding axes and ellipsis for the last
-        # axis:
-        if len(ind_b) < len(sh):
-            ind_out = (Ellipsis,) + tuple(ind_b) + (Ellipsis,)
-        else:
-            ind_out = tuple(ind_b) + (Ellipsis,)
+def m_chol_solve(U, B, out=None):
+    """
+    Solve linear systems using Cholesky factors of a collection of matrices.
 
-        out[ind_out] = linalg.cho_solve((U[i], False),
-                                        b.T).T.reshape(orig_shape)
+    See :func:`bayespy.utils.linalg.chol_solve`.
+    """
+    from . import linalg
+    return linalg.chol_solve(U, B, out=out)
 
-        
-    return out
-    
 
 def m_chol_inv(U):
-    # Allocate memory
-    V = np.tile(np.identity(np.shape(U)[-1]), np.shape(U)[:-2]+(1,1))
-    for i in nested_iterator(np.shape(U)[:-2]):
-        V[i] = linalg.cho_solve((U[i], False),
-                                V[i],
-                                overwrite_b=True) # This would need Fortran order
-        
-    return V
+    """
+    Invert a collection of matrices using their Cholesky factors.
+
+    See :func:`bayespy.utils.linalg.chol_inv`.
+    """
+    from . import linalg
+    return linalg.chol_inv(U)
     
 
 def m_chol_logdet(U):
@@ -906,6 +1341,11 @@ def get_diag(X, ndim=1):
 
     If ndim>1, take the diagonal of the last 2*ndim axes.
     """
+    if isinstance(X, OuterProduct) and X.ndim_outer == ndim:
+        return X.diagonal()
+    if isinstance(X, DiagonalMatrix) and X.ndim_diag == ndim:
+        return X.diagonal()
+
     if ndim == 0:
         return X
 
@@ -951,6 +1391,8 @@ def m_dot(A,b):
     
     #b = reshape(b, shape(b)[:-1] + (1,) + shape(b)[-1:])
     #return np.dot(A, b)
+    if isinstance(A, DiagonalMatrix):
+        return A.d * b
     return np.einsum('...ik,...k->...i', A, b)
     # TODO: Use einsum!!
     #return np.sum(A*b[...,np.newaxis,:], axis=(-1,))
@@ -1021,6 +1463,66 @@ def block_banded(D, B):
     
 
 
+def band_indices(D, offsets):
+    """
+    Return the dense column indices of banded matrices.
+
+    A banded representation of DxD matrices has shape (..., D, M), where
+    element [...,i,m] corresponds to element [...,i,i+offsets[m]] of the dense
+    matrix. Returns the (clipped) column indices and a boolean array telling
+    which elements are inside the dense matrix.
+    """
+    offsets = np.asarray(offsets, dtype=int)
+    cols = np.arange(D)[:,None] + offsets[None,:]
+    valid = (cols >= 0) & (cols < D)
+    return (np.clip(cols, 0, D-1), valid)
+
+def dense_to_banded(X, offsets, fill=0):
+    """
+    Extract the given diagonals of matrices in the last two axes.
+
+    See `band_indices` for the banded representation. Elements outside the
+    dense matrix are set to `fill`.
+    """
+    X = atleast_nd(X, 2)
+    D = np.shape(X)[-1]
+    X = np.broadcast_to(X, np.shape(X)[:-2] + (D,D))
+    (cols, valid) = band_indices(D, offsets)
+    Y = X[...,np.arange(D)[:,None],cols]
+    Y[...,~valid] = fill
+    return Y
+
+def banded_to_dense(X, offsets, fill=0):
+    """
+    Construct dense matrices from banded representation.
+
+    See `band_indices` for the banded representation. Elements outside the
+    band are set to `fill`.
+    """
+    X = np.asanyarray(X)
+    D = np.shape(X)[-2]
+    (cols, valid) = band_indices(D, offsets)
+    rows = np.arange(D)[:,None] * np.ones(np.shape(cols), dtype=int)
+    Y = np.empty(np.shape(X)[:-1] + (D,), dtype=np.result_type(X, fill))
+    Y[...] = fill
+    Y[...,rows[valid],cols[valid]] = X[...,valid]
+    return Y
+
+def banded_column_sum(X, offsets):
+    """
+    Sum banded matrices over the rows.
+
+    Computes sum(Y, axis=-2) for the dense matrices Y without constructing
+    them. See `band_indices` for the banded representation.
+    """
+    X = np.asanyarray(X)
+    D = np.shape(X)[-2]
+    offsets = np.asarray(offsets, dtype=int)
+    rows = np.arange(D)[:,None] - offsets[None,:]
+    valid = (rows >= 0) & (rows < D)
+    Y = X[...,np.clip(rows, 0, D-1),np.arange(len(offsets))]
+    return np.einsum('...ij,ij->...i', Y, valid.astype(float))
+
 def kalman_filter(y, U, A, V, mu0, Cov0, out=None):
     """
     Perform Kalman filtering to obtain filtered mean and covariance.